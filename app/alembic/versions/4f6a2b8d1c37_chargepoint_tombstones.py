@@ -0,0 +1,31 @@
+"""ChargePoint tombstones
+
+Revision ID: 4f6a2b8d1c37
+Revises: 9d4b7e2c1a85
+Create Date: 2026-10-18 19:21:08.402716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6a2b8d1c37'
+down_revision = '9d4b7e2c1a85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('charge_point_tombstone',
+    sa.Column('id', fastapi_users_db_sqlalchemy.guid.GUID(), nullable=False),
+    sa.Column('revision', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_charge_point_tombstone_revision'), 'charge_point_tombstone', ['revision'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_charge_point_tombstone_revision'), table_name='charge_point_tombstone')
+    op.drop_table('charge_point_tombstone')
@@ -0,0 +1,38 @@
+"""ChargePoint geo_cell
+
+Revision ID: 5b1f0c3d9a2e
+Revises: 08ee6b1168e8
+Create Date: 2026-10-18 09:12:31.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0c3d9a2e'
+down_revision = '08ee6b1168e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stored generated column, PostgreSQL backfills every existing row when it is added.
+    # Expression is `app.geo.cells.geo_cell_sql('longitude', 'latitude')` at the time of writing.
+    op.add_column('charge_point', sa.Column(
+        'geo_cell',
+        sa.Integer(),
+        sa.Computed(
+            '(LEAST(FLOOR((longitude + 90) / 0.25), 719) * 1440'
+            ' + LEAST(FLOOR((latitude + 180) / 0.25), 1439))::integer',
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index(op.f('ix_charge_point_geo_cell'), 'charge_point', ['geo_cell'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_charge_point_geo_cell'), table_name='charge_point')
+    op.drop_column('charge_point', 'geo_cell')
@@ -0,0 +1,111 @@
+"""ChargePoint clusters
+
+Revision ID: 9d4b7e2c1a85
+Revises: e3a4d6f19b27
+Create Date: 2026-10-18 16:05:42.731906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b7e2c1a85'
+down_revision = 'e3a4d6f19b27'
+branch_labels = None
+depends_on = None
+
+# Below is `app.geo.clusters` at the time of writing, with CLUSTER_MAX_ZOOM = 14 and
+# CELLS_PER_TILE = 4.
+# NOTE the `lat` attribute is stored in the "longitude" column and vice versa
+
+
+def _cells_sql(rows, sign):
+    return (
+        'SELECT z AS zoom,'
+        ' LEAST(FLOOR((r.longitude + 90) / (360.0 / (4 << z))), (4 << z) / 2 - 1)::integer AS y,'
+        ' LEAST(FLOOR((r.latitude + 180) / (360.0 / (4 << z))), (4 << z) - 1)::integer AS x,'
+        f' {sign} AS count, {sign} * r.longitude AS lat_sum, {sign} * r.latitude AS lng_sum'
+        f' FROM {rows} AS r CROSS JOIN generate_series(0, 14) AS z'
+    )
+
+
+def _apply_sql(cells):
+    return (
+        'INSERT INTO charge_point_cluster (zoom, y, x, count, lat_sum, lng_sum)'
+        ' SELECT zoom, y, x, SUM(count), SUM(lat_sum), SUM(lng_sum)'
+        f' FROM ({cells}) AS cells GROUP BY zoom, y, x ORDER BY zoom, y, x'
+        ' ON CONFLICT (zoom, y, x) DO UPDATE SET'
+        ' count = charge_point_cluster.count + excluded.count,'
+        ' lat_sum = charge_point_cluster.lat_sum + excluded.lat_sum,'
+        ' lng_sum = charge_point_cluster.lng_sum + excluded.lng_sum'
+    )
+
+
+def _prune_sql(rows):
+    return (
+        'DELETE FROM charge_point_cluster AS c'
+        f' USING ({_cells_sql(rows, "1")}) AS r'
+        ' WHERE c.zoom = r.zoom AND c.y = r.y AND c.x = r.x AND c.count = 0'
+    )
+
+
+MOVED = (
+    '(SELECT {side}.* FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id'
+    ' WHERE (n.longitude, n.latitude) IS DISTINCT FROM (o.longitude, o.latitude))'
+)
+MOVED_NEW, MOVED_OLD = MOVED.format(side='n'), MOVED.format(side='o')
+
+FUNCTION = f"""
+CREATE OR REPLACE FUNCTION charge_point_cluster_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_apply_sql(_cells_sql('new_rows', '1'))};
+    ELSIF TG_OP = 'UPDATE' THEN
+        {_apply_sql(_cells_sql(MOVED_NEW, '1') + ' UNION ALL ' + _cells_sql(MOVED_OLD, '-1'))};
+        {_prune_sql(MOVED_OLD)};
+    ELSIF TG_OP = 'DELETE' THEN
+        {_apply_sql(_cells_sql('old_rows', '-1'))};
+        {_prune_sql('old_rows')};
+    ELSE
+        TRUNCATE charge_point_cluster;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGERS = {
+    'charge_point_cluster_insert': 'AFTER INSERT ON charge_point REFERENCING NEW TABLE AS new_rows',
+    'charge_point_cluster_update': (
+        'AFTER UPDATE ON charge_point REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'
+    ),
+    'charge_point_cluster_delete': 'AFTER DELETE ON charge_point REFERENCING OLD TABLE AS old_rows',
+    'charge_point_cluster_truncate': 'AFTER TRUNCATE ON charge_point',
+}
+
+
+def upgrade():
+    op.create_table('charge_point_cluster',
+    sa.Column('zoom', sa.SmallInteger(), nullable=False),
+    sa.Column('y', sa.Integer(), nullable=False),
+    sa.Column('x', sa.Integer(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.Column('lat_sum', sa.Float(), nullable=False),
+    sa.Column('lng_sum', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('zoom', 'y', 'x')
+    )
+    # Hold off writes until the triggers are in place so the backfill misses nothing
+    op.execute('LOCK TABLE charge_point IN SHARE MODE')
+    op.execute(FUNCTION)
+    for name, when in TRIGGERS.items():
+        op.execute(f'CREATE TRIGGER {name} {when} FOR EACH STATEMENT EXECUTE FUNCTION charge_point_cluster_apply()')
+    op.execute(_apply_sql(_cells_sql('charge_point', '1')))
+
+
+def downgrade():
+    for name in TRIGGERS:
+        op.execute(f'DROP TRIGGER {name} ON charge_point')
+    op.execute('DROP FUNCTION charge_point_cluster_apply()')
+    op.drop_table('charge_point_cluster')
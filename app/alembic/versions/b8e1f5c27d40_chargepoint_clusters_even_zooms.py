@@ -0,0 +1,97 @@
+"""ChargePoint clusters of even zoom levels only
+
+Revision ID: b8e1f5c27d40
+Revises: 4f6a2b8d1c37
+Create Date: 2026-10-18 21:47:13.215804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e1f5c27d40'
+down_revision = '4f6a2b8d1c37'
+branch_labels = None
+depends_on = None
+
+# Below is `app.geo.clusters` at the time of writing, with CLUSTER_MAX_ZOOM = 14,
+# CELLS_PER_TILE = 4 and CLUSTER_ZOOM_STEP = 2, the odd zoom levels are merged from the
+# even ones when read. Downgrading stores every zoom level again.
+# NOTE the `lat` attribute is stored in the "longitude" column and vice versa
+
+
+def _cells_sql(rows, sign, zooms):
+    return (
+        'SELECT z AS zoom,'
+        ' LEAST(FLOOR((r.longitude + 90) / (360.0 / (4 << z))), (4 << z) / 2 - 1)::integer AS y,'
+        ' LEAST(FLOOR((r.latitude + 180) / (360.0 / (4 << z))), (4 << z) - 1)::integer AS x,'
+        f' {sign} AS count, {sign} * r.longitude AS lat_sum, {sign} * r.latitude AS lng_sum'
+        f' FROM {rows} AS r CROSS JOIN generate_series({zooms}) AS z'
+    )
+
+
+def _apply_sql(cells):
+    return (
+        'INSERT INTO charge_point_cluster (zoom, y, x, count, lat_sum, lng_sum)'
+        ' SELECT zoom, y, x, SUM(count), SUM(lat_sum), SUM(lng_sum)'
+        f' FROM ({cells}) AS cells GROUP BY zoom, y, x ORDER BY zoom, y, x'
+        ' ON CONFLICT (zoom, y, x) DO UPDATE SET'
+        ' count = charge_point_cluster.count + excluded.count,'
+        ' lat_sum = charge_point_cluster.lat_sum + excluded.lat_sum,'
+        ' lng_sum = charge_point_cluster.lng_sum + excluded.lng_sum'
+    )
+
+
+def _prune_sql(rows, zooms):
+    return (
+        'DELETE FROM charge_point_cluster AS c'
+        f' USING ({_cells_sql(rows, "1", zooms)}) AS r'
+        ' WHERE c.zoom = r.zoom AND c.y = r.y AND c.x = r.x AND c.count = 0'
+    )
+
+
+MOVED = (
+    '(SELECT {side}.* FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id'
+    ' WHERE (n.longitude, n.latitude) IS DISTINCT FROM (o.longitude, o.latitude))'
+)
+MOVED_NEW, MOVED_OLD = MOVED.format(side='n'), MOVED.format(side='o')
+
+EVEN_ZOOMS = '0, 14, 2'
+ALL_ZOOMS = '0, 14'
+ODD_ZOOMS = '1, 13, 2'
+
+
+def _function(zooms):
+    return f"""
+CREATE OR REPLACE FUNCTION charge_point_cluster_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_apply_sql(_cells_sql('new_rows', '1', zooms))};
+    ELSIF TG_OP = 'UPDATE' THEN
+        {_apply_sql(_cells_sql(MOVED_NEW, '1', zooms) + ' UNION ALL ' + _cells_sql(MOVED_OLD, '-1', zooms))};
+        {_prune_sql(MOVED_OLD, zooms)};
+    ELSIF TG_OP = 'DELETE' THEN
+        {_apply_sql(_cells_sql('old_rows', '-1', zooms))};
+        {_prune_sql('old_rows', zooms)};
+    ELSE
+        TRUNCATE charge_point_cluster;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade():
+    # Hold off writes so that none of them maintains the odd zoom levels once dropped
+    op.execute('LOCK TABLE charge_point IN SHARE MODE')
+    op.execute(_function(EVEN_ZOOMS))
+    op.execute('DELETE FROM charge_point_cluster WHERE zoom % 2 = 1')
+
+
+def downgrade():
+    op.execute('LOCK TABLE charge_point IN SHARE MODE')
+    op.execute(_function(ALL_ZOOMS))
+    op.execute(_apply_sql(_cells_sql('charge_point', '1', ODD_ZOOMS)))
@@ -0,0 +1,33 @@
+"""ChargePoint revision
+
+Revision ID: c7e2a91f4b60
+Revises: 5b1f0c3d9a2e
+Create Date: 2026-10-18 11:02:47.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a91f4b60'
+down_revision = '5b1f0c3d9a2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('revision',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.add_column('charge_point', sa.Column('revision', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_index(op.f('ix_charge_point_revision'), 'charge_point', ['revision'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_charge_point_revision'), table_name='charge_point')
+    op.drop_column('charge_point', 'revision')
+    op.drop_table('revision')
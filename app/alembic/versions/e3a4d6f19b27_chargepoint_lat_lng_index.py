@@ -0,0 +1,26 @@
+"""ChargePoint lat lng index
+
+Revision ID: e3a4d6f19b27
+Revises: c7e2a91f4b60
+Create Date: 2026-10-18 14:37:05.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import fastapi_users_db_sqlalchemy
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a4d6f19b27'
+down_revision = 'c7e2a91f4b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE the `lat` attribute is stored in the "longitude" column and vice versa
+    op.create_index('ix_charge_point_lat_lng', 'charge_point', ['longitude', 'latitude'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_charge_point_lat_lng', table_name='charge_point')
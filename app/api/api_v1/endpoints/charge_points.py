@@ -1,30 +1,118 @@
-from typing import List
+import asyncio
+from typing import AsyncIterator, List, Optional, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Body, HTTPException, Query
+from fastapi import APIRouter, Depends, Body, Header, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from app.api.deps.db import get_db
 from app.api.deps.user import current_active_user
 from app.api.deps.charge_point import get_charge_point_or_404
-from app.crud.charge_point import CRUDChargePoint
+from app.api.etag import collection_etag, item_etag, none_match, parse_if_match
+from app.api.responses import (
+    accepts_msgpack,
+    charge_point_bulk_results,
+    charge_point_changes_out,
+    charge_point_cluster_out,
+    charge_point_nearest_out,
+    charge_point_out,
+)
+from app.bulk import columnar
+from app.bulk.exporter import MEDIA_TYPES, MSGPACK, stream_charge_points
+from app.bulk.importer import CSV, NDJSON, ChargePointImporter, iter_lines
+from app.crud.charge_point import CRUDChargePoint, charge_point_changes
+from app.core.config import settings
+from app.db.exceptions import DoesNotExist, InvalidCursor, RevisionMismatch
+from app.geo.bbox import BBox, parse_bbox
+from app.geo.clusters import CLUSTER_MAX_ZOOM
 from app.models.user import User
-from app.schemas.charge_point import ChargePointSchema, ChargePointSchemaOut, ChargePointSchemaIn, ChargePointSchemaUpdate
+from app.schemas.charge_point import (
+    ChargePointBulkResult,
+    ChargePointChangesOut,
+    ChargePointClusterOut,
+    ChargePointImportReport,
+    ChargePointSchema,
+    ChargePointSchemaBulkDeleteIn,
+    ChargePointSchemaBulkUpdateIn,
+    ChargePointSchemaIn,
+    ChargePointSchemaNearestBatchIn,
+    ChargePointSchemaNearestOut,
+    ChargePointSchemaOut,
+    ChargePointSchemaUpdate,
+)
 
 router = APIRouter()
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TRUNCATED_HEADER = "X-Truncated"
+
+BBOX_DESCRIPTION = "`min_lng,min_lat,max_lng,max_lat`, `min_lng` greater than `max_lng` crosses the antimeridian."
+BBOX_EXAMPLE = "166.5,-20.5,170.5,-13"
+
+
+def _parse_bbox(bbox: str) -> BBox:
+    try:
+        return parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid bbox: {e}")
 
-@router.get("/nearest", status_code=status.HTTP_200_OK, response_model=ChargePointSchemaOut)
+
+@router.get(
+    "/nearest",
+    status_code=status.HTTP_200_OK,
+    response_model=Union[ChargePointSchemaOut, List[ChargePointSchemaNearestOut]],
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "No charge point within `max_km`, only without `k`.",
+        },
+    },
+)
 async def find_nearest_charge_point(
     db: AsyncSession = Depends(get_db),
     *,
     lat: float = Query(..., ge=-90, le=90),
     lng: float = Query(..., ge=-180, le=180),
-) -> ChargePointSchemaOut:
+    k: Optional[int] = Query(
+        None, ge=1, le=100,
+        description="Return a list of up to `k` charge points with their distances rather than the nearest one.",
+    ),
+    max_km: Optional[float] = Query(None, gt=0),
+) -> Response:
     crud_cp = CRUDChargePoint(db)
-    charge_point = await crud_cp.find_nearest(lat, lng)
-    return ChargePointSchemaOut(**charge_point.dict())
+    charge_points = await crud_cp.find_nearest(lat, lng, k=k or 1, max_km=max_km)
+    if k is not None:
+        return ORJSONResponse([charge_point_nearest_out(cp, distance) for cp, distance in charge_points])
+    if not charge_points:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return ORJSONResponse(charge_point_out(charge_points[0][0]))
+
+
+@router.post(
+    "/nearest/batch",
+    status_code=status.HTTP_200_OK,
+    response_model=List[Optional[ChargePointSchemaNearestOut]],
+)
+async def find_nearest_charge_point_batch(
+    db: AsyncSession = Depends(get_db),
+    *,
+    payload: ChargePointSchemaNearestBatchIn = Body(
+        ...,
+        example={
+            "origins": [
+                {"lat": "40.7453297", "lng": "-73.9929523"},
+                {"lat": "-17.7333", "lng": "168.3273"},
+            ],
+        },
+    ),
+) -> Response:
+    crud_cp = CRUDChargePoint(db)
+    charge_points = await crud_cp.find_nearest_batch([(o.lat, o.lng) for o in payload.origins])
+    return ORJSONResponse([
+        charge_point_nearest_out(*found) if found else None
+        for found in charge_points
+    ])
 
 
 @router.post(
@@ -49,24 +137,352 @@ async def create_charge_point(
             "location": "Ampcontrol Office",
         },
     ),
-) -> ChargePointSchemaOut:
+) -> Response:
     crud_cp = CRUDChargePoint(db)
     charge_point = await crud_cp.create(payload)
-    return ChargePointSchemaOut(**charge_point.dict())
+    return ORJSONResponse(
+        charge_point_out(charge_point),
+        status_code=status.HTTP_201_CREATED,
+        headers={"ETag": item_etag(charge_point.revision)},
+    )
+
+
+@router.post(
+    "/import",
+    status_code=status.HTTP_200_OK,
+    response_model=ChargePointImportReport,
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Missing token or inactive user.",
+        },
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: {
+            "description": "Body is neither `text/csv` nor `application/x-ndjson`.",
+        },
+    },
+)
+async def import_charge_points(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(current_active_user),
+) -> ChargePointImportReport:
+    """Bulk load charge points from a CSV (`lat,lng,location` header row) or NDJSON body.
+    Rows that fail validation are listed in the report and do not stop the import.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        fmt = CSV
+    elif "ndjson" in content_type:
+        fmt = NDJSON
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    importer = ChargePointImporter(db, fmt)
+    return await importer.run(iter_lines(request.stream()))
 
 
 @router.get(
-    "/", status_code=status.HTTP_200_OK, response_model=List[ChargePointSchemaOut],
+    "/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {media_type: {} for media_type in MEDIA_TYPES.values()},
+            "description": "Every charge point, streamed. MessagePack is a sequence of columnar batches.",
+        },
+    },
+)
+async def export_charge_points(
+    db: AsyncSession = Depends(get_db),
+    *,
+    format: Optional[str] = Query(
+        None,
+        regex=f"^({CSV}|{NDJSON}|{MSGPACK})$",
+        description=f"Defaults to `{MSGPACK}` when the `Accept` header asks for it, `{NDJSON}` otherwise.",
+    ),
+    accept: Optional[str] = Header(None),
+) -> StreamingResponse:
+    if format is None:
+        format = MSGPACK if accepts_msgpack(accept) else NDJSON
+    return StreamingResponse(
+        stream_charge_points(db, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="charge_points.{format}"'},
+    )
+
+
+@router.get("/search", status_code=status.HTTP_200_OK, response_model=List[ChargePointSchemaOut])
+async def search_charge_points(
+    db: AsyncSession = Depends(get_db),
+    *,
+    q: str = Query(..., min_length=1, max_length=200, example="port vila"),
+    limit: int = Query(10, ge=1, le=100),
+) -> Response:
+    """Charge points whose location starts with `q`, then those with words starting with
+    each word of `q`, ignoring case and accents. For autocomplete, "vila" finds
+    "Port Vila, Vanuatu".
+    """
+    crud_cp = CRUDChargePoint(db)
+    charge_points = await crud_cp.search(q, limit)
+    return ORJSONResponse([charge_point_out(cp) for cp in charge_points])
+
+
+@router.get(
+    "/events",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {"text/event-stream": {}},
+            "description": (
+                "A `created`, `updated` or `deleted` event per charge point written, with the revision as "
+                "id and `{op, revision, item}` as data. Items too large for an event only have their `id`."
+            ),
+        },
+    },
+)
+async def stream_charge_point_events() -> StreamingResponse:
+    """Live feed of charge point changes as Server-Sent Events, from the moment of the
+    request on. Clients that fall `CHANGE_FEED_BUFFER_SIZE` events behind are
+    disconnected and should reconnect, refetching what they may have missed.
+    """
+    subscription = await charge_point_changes.subscribe()
+
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), settings.CHANGE_FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield b": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            charge_point_changes.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get(
+    "/changes",
+    status_code=status.HTTP_200_OK,
+    response_model=ChargePointChangesOut,
+    responses={
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "Nothing changed since the `If-None-Match` ETag.",
+        },
+    },
+)
+async def read_charge_point_changes(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    *,
+    since: int = Query(
+        0,
+        ge=0,
+        description="`revision` of the previous sync or id of the last event received, 0 for everything.",
+    ),
+    limit: int = Query(1000, ge=1, le=10000),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """Charge points written and ids of those deleted after revision `since`, for
+    clients keeping a copy in sync. Apply the changes, then ask again from the returned
+    `revision`, straight away while `more` is true. A revision is never split across
+    responses, so one can hold more than `limit` changes.
+    """
+    crud_cp = CRUDChargePoint(db)
+    etag = collection_etag(await crud_cp.get_revision(), request.url.query)
+    if none_match(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    changed, deleted, revision, more = await crud_cp.get_changes(since, limit)
+    return ORJSONResponse(charge_point_changes_out(changed, deleted, revision, more), headers={"ETag": etag})
+
+
+@router.get(
+    "/clusters",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ChargePointClusterOut],
+    responses={
+        status.HTTP_200_OK: {
+            "headers": {
+                TRUNCATED_HEADER: {
+                    "description": "Whether more clusters are inside the box.",
+                    "schema": {"type": "boolean"},
+                },
+            },
+        },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "Nothing changed since the `If-None-Match` ETag.",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "The bbox is invalid.",
+        },
+    },
+)
+async def read_charge_point_clusters(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    *,
+    bbox: str = Query(..., description=BBOX_DESCRIPTION, example=BBOX_EXAMPLE),
+    zoom: int = Query(..., ge=0, le=CLUSTER_MAX_ZOOM, description="Map zoom level."),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """Charge points of the box grouped into grid cells sized for the zoom level, each
+    cluster with its count and centroid, up to `BBOX_MAX_RESULTS` clusters. Cells on the
+    edge of the box are whole, so their centroid may fall just outside of it.
+    """
+    box = _parse_bbox(bbox)
+    crud_cp = CRUDChargePoint(db)
+    etag = collection_etag(await crud_cp.get_revision(), request.url.query)
+    if none_match(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    clusters, truncated = await crud_cp.find_clusters(box, zoom, settings.BBOX_MAX_RESULTS)
+    return ORJSONResponse(
+        [charge_point_cluster_out(cluster) for cluster in clusters],
+        headers={"ETag": etag, TRUNCATED_HEADER: "true" if truncated else "false"},
+    )
+
+
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ChargePointSchemaOut],
+    responses={
+        status.HTTP_200_OK: {
+            "content": {columnar.MEDIA_TYPE: {}},
+            "description": (
+                f"With `Accept: {columnar.MEDIA_TYPE}` one columnar MessagePack batch, "
+                "see `app.bulk.columnar`."
+            ),
+            "headers": {
+                NEXT_CURSOR_HEADER: {
+                    "description": "Cursor of the next page, absent on the last page.",
+                    "schema": {"type": "string"},
+                },
+                TRUNCATED_HEADER: {
+                    "description": "With `bbox`, whether more charge points are inside the box.",
+                    "schema": {"type": "boolean"},
+                },
+            },
+        },
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "Nothing changed since the `If-None-Match` ETag.",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "The cursor or bbox is invalid.",
+        },
+    },
 )
 async def read_charge_points(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     *,
-    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description=f"`{NEXT_CURSOR_HEADER}` of the previous page."),
+    skip: int = Query(0, ge=0, deprecated=True),
     limit: int = Query(100, ge=1, le=100),
-) -> List[ChargePointSchemaOut]:
+    bbox: Optional[str] = Query(
+        None,
+        description=(
+            f"Every charge point inside the box instead of a page, up to {settings.BBOX_MAX_RESULTS}. "
+            + BBOX_DESCRIPTION
+        ),
+        example=BBOX_EXAMPLE,
+    ),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+) -> Response:
     crud_cp = CRUDChargePoint(db)
-    charge_points = await crud_cp.get_multi(skip=skip, limit=limit)
-    return [ChargePointSchemaOut(**cp.dict()) for cp in charge_points]
+    if bbox is not None:
+        box = _parse_bbox(bbox)
+    msgpack = accepts_msgpack(accept)
+    # each representation gets its own ETag
+    etag_parts = (request.url.query, columnar.MEDIA_TYPE) if msgpack else (request.url.query,)
+    etag = collection_etag(await crud_cp.get_revision(), *etag_parts)
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if none_match(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if bbox is not None:
+        charge_points, truncated = await crud_cp.find_in_bbox(box, settings.BBOX_MAX_RESULTS)
+        headers[TRUNCATED_HEADER] = "true" if truncated else "false"
+    elif skip:
+        charge_points = await crud_cp.get_multi(skip=skip, limit=limit)
+    else:
+        try:
+            charge_points, next_cursor = await crud_cp.get_page(cursor, limit=limit, raw=True)
+        except InvalidCursor:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        if next_cursor:
+            headers[NEXT_CURSOR_HEADER] = next_cursor
+    if msgpack:
+        return Response(columnar.encode_charge_points(charge_points), media_type=columnar.MEDIA_TYPE, headers=headers)
+    return ORJSONResponse([charge_point_out(cp) for cp in charge_points], headers=headers)
+
+
+@router.patch(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ChargePointBulkResult],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Missing token or inactive user.",
+        },
+    },
+)
+async def update_charge_points(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(current_active_user),
+    *,
+    payload: ChargePointSchemaBulkUpdateIn = Body(
+        ...,
+        example={
+            "items": [
+                {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa6", "location": "Ampcontrol Office"},
+                {"id": "9c8e1a4b-2f7d-4e53-a1b6-0d3c5e7f9a12", "lat": "-17.7333", "lng": "168.3273"},
+            ],
+        },
+    ),
+) -> Response:
+    """Partially update many charge points in one transaction. Fields left out keep their
+    value. Results are in request order, with status 404 for ids that do not exist.
+    """
+    crud_cp = CRUDChargePoint(db)
+    charge_points = await crud_cp.bulk_update([
+        (item.id, ChargePointSchemaUpdate(**item.dict(exclude={"id"}, exclude_unset=True)))
+        for item in payload.items
+    ])
+    return ORJSONResponse(charge_point_bulk_results([item.id for item in payload.items], charge_points))
+
+
+@router.delete(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ChargePointBulkResult],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Missing token or inactive user.",
+        },
+    },
+)
+async def remove_charge_points(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(current_active_user),
+    *,
+    payload: ChargePointSchemaBulkDeleteIn = Body(
+        ...,
+        example={"ids": ["3fa85f64-5717-4562-b3fc-2c963f66afa6"]},
+    ),
+) -> Response:
+    """Delete many charge points in one transaction. Results are in request order, with
+    status 404 for ids that do not exist.
+    """
+    crud_cp = CRUDChargePoint(db)
+    charge_points = await crud_cp.bulk_delete(payload.ids)
+    return ORJSONResponse(charge_point_bulk_results(payload.ids, charge_points))
 
 
 @router.get(
@@ -74,6 +490,9 @@ async def read_charge_points(
     status_code=status.HTTP_200_OK,
     response_model=ChargePointSchemaOut,
     responses={
+        status.HTTP_304_NOT_MODIFIED: {
+            "description": "The charge point has not changed since the `If-None-Match` ETag.",
+        },
         status.HTTP_404_NOT_FOUND: {
             "description": "The charge point does not exist.",
         },
@@ -81,8 +500,13 @@ async def read_charge_points(
 )
 async def read_charge_point(
     charge_point: ChargePointSchema = Depends(get_charge_point_or_404),
-) -> ChargePointSchemaOut:
-    return ChargePointSchemaOut(**charge_point.dict())
+    *,
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    etag = item_etag(charge_point.revision)
+    if none_match(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return ORJSONResponse(charge_point_out(charge_point), headers={"ETag": etag})
 
 
 @router.put(
@@ -96,13 +520,16 @@ async def read_charge_point(
         status.HTTP_404_NOT_FOUND: {
             "description": "The charge point does not exist.",
         },
+        status.HTTP_412_PRECONDITION_FAILED: {
+            "description": "The charge point does not match the `If-Match` ETag.",
+        },
     },
 )
 async def update_charge_point(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(current_active_user),
     *,
-    charge_point: ChargePointSchema = Depends(get_charge_point_or_404),
+    id: UUID,
     payload: ChargePointSchemaUpdate = Body(
         ...,
         example={
@@ -111,10 +538,16 @@ async def update_charge_point(
             "location": "Ampcontrol Office",
         },
     ),
-) -> ChargePointSchemaOut:
+    if_match: Optional[str] = Header(None),
+) -> Response:
     crud_cp = CRUDChargePoint(db)
-    charge_point = await crud_cp.update(charge_point.id, payload)
-    return ChargePointSchemaOut(**charge_point.dict())
+    try:
+        charge_point = await crud_cp.update(id, payload, if_revision=parse_if_match(if_match))
+    except DoesNotExist:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    except RevisionMismatch:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED)
+    return ORJSONResponse(charge_point_out(charge_point), headers={"ETag": item_etag(charge_point.revision)})
 
 
 @router.delete(
@@ -128,14 +561,23 @@ async def update_charge_point(
         status.HTTP_404_NOT_FOUND: {
             "description": "The charge point does not exist.",
         },
+        status.HTTP_412_PRECONDITION_FAILED: {
+            "description": "The charge point does not match the `If-Match` ETag.",
+        },
     },
 )
 async def remove_charge_point(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(current_active_user),
     *,
-    charge_point: ChargePointSchema = Depends(get_charge_point_or_404),
-) -> ChargePointSchemaOut:
+    id: UUID,
+    if_match: Optional[str] = Header(None),
+) -> Response:
     crud_cp = CRUDChargePoint(db)
-    charge_point = await crud_cp.delete(charge_point.id)
-    return ChargePointSchemaOut(**charge_point.dict())
+    try:
+        charge_point = await crud_cp.delete(id, if_revision=parse_if_match(if_match))
+    except DoesNotExist:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    except RevisionMismatch:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED)
+    return ORJSONResponse(charge_point_out(charge_point))
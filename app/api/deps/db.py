@@ -1,12 +1,19 @@
+from fastapi import Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import async_session
+from app.db.routing import use_read_replica
+from app.db.session import async_read_session, async_session
 
 
-async def get_db() -> AsyncSession:
+async def get_db(request: Request) -> AsyncSession:
     """
-    Dependency function that yields db sessions
+    Dependency function that yields db sessions, bound to the read replica
+    for reads when one is configured, see `app.db.routing`
     """
+    if use_read_replica(request):
+        async with async_read_session() as session:
+            yield session
+        return
     async with async_session() as session:
         yield session
-        await session.commit()
\ No newline at end of file
+        await session.commit()
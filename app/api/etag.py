@@ -0,0 +1,38 @@
+import hashlib
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+
+def item_etag(revision: int) -> str:
+    return f'"{revision}"'
+
+
+def collection_etag(revision: int, *parts: str) -> str:
+    """ETag of a collection response, the table revision plus whatever else shapes it."""
+    digest = hashlib.sha1("&".join(parts).encode()).hexdigest()[:16]
+    return f'"{revision}-{digest}"'
+
+
+def none_match(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an `If-None-Match` header matches `etag`, i.e. a 304 can be sent."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Revision an `If-Match` header requires, None when any revision will do."""
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip()
+    try:
+        if tag.startswith('"') and tag.endswith('"'):
+            return int(tag[1:-1])
+    except ValueError:
+        pass
+    # Not an ETag we could have issued, so it can never match
+    raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED)
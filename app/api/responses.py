@@ -0,0 +1,98 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.bulk import columnar
+
+# Endpoints returning an `ORJSONResponse` directly skip FastAPI's `response_model`
+# validation and `jsonable_encoder`, so the functions below build the exact payload of
+# the declared response model straight from schemas, ORM objects or result rows.
+
+
+def charge_point_out(charge_point: Any) -> Dict[str, Any]:
+    """`ChargePointSchemaOut` payload."""
+    return {
+        "id": charge_point.id,
+        "lat": charge_point.lat,
+        "lng": charge_point.lng,
+        "location": charge_point.location,
+    }
+
+
+def charge_point_nearest_out(charge_point: Any, distance: float) -> Dict[str, Any]:
+    """`ChargePointSchemaNearestOut` payload."""
+    out = charge_point_out(charge_point)
+    out["distance"] = distance
+    return out
+
+
+def charge_point_bulk_results(ids: Iterable[Any], charge_points: Iterable[Any]) -> List[Dict[str, Any]]:
+    """`ChargePointBulkResult` payloads in the order of `ids`, 404 for those that are
+    not among the changed `charge_points`.
+    """
+    changed = {charge_point.id: charge_point for charge_point in charge_points}
+    return [
+        {"id": id, "status": 200, "charge_point": charge_point_out(changed[id])}
+        if id in changed
+        else {"id": id, "status": 404, "charge_point": None}
+        for id in ids
+    ]
+
+
+def charge_point_cluster_out(cluster: Any) -> Dict[str, Any]:
+    """`ChargePointClusterOut` payload from a cluster row of sums."""
+    return {
+        "lat": cluster.lat_sum / cluster.count,
+        "lng": cluster.lng_sum / cluster.count,
+        "count": cluster.count,
+    }
+
+
+def charge_point_changes_out(
+    charge_points: Iterable[Any],
+    deleted: Iterable[Any],
+    revision: int,
+    more: bool,
+) -> Dict[str, Any]:
+    """`ChargePointChangesOut` payload."""
+    return {
+        "revision": revision,
+        "more": more,
+        "changed": [charge_point_out(charge_point) for charge_point in charge_points],
+        "deleted": list(deleted),
+    }
+
+
+def _quality(accept: str, media_type: str) -> float:
+    """Quality an `Accept` header gives `media_type`, from its most specific media range."""
+    main_type = media_type.split("/")[0]
+    best, specificity = 0.0, -1
+    for media_range in accept.split(","):
+        range_type, *params = (part.strip() for part in media_range.split(";"))
+        if range_type == media_type:
+            rank = 2
+        elif range_type == f"{main_type}/*":
+            rank = 1
+        elif range_type == "*/*":
+            rank = 0
+        else:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if rank > specificity:
+            best, specificity = quality, rank
+    return best
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """Whether an `Accept` header asks for columnar MessagePack over JSON, which stays
+    the default for missing or wildcard headers.
+    """
+    if not accept or columnar.MEDIA_TYPE not in accept:
+        return False
+    msgpack_quality = _quality(accept, columnar.MEDIA_TYPE)
+    return msgpack_quality > 0 and msgpack_quality >= _quality(accept, "application/json")
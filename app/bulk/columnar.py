@@ -0,0 +1,147 @@
+"""Columnar MessagePack encoding of charge points.
+
+A batch of charge points is one MessagePack map of columns instead of an object per
+point, so field names are sent once and the values are packed arrays:
+
+    {
+        "count": n,
+        "id": bin,          # n raw 16 byte UUIDs
+        "lat": bin,         # n little-endian float64
+        "lng": bin,         # n little-endian float64
+        "locations": [str], # string table of the distinct locations
+        "location": bin,    # n little-endian uint32 indexes into "locations"
+    }
+
+Any MessagePack library decodes it, e.g. with numpy
+`np.frombuffer(batch["lat"], "<f8")`. Streamed responses are a sequence of such maps.
+Only the handful of MessagePack types the layout needs are written here, see
+https://github.com/msgpack/msgpack/blob/master/spec.md
+"""
+import struct
+import uuid
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+MEDIA_TYPE = "application/x-msgpack"
+
+_FLOAT = np.dtype("<f8")
+_INDEX = np.dtype("<u4")
+# fixstr headers by length, most locations are short enough for one
+_FIXSTR = [bytes((0xA0 | size,)) for size in range(32)]
+
+
+def _uint(value: int) -> bytes:
+    if value < 0x80:
+        return bytes((value,))
+    return b"\xce" + struct.pack(">I", value)
+
+
+def _str(value: str) -> bytes:
+    data = value.encode()
+    size = len(data)
+    if size < 32:
+        return _FIXSTR[size] + data
+    if size < 0x100:
+        return b"\xd9" + bytes((size,)) + data
+    if size < 0x10000:
+        return b"\xda" + struct.pack(">H", size) + data
+    return b"\xdb" + struct.pack(">I", size) + data
+
+
+def _bin(data: bytes) -> bytes:
+    size = len(data)
+    if size < 0x100:
+        return b"\xc4" + bytes((size,)) + data
+    if size < 0x10000:
+        return b"\xc5" + struct.pack(">H", size) + data
+    return b"\xc6" + struct.pack(">I", size) + data
+
+
+def _array_header(size: int) -> bytes:
+    if size < 16:
+        return bytes((0x90 | size,))
+    if size < 0x10000:
+        return b"\xdc" + struct.pack(">H", size)
+    return b"\xdd" + struct.pack(">I", size)
+
+
+def encode_charge_points(rows: Sequence[Any]) -> bytes:
+    """Columnar batch of rows, schemas or ORM objects with `id`, `lat`, `lng` and `location`."""
+    count = len(rows)
+    locations = list(map(attrgetter("location"), rows))
+    table = {location: i for i, location in enumerate(dict.fromkeys(locations))}
+    # what `UUID.bytes` does, minus the property lookup
+    ids = b"".join([id.int.to_bytes(16, "big") for id in map(attrgetter("id"), rows)])
+    return b"".join((
+        b"\x86",
+        _str("count"), _uint(count),
+        _str("id"), _bin(ids),
+        _str("lat"), _bin(np.fromiter(map(attrgetter("lat"), rows), _FLOAT, count).tobytes()),
+        _str("lng"), _bin(np.fromiter(map(attrgetter("lng"), rows), _FLOAT, count).tobytes()),
+        _str("locations"), _array_header(len(table)), *map(_str, table),
+        _str("location"), _bin(np.fromiter(map(table.__getitem__, locations), _INDEX, count).tobytes()),
+    ))
+
+
+def _read(data: bytes, pos: int) -> Tuple[Any, int]:
+    """Decode the MessagePack value at `pos`, limited to the types written above."""
+    tag = data[pos]
+    pos += 1
+    if tag < 0x80:
+        return tag, pos
+    if 0x80 <= tag <= 0x8F:
+        return _read_map(data, pos, tag & 0x0F)
+    if 0x90 <= tag <= 0x9F:
+        return _read_array(data, pos, tag & 0x0F)
+    if 0xA0 <= tag <= 0xBF:
+        size = tag & 0x1F
+        return data[pos:pos + size].decode(), pos + size
+    if tag == 0xCE:
+        return struct.unpack_from(">I", data, pos)[0], pos + 4
+    if tag in (0xC4, 0xC5, 0xC6, 0xD9, 0xDA, 0xDB):
+        width = {0xC4: 1, 0xC5: 2, 0xC6: 4, 0xD9: 1, 0xDA: 2, 0xDB: 4}[tag]
+        size = int.from_bytes(data[pos:pos + width], "big")
+        pos += width
+        value = data[pos:pos + size]
+        return (bytes(value) if tag <= 0xC6 else value.decode()), pos + size
+    if tag == 0xDC:
+        return _read_array(data, pos + 2, struct.unpack_from(">H", data, pos)[0])
+    if tag == 0xDD:
+        return _read_array(data, pos + 4, struct.unpack_from(">I", data, pos)[0])
+    raise ValueError(f"Unsupported MessagePack type 0x{tag:02x} at {pos - 1}")
+
+
+def _read_map(data: bytes, pos: int, size: int) -> Tuple[Dict[Any, Any], int]:
+    value = {}
+    for _ in range(size):
+        key, pos = _read(data, pos)
+        value[key], pos = _read(data, pos)
+    return value, pos
+
+
+def _read_array(data: bytes, pos: int, size: int) -> Tuple[List[Any], int]:
+    value = []
+    for _ in range(size):
+        item, pos = _read(data, pos)
+        value.append(item)
+    return value, pos
+
+
+def decode_charge_points(data: bytes) -> Iterable[Dict[str, Any]]:
+    """Charge points of a stream of columnar batches, as `ChargePointSchemaOut` dicts.
+    Mostly for tests, clients would rather use a MessagePack library.
+    """
+    pos = 0
+    while pos < len(data):
+        batch, pos = _read(data, pos)
+        locations = batch["locations"]
+        columns = zip(
+            (uuid.UUID(bytes=batch["id"][i:i + 16]) for i in range(0, 16 * batch["count"], 16)),
+            np.frombuffer(batch["lat"], _FLOAT).tolist(),
+            np.frombuffer(batch["lng"], _FLOAT).tolist(),
+            np.frombuffer(batch["location"], _INDEX).tolist(),
+        )
+        for id, lat, lng, location in columns:
+            yield {"id": id, "lat": lat, "lng": lng, "location": locations[location]}
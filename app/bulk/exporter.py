@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.bulk import columnar
+from app.bulk.importer import CSV, NDJSON
+from app.models.charge_point import ChargePoint
+
+MSGPACK = "msgpack"
+
+MEDIA_TYPES = {
+    CSV: "text/csv",
+    NDJSON: "application/x-ndjson",
+    MSGPACK: columnar.MEDIA_TYPE,
+}
+# Rows fetched from the server-side cursor and written out per chunk.
+CHUNK_SIZE = 1000
+COLUMNS = ("id", "lat", "lng", "location")
+
+
+def _ndjson(rows: Iterable) -> bytes:
+    return "".join(
+        json.dumps({"id": str(r.id), "lat": r.lat, "lng": r.lng, "location": r.location}) + "\n"
+        for r in rows
+    ).encode()
+
+
+def _csv(rows: Iterable) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows((str(r.id), r.lat, r.lng, r.location) for r in rows)
+    return buffer.getvalue().encode()
+
+
+ENCODERS = {
+    CSV: _csv,
+    NDJSON: _ndjson,
+    MSGPACK: columnar.encode_charge_points,
+}
+
+
+async def stream_charge_points(db_session: AsyncSession, fmt: str, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield every charge point encoded as CSV (with a header row), NDJSON or a columnar
+    MessagePack batch per chunk. Rows are read through a server-side cursor so memory use
+    does not grow with the table.
+    """
+    encode = ENCODERS[fmt]
+    if fmt == CSV:
+        yield (",".join(COLUMNS) + "\r\n").encode()
+    query = (
+        select(ChargePoint.id, ChargePoint.lat, ChargePoint.lng, ChargePoint.location)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = await db_session.stream(query)
+    async for rows in result.partitions(chunk_size):
+        yield encode(rows)
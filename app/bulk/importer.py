@@ -0,0 +1,185 @@
+import asyncio
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from asyncpg import PostgresError
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.executor import ExecutorBusy, spatial_executor
+from app.crud.charge_point import CRUDChargePoint
+from app.schemas.charge_point import ChargePointImportError, ChargePointImportReport, ChargePointSchemaIn
+
+CSV = "csv"
+NDJSON = "ndjson"
+FORMATS = (CSV, NDJSON)
+
+CHUNK_SIZE = 5000
+# Only this many errors are listed in the report, the rest are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a stream of utf-8 encoded bytes into lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+def _parse_csv(lines: List[Tuple[int, str]], header: List[str]) -> List[Tuple[int, Dict]]:
+    """Records of a chunk of consecutive lines, numbered by the line they start on, as
+    quoted fields may span lines.
+    """
+    reader = csv.reader(line + "\n" for _, line in lines)
+    records = []
+    number = lines[0][0] if lines else 0
+    for row in reader:
+        if row:  # blank line
+            records.append((number, dict(zip(header, row))))
+        number = lines[0][0] + reader.line_num
+    return records
+
+
+def _parse_ndjson(lines: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, Dict]], List[ChargePointImportError]]:
+    records, errors = [], []
+    for number, line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            errors.append(ChargePointImportError(line=number, error=f"Invalid JSON: {e}"))
+            continue
+        if not isinstance(record, dict):
+            errors.append(ChargePointImportError(line=number, error="Expected a JSON object"))
+            continue
+        records.append((number, record))
+    return records, errors
+
+
+def _validate(
+    fmt: str,
+    header: List[str],
+    lines: List[Tuple[int, str]],
+) -> Tuple[List[ChargePointSchemaIn], List[int], List[ChargePointImportError]]:
+    """Charge points of a chunk of numbered lines with their line numbers, and the
+    errors of the lines that are not valid charge points.
+    """
+    if fmt == CSV:
+        records = _parse_csv(lines, header)
+        errors = []
+    else:
+        records, errors = _parse_ndjson(lines)
+    valid, numbers = [], []
+    for number, record in records:
+        try:
+            valid.append(ChargePointSchemaIn(**record))
+        except ValidationError as e:
+            errors.append(ChargePointImportError(line=number, error=_format_errors(e)))
+        else:
+            numbers.append(number)
+    return valid, numbers, errors
+
+
+class ChargePointImporter:
+    """Streams CSV (with a header row) or NDJSON charge points into the database.
+
+    Records are validated against `ChargePointSchemaIn` and loaded with COPY one
+    chunk at a time, each chunk in its own transaction. A bad row or a failing
+    chunk is recorded in the report and the import carries on.
+
+    Chunks are validated on `spatial_executor`, the next one while the database
+    loads the previous one.
+    """
+
+    def __init__(self, db_session: AsyncSession, fmt: str, chunk_size: int = CHUNK_SIZE) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format {fmt!r}, expected one of {FORMATS}")
+        self._crud = CRUDChargePoint(db_session)
+        self._db_session = db_session
+        self._fmt = fmt
+        self._chunk_size = chunk_size
+        self._header = None
+        self.report = ChargePointImportReport(created=0, failed=0, errors=[])
+
+    async def run(self, lines: AsyncIterator[str]) -> ChargePointImportReport:
+        loading: Optional[asyncio.Task] = None
+        try:
+            async for chunk in self._chunks(lines):
+                validated = await self._validate(chunk)
+                if loading is not None:
+                    await loading
+                loading = asyncio.get_running_loop().create_task(self._load(*validated))
+            if loading is not None:
+                await loading
+        finally:
+            # never leave a load running on the session
+            if loading is not None and not loading.done():
+                await asyncio.wait([loading])
+        return self.report
+
+    async def _chunks(self, lines: AsyncIterator[str]) -> AsyncIterator[List[Tuple[int, str]]]:
+        chunk: List[Tuple[int, str]] = []
+        number = 0
+        # whether a quoted CSV field goes on to the next line, chunks only end between records
+        quoted = False
+        async for line in lines:
+            number += 1
+            line = line.rstrip("\r")
+            if self._fmt == CSV:
+                if self._header is None:
+                    if line.strip():
+                        self._header = [column.strip() for column in next(csv.reader([line]))]
+                    continue
+                # lines are kept blank or not so that `_parse_csv` can number them
+                quoted ^= line.count('"') % 2 == 1
+            elif not line.strip():
+                continue
+            chunk.append((number, line))
+            if len(chunk) >= self._chunk_size and not quoted:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _validate(
+        self,
+        lines: List[Tuple[int, str]],
+    ) -> Tuple[List[ChargePointSchemaIn], List[int], List[ChargePointImportError]]:
+        try:
+            return await spatial_executor.run(_validate, self._fmt, self._header, lines)
+        except ExecutorBusy:
+            # rather than failing half way through the import
+            return _validate(self._fmt, self._header, lines)
+
+    async def _load(
+        self,
+        valid: List[ChargePointSchemaIn],
+        numbers: List[int],
+        errors: List[ChargePointImportError],
+    ) -> None:
+        if valid:
+            try:
+                await self._crud.bulk_create(valid)
+            except (PostgresError, SQLAlchemyError) as e:  # the whole chunk is rolled back
+                await self._db_session.rollback()
+                errors.extend(ChargePointImportError(line=n, error=str(e)) for n in numbers)
+            else:
+                self.report.created += len(valid)
+        self.report.failed += len(errors)
+        room = MAX_REPORTED_ERRORS - len(self.report.errors)
+        self.report.errors.extend(sorted(errors, key=lambda e: e.line)[:max(0, room)])
+
+
+def _format_errors(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']}" for e in error.errors()
+    )
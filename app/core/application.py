@@ -1,8 +1,35 @@
-from fastapi import FastAPI
+import asyncio
+from functools import partial
+
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 
 from app.api import root
 from app.api.api_v1.api import api_router
 from app.core.config import settings
+from app.core.executor import ExecutorBusy, spatial_executor
+from app.core.metrics import (
+    MetricsMiddleware,
+    collect_cache,
+    collect_pool,
+    flush_periodically,
+    metrics_endpoint,
+    registry,
+)
+from app.core.users import user_token_cache
+from app.crud.charge_point import (
+    CRUDChargePoint,
+    charge_point_cache,
+    charge_point_changes,
+    reload_indexes_periodically,
+)
+from app.db.profiler import QueryProfilerMiddleware, query_profiler
+from app.db.routing import ReadYourWritesMiddleware
+from app.db.session import async_engine, async_read_engine, async_session
+
+spatial_executor_in_flight = registry.gauge(
+    "spatial_executor_in_flight", "CPU-bound spatial jobs running or queued.",
+)
 
 
 def create_api():
@@ -11,4 +38,69 @@ def create_api():
     app.include_router(root.router)
     app.include_router(api_router, prefix=settings.API_V1_STR)
 
+    if settings.READ_REPLICA_DATABASE_URI:
+        app.add_middleware(ReadYourWritesMiddleware, seconds=settings.READ_YOUR_WRITES_SECONDS)
+
+    if settings.SQL_PROFILER_ENABLED:
+        query_profiler.install(async_engine)
+        query_profiler.install(async_read_engine)
+        app.add_middleware(QueryProfilerMiddleware)
+
+    app.add_middleware(MetricsMiddleware, router=app.router)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+    registry.collector("db_pool_primary", partial(collect_pool, "primary", async_engine))
+    if async_read_engine is not async_engine:
+        registry.collector("db_pool_replica", partial(collect_pool, "replica", async_read_engine))
+    registry.collector("cache_charge_point", partial(collect_cache, "charge_point", charge_point_cache))
+    registry.collector("cache_user_token", partial(collect_cache, "user_token", user_token_cache))
+    registry.collector(
+        "spatial_executor",
+        lambda: spatial_executor_in_flight.set((), spatial_executor.in_flight),
+    )
+
+    if registry.directory is not None:
+        @app.on_event("startup")
+        async def start_metrics_flush():
+            app.state.metrics_flush = asyncio.create_task(
+                flush_periodically(settings.METRICS_FLUSH_SECONDS),
+            )
+
+        @app.on_event("shutdown")
+        def stop_metrics_flush():
+            app.state.metrics_flush.cancel()
+            registry.write()
+
+    if settings.SPATIAL_INDEX_ENABLED:
+        @app.on_event("startup")
+        async def load_spatial_index():
+            async with async_session() as session:
+                await CRUDChargePoint(session).load_index()
+
+    if settings.INDEX_RELOAD_SECONDS:
+        @app.on_event("startup")
+        async def start_index_reload():
+            app.state.index_reload = asyncio.create_task(
+                reload_indexes_periodically(settings.INDEX_RELOAD_SECONDS),
+            )
+
+        @app.on_event("shutdown")
+        def stop_index_reload():
+            app.state.index_reload.cancel()
+
+    @app.on_event("shutdown")
+    def shutdown_spatial_executor():
+        spatial_executor.shutdown()
+
+    @app.on_event("shutdown")
+    async def close_change_feed():
+        await charge_point_changes.close()
+
+    @app.exception_handler(ExecutorBusy)
+    async def executor_busy_handler(request: Request, exc: ExecutorBusy):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Server is busy, try again shortly."},
+            headers={"Retry-After": "1"},
+        )
+
     return app
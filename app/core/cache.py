@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Sentinel cached for keys known not to exist.
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Negative entries, storing `MISSING`, expire after `negative_ttl` instead so a
+    newly created item is not hidden for long. Not thread-safe, meant to be used
+    from the event loop only.
+
+    A value read from elsewhere while a concurrent write invalidates its key would
+    otherwise be cached stale for a whole `ttl`. Callers take a `generation` before
+    reading and pass it to `set`, which drops the value if the key was invalidated
+    in between.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        negative_ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+        # generation of the latest invalidation of recently invalidated keys, bounded
+        # like the entries, and the latest generation forgotten or bulk invalidated
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._floor = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Cached value, `MISSING` for a cached negative lookup or None on a miss."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= self._clock():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def generation(self) -> int:
+        """Token to pass to `set` for a value about to be read."""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, generation: Optional[int] = None) -> None:
+        """Cache `value`, for `ttl` seconds if given and shorter than the cache's own.
+        With `generation` nothing is cached if `key` was invalidated since it was taken.
+        """
+        if self.maxsize <= 0:
+            return
+        if generation is not None and max(self._floor, self._invalidated.get(key, 0)) > generation:
+            return
+        default_ttl = self.negative_ttl if value is MISSING else self.ttl
+        ttl = default_ttl if ttl is None else min(ttl, default_ttl)
+        if ttl <= 0:
+            return
+        self._data[key] = (self._clock() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._generation += 1
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > max(self.maxsize, 1):
+            _, generation = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, generation)
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Drop every entry whose value matches `predicate`, return how many were dropped.
+        This is a linear scan so it is meant for rare events only. Values being read
+        may match too, so every `generation` taken before is invalidated.
+        """
+        keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+        for key in keys:
+            del self._data[key]
+        self._generation += 1
+        self._floor = self._generation
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._invalidated.clear()
+        self._generation += 1
+        self._floor = self._generation
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,5 +1,6 @@
 from typing import Any
 from typing import Dict
+from typing import Literal
 from typing import Optional
 
 from pydantic import BaseSettings, EmailStr
@@ -14,6 +15,11 @@ class Config(BaseSettings):
     API_V1_STR: str = '/api/v1'
 
     ACCESS_TOKEN_EXPIRE_SECONDS: int = 3600
+    # In-process cache of the user behind a bearer token, 0 disables it.
+    # NOTE a user deactivated through another worker process keeps being
+    # authenticated there for up to USER_TOKEN_CACHE_TTL_SECONDS.
+    USER_TOKEN_CACHE_SIZE: int = 10000
+    USER_TOKEN_CACHE_TTL_SECONDS: float = 60
 
     POSTGRES_SERVER: str
     POSTGRES_USER: str
@@ -22,6 +28,65 @@ class Config(BaseSettings):
     SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
     SQLALCHEMY_DATABASE_ECHO: bool = False
 
+    # Connection pool of each engine, see `app.db.session`.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_COMMAND_TIMEOUT_SECONDS: Optional[float] = None
+    # Prepared statements cached per connection, set to 0 behind pgbouncer.
+    DB_STATEMENT_CACHE_SIZE: int = 100
+
+    # Count and time the statements of each request, reported in a Server-Timing
+    # header, and log statements slower than SLOW_QUERY_THRESHOLD_MS.
+    SQL_PROFILER_ENABLED: bool = False
+    SLOW_QUERY_THRESHOLD_MS: float = 100
+
+    # Optional read-only replica serving GET and HEAD requests. A client that
+    # wrote something keeps reading from the primary for READ_YOUR_WRITES_SECONDS.
+    READ_REPLICA_DATABASE_URI: Optional[PostgresDsn] = None
+    READ_YOUR_WRITES_SECONDS: float = 5
+
+    # Serve nearest charge point searches from the in-memory KD-tree, otherwise
+    # candidates are prefiltered in SQL through the indexed `geo_cell` column.
+    SPATIAL_INDEX_ENABLED: bool = True
+    # Seconds between reloads of the in-memory indexes, which otherwise miss writes
+    # that bypass the application, such as plain SQL. 0 never reloads them.
+    INDEX_RELOAD_SECONDS: float = 900
+    # Pool running CPU-bound spatial work off the event loop, see `app.core.executor`.
+    SPATIAL_EXECUTOR: Literal['thread', 'process'] = 'thread'
+    SPATIAL_EXECUTOR_WORKERS: int = 2
+    SPATIAL_EXECUTOR_QUEUE: int = 32
+
+    # Most charge points returned for one bounding box, larger boxes are truncated.
+    BBOX_MAX_RESULTS: int = 2000
+
+    # In-process cache of charge points looked up by id, 0 disables it.
+    CHARGE_POINT_CACHE_SIZE: int = 10000
+    CHARGE_POINT_CACHE_TTL_SECONDS: float = 30
+    CHARGE_POINT_CACHE_NEGATIVE_TTL_SECONDS: float = 2
+
+    # Server-Sent Events feed of charge point changes, see `app.db.changes`. A
+    # subscriber more than CHANGE_FEED_BUFFER_SIZE events behind is disconnected.
+    CHANGE_FEED_BUFFER_SIZE: int = 256
+    CHANGE_FEED_HEARTBEAT_SECONDS: float = 15
+
+    # Directory shared by all worker processes where each one periodically
+    # writes its metrics so that /metrics covers the whole server. Leave unset
+    # when running a single process.
+    METRICS_DIR: Optional[str] = None
+    METRICS_FLUSH_SECONDS: float = 5
+
+    @validator('USER_TOKEN_CACHE_TTL_SECONDS')
+    def check_user_token_cache_ttl(
+        cls,
+        v: float,
+        values: Dict[str, Any],
+    ) -> float:
+        if v >= values.get('ACCESS_TOKEN_EXPIRE_SECONDS', v + 1):
+            raise ValueError('must be lower than ACCESS_TOKEN_EXPIRE_SECONDS')
+        return v
+
     @validator('SQLALCHEMY_DATABASE_URI', pre=True)
     def assemble_db_connection(
         cls,
@@ -48,6 +113,16 @@ class Config(BaseSettings):
             else self.SQLALCHEMY_DATABASE_URI
         )
 
+    @property
+    def ASYNC_READ_REPLICA_DATABASE_URI(self) -> Optional[str]:
+        return (
+            self.READ_REPLICA_DATABASE_URI.replace(
+                'postgresql://', 'postgresql+asyncpg://',
+            )
+            if self.READ_REPLICA_DATABASE_URI
+            else self.READ_REPLICA_DATABASE_URI
+        )
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,81 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+class ExecutorBusy(Exception):
+    """Raised when too many CPU-bound jobs are already running or queued."""
+
+
+class CPUExecutor:
+    """Runs CPU-bound work off the event loop.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more wait for
+    a slot; anything beyond that is rejected with `ExecutorBusy` straight away
+    instead of piling up behind the pool.
+
+    `run` uses a thread or process pool depending on `kind`, so its function and
+    arguments must be picklable in process mode. `run_local` always uses threads
+    and is meant for work on in-process state such as the spatial index.
+    """
+
+    def __init__(self, kind: str, max_workers: int, max_queue: int) -> None:
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="cpu")
+        return self._thread_pool
+
+    def _get_pool(self) -> Executor:
+        if self.kind != "process":
+            return self._get_thread_pool()
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.max_workers)
+        return self._process_pool
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await self._submit(self._get_pool(), fn, *args)
+
+    async def run_local(self, fn: Callable[..., T], *args: Any) -> T:
+        return await self._submit(self._get_thread_pool(), fn, *args)
+
+    async def _submit(self, pool: Executor, fn: Callable[..., T], *args: Any) -> T:
+        if self.in_flight >= self.max_workers + self.max_queue:
+            raise ExecutorBusy(f"{self.in_flight} CPU-bound jobs already running or queued")
+        if self._semaphore is None:
+            # created lazily so it belongs to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        self.in_flight += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(pool, partial(fn, *args))
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self) -> None:
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._thread_pool = None
+        self._process_pool = None
+        self._semaphore = None
+
+
+spatial_executor = CPUExecutor(
+    settings.SPATIAL_EXECUTOR,
+    settings.SPATIAL_EXECUTOR_WORKERS,
+    settings.SPATIAL_EXECUTOR_QUEUE,
+)
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds, from a cached lookup to a large export.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    """Values of one metric keyed by label values.
+
+    Updates are plain dict operations without any locking, so like `TTLCache`
+    metrics are meant to be updated from the event loop only.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, Any] = {}
+
+    def snapshot(self) -> List[List[Any]]:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+    def clear(self) -> None:
+        self._values.clear()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, labels: Labels, value: float) -> None:
+        """For collectors mirroring a count kept elsewhere, such as cache stats."""
+        self._values[labels] = value
+
+
+class Gauge(Metric):
+    """Gauges of processes that are gone are dropped when workers are merged."""
+
+    type = "gauge"
+
+    def set(self, labels: Labels, value: float) -> None:
+        self._values[labels] = value
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """Values are `[counts, sum, count]`, `counts` holding one non-cumulative count
+    per bucket plus a last one for +Inf.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: Labels, value: float) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+class Registry:
+    """Metrics of this process plus collectors refreshing gauges before each snapshot.
+
+    With `directory` set every worker periodically writes its snapshot there as
+    `<pid>.json` and `collect` merges the snapshots of all workers, so any worker
+    can answer a scrape for the whole server.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = directory
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Callable[[], None]] = {}
+
+    def _register(self, metric: Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, name: str, collect: Callable[[], None]) -> None:
+        """Run `collect` before every snapshot, replacing any collector of the same name."""
+        self._collectors[name] = collect
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def snapshot(self) -> Dict[str, List[List[Any]]]:
+        for collect in self._collectors.values():
+            collect()
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def write(self) -> None:
+        """Atomically replace this worker's snapshot file."""
+        if self.directory is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _worker_snapshots(self) -> List[Tuple[bool, Dict[str, List[List[Any]]]]]:
+        snapshots = [(True, self.snapshot())]
+        if self.directory is None:
+            return snapshots
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json") or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((_is_alive(int(filename[:-5])), snapshot))
+        return snapshots
+
+    def collect(self) -> str:
+        """All metrics of every worker in the Prometheus text format."""
+        merged: Dict[str, Dict[Labels, Any]] = {name: {} for name in self._metrics}
+        for alive, snapshot in self._worker_snapshots():
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None or (not alive and metric.type == "gauge"):
+                    continue
+                for labels, value in values:
+                    _merge(merged[name], tuple(labels), value)
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(merged[name].items()):
+                label_pairs = list(zip(metric.labelnames, labels))
+                if isinstance(metric, Histogram):
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip((*metric.buckets, "+Inf"), counts):
+                        cumulative += bucket_count
+                        bucket_labels = _format_labels(label_pairs + [("le", _format_value(bound))])
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(label_pairs)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(label_pairs)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(label_pairs)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(values: Dict[Labels, Any], labels: Labels, value: Any) -> None:
+    current = values.get(labels)
+    if current is None:
+        values[labels] = value if not isinstance(value, list) else [list(value[0]), value[1], value[2]]
+    elif isinstance(value, list):
+        current[0] = [a + b for a, b in zip(current[0], value[0])]
+        current[1] += value[1]
+        current[2] += value[2]
+    else:
+        values[labels] = current + value
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _format_labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry(settings.METRICS_DIR)
+
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.",
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"),
+)
+http_responses_total = registry.counter(
+    "http_responses_total", "HTTP responses by route and status code.", ("method", "route", "status"),
+)
+
+db_pool_size = registry.gauge("db_pool_size", "Connections kept open by the pool.", ("engine",))
+db_pool_checked_out = registry.gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool.", ("engine",),
+)
+db_pool_overflow = registry.gauge(
+    "db_pool_overflow", "Connections open beyond the pool size.", ("engine",),
+)
+cache_entries = registry.gauge("cache_entries", "Entries held by an in-process cache.", ("cache",))
+cache_hits_total = registry.counter("cache_hits_total", "In-process cache hits.", ("cache",))
+cache_misses_total = registry.counter("cache_misses_total", "In-process cache misses.", ("cache",))
+cache_evictions_total = registry.counter(
+    "cache_evictions_total", "In-process cache entries evicted to stay within size.", ("cache",),
+)
+
+
+def collect_pool(name: str, engine: AsyncEngine) -> None:
+    pool = engine.pool
+    db_pool_size.set((name,), pool.size())
+    db_pool_checked_out.set((name,), pool.checkedout())
+    db_pool_overflow.set((name,), max(0, pool.overflow()))
+
+
+def collect_cache(name: str, cache: TTLCache) -> None:
+    stats = cache.stats()
+    cache_entries.set((name,), stats["size"])
+    cache_hits_total.set((name,), stats["hits"])
+    cache_misses_total.set((name,), stats["misses"])
+    cache_evictions_total.set((name,), stats["evictions"])
+
+
+# Route label of requests that did not match any route, keeps the label set bounded.
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """Records in-flight requests and per-route latency and status codes.
+
+    The route label is the path template of the matched route, looked up from
+    the endpoint the router stored in the scope.
+    """
+
+    def __init__(self, app: ASGIApp, router: Router) -> None:
+        self.app = app
+        self.router = router
+        self._route_paths: Dict[Callable, str] = {}
+
+    def _route_path(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in self.router.routes
+                if hasattr(route, "endpoint")
+            }
+            path = self._route_paths.get(endpoint, UNMATCHED_ROUTE)
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = self._route_path(scope)
+            http_requests_in_flight.dec()
+            http_request_duration_seconds.observe((scope["method"], route), time.perf_counter() - start)
+            http_responses_total.inc((scope["method"], route, str(status_code)))
+
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(registry.collect(), media_type=CONTENT_TYPE)
+
+
+async def flush_periodically(interval: float) -> None:
+    """Keep this worker's snapshot file fresh for scrapes served by other workers."""
+    while True:
+        await asyncio.sleep(interval)
+        registry.write()
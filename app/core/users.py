@@ -1,19 +1,36 @@
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 
+import jwt
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers
 from fastapi_users.authentication import (AuthenticationBackend,
                                           BearerTransport, JWTStrategy)
 from fastapi_users_db_sqlalchemy import SQLAlchemyUserDatabase
-from fastapi_users.manager import BaseUserManager
+from fastapi_users.jwt import decode_jwt
+from fastapi_users.manager import BaseUserManager, UserNotExists
+from pydantic import UUID4
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.cache import TTLCache
 from app.core.config import settings
 from app.db.session import async_session
 from app.models.user import User as UserTable
 from app.schemas.user import User, UserCreate, UserDB, UserUpdate
 
 
+# Per-process cache of bearer token -> user, see `CachedJWTStrategy`.
+user_token_cache = TTLCache(
+    maxsize=settings.USER_TOKEN_CACHE_SIZE,
+    ttl=settings.USER_TOKEN_CACHE_TTL_SECONDS,
+    negative_ttl=0,
+)
+
+
+def invalidate_user_tokens(user_id: UUID4) -> None:
+    user_token_cache.invalidate_where(lambda user: user.id == user_id)
+
+
 class UserManager(BaseUserManager[UserCreate, UserDB]):
     user_db_model = UserDB
     reset_password_token_secret = settings.SECRET_KEY
@@ -35,6 +52,25 @@ class UserManager(BaseUserManager[UserCreate, UserDB]):
     ) -> None:
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    async def on_after_update(
+        self, user: UserDB, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ) -> None:
+        invalidate_user_tokens(user.id)
+
+    async def on_after_verify(
+        self, user: UserDB, request: Optional[Request] = None
+    ) -> None:
+        invalidate_user_tokens(user.id)
+
+    async def on_after_reset_password(
+        self, user: UserDB, request: Optional[Request] = None
+    ) -> None:
+        invalidate_user_tokens(user.id)
+
+    async def delete(self, user: UserDB) -> None:
+        await super().delete(user)
+        invalidate_user_tokens(user.id)
+
 
 async def get_async_session() -> AsyncSession:
     async with async_session() as session:
@@ -52,8 +88,41 @@ async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db
 bearer_transport = BearerTransport(tokenUrl="/api/v1/auth/jwt/login")
 
 
+class CachedJWTStrategy(JWTStrategy):
+    """JWT strategy remembering the user behind each valid token.
+
+    Authenticated requests otherwise verify the token signature and load the user
+    from the database every time. Entries never outlive the token's own expiry and
+    are dropped by `UserManager` whenever the user changes in this process.
+    """
+
+    async def read_token(
+        self, token: Optional[str], user_manager: BaseUserManager[UserCreate, UserDB]
+    ) -> Optional[UserDB]:
+        if token is None:
+            return None
+        user = user_token_cache.get(token)
+        if user is not None:
+            return user
+
+        # a user updated while being read must not be cached as it was before
+        generation = user_token_cache.generation()
+        try:
+            data = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+            user_id = UUID4(data["user_id"])
+            user = await user_manager.get(user_id)
+        except (jwt.PyJWTError, KeyError, TypeError, ValueError, UserNotExists):
+            return None
+
+        expires = data.get("exp")
+        user_token_cache.set(token, user, None if expires is None else expires - time.time(), generation)
+        return user
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(
+    return CachedJWTStrategy(
         secret=settings.SECRET_KEY,
         lifetime_seconds=settings.ACCESS_TOKEN_EXPIRE_SECONDS,
         token_audience=[f"{settings.SERVICE_SLUG}:auth"],
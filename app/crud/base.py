@@ -1,12 +1,37 @@
 import abc
-from typing import Generic, List, Type, TypeVar
+import base64
+import binascii
+from typing import Any, Generic, List, Optional, Tuple, Type, TypeVar
 from uuid import UUID, uuid4
 
-from sqlalchemy import select
+from sqlalchemy import (
+    String,
+    Table,
+    any_,
+    cast,
+    column,
+    delete,
+    exists,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    select,
+    true,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.util import identity_key
 
-from app.db.exceptions import DoesNotExist
+from app.core.cache import MISSING, TTLCache
+from app.db.changes import CREATED, DELETED, UPDATED, change_event
+from app.db.exceptions import DoesNotExist, InvalidCursor, RevisionMismatch
+from app.db.session import async_engine, async_read_engine
+from app.models.revision import revision_table
 from app.schemas.base import BaseSchema
 
 IN_SCHEMA = TypeVar("IN_SCHEMA", bound=BaseSchema)
@@ -14,7 +39,29 @@ SCHEMA = TypeVar("SCHEMA", bound=BaseSchema)
 TABLE = TypeVar("TABLE")
 
 
+def encode_cursor(item_id: UUID) -> str:
+    """Opaque pagination token pointing just past `item_id`."""
+    return base64.urlsafe_b64encode(item_id.bytes).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> UUID:
+    try:
+        return UUID(bytes=base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+
+
 class CRUDBase(Generic[TABLE, IN_SCHEMA, SCHEMA], metaclass=abc.ABCMeta):
+    # Read-through cache for `get_by_id`, kept in sync by create/update/delete.
+    _cache: Optional[TTLCache] = None
+    # Whether `_table` has a `revision` column stamped from `app.models.revision`.
+    _revisioned: bool = False
+    # Channel every write is announced on with NOTIFY, see `app.db.changes`.
+    _channel: Optional[str] = None
+    # Table of `id` and `revision` that deletes of a revisioned `_table` leave a row in,
+    # see `get_changes`.
+    _tombstones: Optional[Table] = None
+
     def __init__(self, db_session: AsyncSession, *args, **kwargs) -> None:
         self._db_session: AsyncSession = db_session
 
@@ -30,45 +77,386 @@ class CRUDBase(Generic[TABLE, IN_SCHEMA, SCHEMA], metaclass=abc.ABCMeta):
 
     async def create(self, in_schema: IN_SCHEMA) -> SCHEMA:
         item = self._table(id=uuid4(), **in_schema.dict())
+        if self._revisioned:
+            item.revision = await self._next_revision()
         self._db_session.add(item)
+        schema = self._schema.from_orm(item)
+        await self._notify(CREATED, [schema])
         await self._db_session.commit()
-        return self._schema.from_orm(item)
+        self._invalidate(schema.id)
+        self._on_created(schema)
+        return schema
 
-    async def update(self, item_id: UUID, update_schema) -> SCHEMA:
-        item = await self._get_one(item_id)
-        for key, value in update_schema.dict(exclude_unset=True).items():
-            setattr(item, key, value)
-        self._db_session.add(item)
+    async def bulk_create(self, in_schemas: List[IN_SCHEMA]) -> List[SCHEMA]:
+        """Insert many items in one round trip using PostgreSQL's COPY protocol.
+        Columns without a value, such as those computed by the database, are left
+        out of the COPY.
+        """
+        if not in_schemas:
+            return []
+        revision = await self._next_revision() if self._revisioned else None
+        # plain dicts rather than `.dict()`, which is much slower and adds up over an import
+        values = [dict(in_schema, id=uuid4()) for in_schema in in_schemas]
+        attrs = [attr for attr in inspect(self._table).column_attrs if attr.key in values[0]]
+        columns = [attr.columns[0].name for attr in attrs]
+        records = [tuple(value[attr.key] for attr in attrs) for value in values]
+        if self._revisioned:
+            columns.append(inspect(self._table).column_attrs["revision"].columns[0].name)
+            records = [record + (revision,) for record in records]
+        connection = await self._db_session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            self._table.__tablename__, records=records, columns=columns,
+        )
+        await self._notify_events([change_event(CREATED, revision, value) for value in values])
+        await self._db_session.commit()
+        # the ids are new, nothing can have been cached for them
+        extra = {"revision": revision} if self._revisioned else {}
+        schemas = [self._schema.construct(**value, **extra) for value in values]
+        for schema in schemas:
+            self._on_created(schema)
+        return schemas
+
+    async def update(self, item_id: UUID, update_schema, if_revision: Optional[int] = None) -> SCHEMA:
+        """Apply `update_schema` with a single `UPDATE ... RETURNING`, which also stamps
+        the next revision. If `if_revision` is given the row has to be at that
+        revision or `RevisionMismatch` is raised.
+        """
+        table = self._table
+        target = self._target(item_id, if_revision)
+        values = update_schema.dict(exclude_unset=True)
+        if self._revisioned:
+            values["revision"] = select(self._next_revision_cte(target).c.value).scalar_subquery()
+        if not values:
+            # nothing to change, a no-op assignment still returns the row
+            values["id"] = table.id
+        query = (
+            update(table)
+            .where(table.id.in_(select(target.c.id)))
+            .values(**values)
+            .returning(*self._columns())
+            .execution_options(synchronize_session=False)
+        )
+        row = (await self._db_session.execute(query)).one_or_none()
+        if row is None:
+            await self._raise_not_matched(item_id, if_revision)
+        schema = self._schema.from_orm(row)
+        await self._notify(UPDATED, [schema])
+        await self._db_session.commit()
+        self._forget(item_id)
+        self._invalidate(schema.id)
+        self._on_updated(schema)
+        return schema
+
+    async def delete(self, item_id: UUID, if_revision: Optional[int] = None) -> SCHEMA:
+        """Delete an item with a single `DELETE ... RETURNING`, see `update`."""
+        target = self._target(item_id, if_revision)
+        query = self._delete_query(target)
+        row = (await self._db_session.execute(query)).one_or_none()
+        if row is None:
+            await self._raise_not_matched(item_id, if_revision)
+        schema = self._schema.from_orm(row)
+        await self._notify(DELETED, [schema])
         await self._db_session.commit()
-        return self._schema.from_orm(item)
+        self._forget(item_id)
+        self._invalidate(schema.id)
+        self._on_deleted(schema)
+        return schema
 
-    async def delete(self, item_id: UUID) -> SCHEMA:
-        item = await self._get_one(item_id)
-        await self._db_session.delete(item)
+    async def bulk_update(self, updates: List[Tuple[UUID, Any]]) -> List[SCHEMA]:
+        """Apply many partial updates with a single `UPDATE ... FROM (VALUES ...)`.
+        Fields that are unset or None keep their current value. All updated items are
+        stamped with the same revision. Ids that do not exist are skipped; only the
+        updated items are returned, in no particular order.
+        """
+        if not updates:
+            return []
+        table = self._table
+        changes = [(item_id, update_schema.dict(exclude_unset=True)) for item_id, update_schema in updates]
+        keys = sorted({key for _, change in changes for key in change})
+        data = (
+            values(
+                column("id", table.id.type),
+                *(column(key, getattr(table, key).type) for key in keys),
+                name="data",
+            )
+            .data([(item_id, *(change.get(key) for key in keys)) for item_id, change in changes])
+        )
+        target = self._target_many([item_id for item_id, _ in changes])
+        assignments = {key: func.coalesce(data.c[key], getattr(table, key)) for key in keys}
+        if self._revisioned:
+            assignments["revision"] = select(self._next_revision_cte(target).c.value).scalar_subquery()
+        if not assignments:
+            assignments["id"] = table.id
+        query = (
+            update(table)
+            .where(table.id == data.c.id, table.id.in_(select(target.c.id)))
+            .values(**assignments)
+            .returning(*self._columns())
+            .execution_options(synchronize_session=False)
+        )
+        rows = (await self._db_session.execute(query)).all()
+        schemas = [self._schema.from_orm(row) for row in rows]
+        await self._notify(UPDATED, schemas)
         await self._db_session.commit()
-        return self._schema.from_orm(item)
+        for schema in schemas:
+            self._forget(schema.id)
+            self._invalidate(schema.id)
+            self._on_updated(schema)
+        return schemas
+
+    async def bulk_delete(self, item_ids: List[UUID]) -> List[SCHEMA]:
+        """Delete many items with a single `DELETE ... RETURNING`, see `bulk_update`."""
+        if not item_ids:
+            return []
+        target = self._target_many(item_ids)
+        query = self._delete_query(target)
+        rows = (await self._db_session.execute(query)).all()
+        schemas = [self._schema.from_orm(row) for row in rows]
+        await self._notify(DELETED, schemas)
+        await self._db_session.commit()
+        for schema in schemas:
+            self._forget(schema.id)
+            self._invalidate(schema.id)
+            self._on_deleted(schema)
+        return schemas
+
+    def _delete_query(self, target):
+        """`DELETE ... RETURNING` of the rows in `target`. Revisioned rows are returned
+        with the revision of their deletion rather than their last one.
+        """
+        columns = self._columns()
+        query = delete(self._table).where(self._table.id.in_(select(target.c.id)))
+        if self._revisioned:
+            next_revision = self._next_revision_cte(target)
+            query = query.add_cte(next_revision)
+            if self._tombstones is not None:
+                query = query.add_cte(self._tombstones_cte(target, next_revision))
+            columns = [
+                select(next_revision.c.value).scalar_subquery().label("revision") if c.name == "revision" else c
+                for c in columns
+            ]
+        return query.returning(*columns).execution_options(synchronize_session=False)
+
+    def _tombstones_cte(self, target, next_revision):
+        tombstones = self._tombstones
+        query = insert(tombstones).from_select(
+            [tombstones.c.id, tombstones.c.revision],
+            select(target.c.id, next_revision.c.value).select_from(target.join(next_revision, true())),
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[tombstones.c.id],
+            set_={"revision": query.excluded.revision},
+        )
+        return query.cte("tombstone")
+
+    def _target(self, item_id: UUID, if_revision: Optional[int] = None):
+        """CTE locking the row a write applies to, empty if it does not exist or is not
+        at `if_revision`. Writes only touch rows in it so the revision counter is not
+        bumped by a write that matches nothing.
+        """
+        query = select(self._table.id).filter(self._table.id == item_id)
+        if if_revision is not None:
+            query = query.filter(self._table.revision == if_revision)
+        return query.with_for_update().cte("target")
+
+    def _target_many(self, item_ids: List[UUID]):
+        """`_target` for many rows, locked in id order so that concurrent bulk writes
+        cannot deadlock each other.
+        """
+        query = (
+            select(self._table.id)
+            .filter(self._table.id == any_(cast(item_ids, ARRAY(self._table.id.type))))
+            .order_by(self._table.id)
+        )
+        return query.with_for_update().cte("target")
+
+    async def _raise_not_matched(self, item_id: UUID, if_revision: Optional[int]) -> None:
+        """Raise why a write matched no row. Only on this failure path is the row looked
+        up again, to tell a missing item from a stale `if_revision`.
+        """
+        if if_revision is not None:
+            query = select(self._table.revision).filter(self._table.id == item_id)
+            revision = (await self._db_session.execute(query)).scalar()
+            if revision is not None:
+                raise RevisionMismatch(
+                    f"{self._table.__name__}<id:{item_id}> is at revision {revision}, not {if_revision}"
+                )
+        raise DoesNotExist(
+            f"{self._table.__name__}<id:{item_id}> does not exist"
+        )
+
+    def _forget(self, item_id: UUID) -> None:
+        """Drop the session's copy of an item changed behind the ORM's back."""
+        item = self._db_session.sync_session.identity_map.get(identity_key(self._table, item_id))
+        if item is not None:
+            self._db_session.expunge(item)
+
+    async def _notify(self, op: str, items: List[SCHEMA]) -> None:
+        """Queue a change event per item on `_channel`, in the write's transaction so
+        that listeners only hear of it once, and if, it commits.
+        """
+        if self._channel is None:
+            return
+        await self._notify_events(
+            [change_event(op, item.revision if self._revisioned else None, item.dict()) for item in items],
+        )
+
+    async def _notify_events(self, events: List[str]) -> None:
+        """NOTIFY `change_event` payloads on `_channel`, see `_notify`."""
+        if self._channel is None or not events:
+            return
+        payloads = func.unnest(cast(events, ARRAY(String))).table_valued("payload").render_derived()
+        query = select(func.pg_notify(self._channel, payloads.c.payload)).select_from(payloads)
+        await self._db_session.execute(query)
+
+    def _invalidate(self, item_id: UUID) -> None:
+        if self._cache is not None:
+            self._cache.invalidate(item_id)
+
+    def _on_created(self, item: SCHEMA) -> None:
+        """Hook called after an item has been committed by `create`."""
+
+    def _on_updated(self, item: SCHEMA) -> None:
+        """Hook called after an item has been committed by `update`."""
+
+    def _on_deleted(self, item: SCHEMA) -> None:
+        """Hook called after an item has been committed by `delete`."""
 
     async def _get_one(self, item_id: UUID):
         query = select(self._table).filter(self._table.id == item_id)
         try:
-            item = (await self._db_session.execute(query)).scalar_one()
+            return (await self._db_session.execute(query)).scalar_one()
         except NoResultFound:
-            item = None
-        return item
+            return None
+
+    async def _next_revision(self) -> int:
+        """Bump the table's revision counter within the current transaction."""
+        one = literal_column("1")
+        query = self._next_revision_query(select(literal(self._table.__tablename__), one))
+        return (await self._db_session.execute(query)).scalar_one()
+
+    def _next_revision_cte(self, target):
+        """`_next_revision` as a CTE, bumping the counter only if `target` is not empty."""
+        one = literal_column("1")
+        rows = select(literal(self._table.__tablename__), one).filter(exists(select(target.c.id)))
+        return self._next_revision_query(rows).cte("next_revision")
+
+    def _next_revision_query(self, rows):
+        # NOTE the increment is inlined rather than bound, used in a CTE of an UPDATE
+        # SQLAlchemy would otherwise send the positional parameters out of order
+        return (
+            insert(revision_table)
+            .from_select([revision_table.c.name, revision_table.c.value], rows)
+            .on_conflict_do_update(
+                index_elements=[revision_table.c.name],
+                set_={"value": revision_table.c.value + literal_column("1")},
+            )
+            .returning(revision_table.c.value)
+        )
+
+    def _reads_replica(self) -> bool:
+        return self._db_session.bind is async_read_engine and async_read_engine is not async_engine
+
+    async def get_revision(self) -> int:
+        """Current revision of the whole table, changes on every committed write."""
+        query = select(revision_table.c.value).filter(revision_table.c.name == self._table.__tablename__)
+        return (await self._db_session.execute(query)).scalar() or 0
 
     async def get_by_id(self, item_id: UUID) -> SCHEMA:
-        item = await self._get_one(item_id)
-        if not item:
+        schema = self._cache.get(item_id) if self._cache is not None else None
+        if schema is None:
+            # a write committed while reading must not be overwritten by what was read
+            generation = self._cache.generation() if self._cache is not None else None
+            item = await self._get_one(item_id)
+            schema = self._schema.from_orm(item) if item else MISSING
+            # a lagging replica would cache what the primary already changed, see `_reads_replica`
+            if self._cache is not None and not self._reads_replica():
+                self._cache.set(item_id, schema, generation=generation)
+        if schema is MISSING:
             raise DoesNotExist(
                 f"{self._table.__name__}<id:{item_id}> does not exist"
             )
-        return self._schema.from_orm(item)
+        return schema
 
     async def get_multi(self, skip: int = 0, limit: int = 100) -> List[SCHEMA]:
         query = (
             select(self._table)
+            .order_by(self._table.id)
             .offset(skip)
             .limit(limit)
         )
         results = (await self._db_session.execute(query)).scalars()
-        return (self._schema.from_orm(item) for item in results)
+        return [self._schema.from_orm(item) for item in results]
+
+    async def get_page(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        raw: bool = False,
+    ) -> Tuple[List[SCHEMA], Optional[str]]:
+        """Keyset pagination over the primary key. Returns a page of items and the
+        cursor of the next page, or None on the last page. Cost does not depend on
+        how deep the page is since the query seeks straight to `cursor`.
+        With `raw` the items are plain result rows, for callers that serialize them
+        without going through the schema.
+        """
+        query = select(*self._columns()) if raw else select(self._table)
+        query = query.order_by(self._table.id).limit(limit + 1)
+        if cursor is not None:
+            query = query.filter(self._table.id > decode_cursor(cursor))
+        result = await self._db_session.execute(query)
+        items = result.all() if raw else result.scalars().all()
+        next_cursor = encode_cursor(items[limit - 1].id) if len(items) > limit else None
+        if raw:
+            return items[:limit], next_cursor
+        return [self._schema.from_orm(item) for item in items[:limit]], next_cursor
+
+    async def get_changes(self, since: int, limit: int = 1000) -> Tuple[list, List[UUID], int, bool]:
+        """Rows written and ids deleted after revision `since`, as result rows ordered by
+        revision, then the revision they bring a client up to and whether there are more
+        changes after it. Rows stamped 0 predate revisions, only a client at revision 0
+        gets them. Every query is a range scan of a `revision` index, so the cost is in
+        the number of changes rather than the size of the table.
+
+        A page of more than `limit` changes stops short of the revision of the first
+        change left out, so that a client is never left halfway through a revision. A
+        single revision with more than `limit` changes, e.g. a bulk import, is returned
+        whole.
+        """
+        table, tombstones = self._table, self._tombstones
+        # read first, every write up to it has committed since revisions commit in order
+        revision = await self.get_revision()
+
+        def between(column, upto: int):
+            return column.between(since + 1, upto) if since else column <= upto
+
+        revisions = union_all(
+            select(table.revision.label("revision")).filter(between(table.revision, revision)),
+            select(tombstones.c.revision).filter(between(tombstones.c.revision, revision)),
+        ).subquery()
+        ordered = select(revisions.c.revision).order_by(revisions.c.revision)
+        query = select(ordered.limit(1).scalar_subquery(), ordered.offset(limit).limit(1).scalar_subquery())
+        first, boundary = (await self._db_session.execute(query)).one()
+        if boundary is None:
+            upto = revision
+        elif boundary > first:
+            upto = boundary - 1
+        else:
+            upto = boundary
+        query = select(*self._columns()).filter(between(table.revision, upto)).order_by(table.revision, table.id)
+        rows = (await self._db_session.execute(query)).all()
+        query = (
+            select(tombstones.c.id)
+            .filter(between(tombstones.c.revision, upto))
+            .order_by(tombstones.c.revision, tombstones.c.id)
+        )
+        deleted = (await self._db_session.execute(query)).scalars().all()
+        return rows, deleted, upto, upto < revision
+
+    def _columns(self) -> list:
+        """Every mapped column attribute of `_table`, for column-only selects and
+        RETURNING clauses. Labelled with the attribute name since RETURNING would
+        otherwise key them by column name.
+        """
+        return [getattr(self._table, attr.key).label(attr.key) for attr in inspect(self._table).column_attrs]
@@ -1,15 +1,191 @@
-from typing import Type
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type, Union
+from uuid import UUID
 
-from math import cos, asin, sqrt, pi
-
-from sqlalchemy import select
+from sqlalchemy import BigInteger, and_, cast, func, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.executor import ExecutorBusy, spatial_executor
+from app.core.logger import logger
+from app.core.metrics import registry
 from app.crud.base import CRUDBase
+from app.db.changes import DELETED, UPDATED, ChangeFeed
+from app.db.session import async_session
+from app.geo.bbox import BBox
+from app.geo.cells import N_COLS, CellWindow
+from app.geo.clusters import cluster_ranges, cluster_stored_zoom
+from app.geo.haversine import HaversineEngine
+from app.geo.index import SpatialIndex
 from app.models.charge_point import ChargePoint
+from app.models.charge_point_cluster import charge_point_cluster_table
+from app.models.charge_point_tombstone import charge_point_tombstone_table
 from app.schemas.charge_point import ChargePointSchemaIn, ChargePointSchema
+from app.search.prefix import PrefixIndex
+
+# Per-process index of charge point coordinates, see `CRUDChargePoint.load_index`.
+# Writes made by other processes reach it through `charge_point_changes`, see
+# `_on_change`, and writes that bypass the application by `reload_indexes_periodically`.
+charge_point_index = SpatialIndex()
+
+# Per-process index of charge point locations, see `CRUDChargePoint.search`, kept up to
+# date like `charge_point_index`.
+charge_point_search_index = PrefixIndex()
+
+charge_point_cache = TTLCache(
+    maxsize=settings.CHARGE_POINT_CACHE_SIZE,
+    ttl=settings.CHARGE_POINT_CACHE_TTL_SECONDS,
+    negative_ttl=settings.CHARGE_POINT_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+# Background rebuilds of the in-memory indexes, at most one per index, see `_rebuild_when_due`.
+_rebuilds: Dict[object, "asyncio.Task[None]"] = {}
+
+
+def _rebuild_when_due(index: Union[SpatialIndex, PrefixIndex]) -> None:
+    """Rebuild `index` on `spatial_executor` in the background once its pending buffer
+    is large enough. Writes reach the index on the event loop, so they must never
+    rebuild it themselves.
+    """
+    loop = asyncio.get_running_loop()
+    running = _rebuilds.get(index)
+    if running is not None and not running.done() and running.get_loop() is loop:
+        return
+    if index.needs_rebuild:
+        _rebuilds[index] = loop.create_task(_rebuild(index))
+
+
+async def _rebuild(index: Union[SpatialIndex, PrefixIndex]) -> None:
+    try:
+        await spatial_executor.run_local(index.rebuild)
+    except ExecutorBusy:
+        # retried on the next write
+        logger.warning("Executor busy, postponing a rebuild of %s", type(index).__name__)
+    except Exception:
+        logger.exception("Rebuilding %s failed", type(index).__name__)
+
+
+# Every write to charge points is announced on this channel, see `CRUDBase._notify`.
+CHARGE_POINT_CHANNEL = "charge_point_changes"
+
+# Per-process fan out of the announcements to Server-Sent Events subscribers. It
+# listens on the primary, NOTIFY is not delivered to replicas.
+charge_point_changes = ChangeFeed(
+    CHARGE_POINT_CHANNEL,
+    settings.SQLALCHEMY_DATABASE_URI,
+    buffer_size=settings.CHANGE_FEED_BUFFER_SIZE,
+)
+
+# Loads of the in-memory indexes in progress, each with the change events heard since it
+# started, see `_loading`.
+_replays: Dict[object, List[List[Dict[str, Any]]]] = {}
+# Whether `_on_change` watches `charge_point_changes`, and how many times it lost it.
+_watching = False
+_watch_losses = 0
+
+
+def _apply_change(index: Union[SpatialIndex, PrefixIndex], event: Dict[str, Any]) -> None:
+    item = event["item"]
+    item_id = UUID(item["id"])
+    # writes of this process are already in, see `_on_created`
+    if event["op"] == DELETED:
+        index.remove(item_id)
+    elif index is charge_point_index:
+        if not index.matches(item_id, item["lat"], item["lng"]):
+            index.upsert(item_id, item["lat"], item["lng"])
+    elif not index.matches(item_id, item["location"]):
+        index.upsert(item_id, item["location"])
+    _rebuild_when_due(index)
+
+
+def _on_change(event: Optional[Dict[str, Any]]) -> None:
+    """Apply a change event of any process, this one included, to the in-memory indexes
+    and `charge_point_cache`, from the first index load on. If events may have been missed
+    the indexes are dropped, to be reloaded on next use.
+    """
+    global _watching, _watch_losses
+    if event is None:
+        _watching = False
+        _watch_losses += 1
+        charge_point_index.clear()
+        charge_point_search_index.clear()
+        return
+    # cached here before another process wrote it
+    charge_point_cache.invalidate(UUID(event["item"]["id"]))
+    if event["op"] != DELETED and "lat" not in event["item"]:
+        # announced by id only, see `change_event`
+        asyncio.get_running_loop().create_task(_refresh(UUID(event["item"]["id"])))
+        return
+    for index in (charge_point_index, charge_point_search_index):
+        for replay in _replays.get(index, ()):
+            replay.append(event)
+        if index.loaded:
+            _apply_change(index, event)
+
+
+async def _refresh(item_id: UUID) -> None:
+    """Apply a change of `item_id` announced by id only, as the primary has it now."""
+    try:
+        async with async_session() as session:
+            item = await session.get(ChargePoint, item_id)
+    except Exception:
+        logger.exception("Reading back charge point %s failed", item_id)
+        return
+    if item is None:
+        _on_change({"op": DELETED, "item": {"id": str(item_id)}})
+    else:
+        _on_change({
+            "op": UPDATED,
+            "item": {"id": str(item_id), "lat": item.lat, "lng": item.lng, "location": item.location},
+        })
+
+
+@asynccontextmanager
+async def _loading(index: Union[SpatialIndex, PrefixIndex]) -> AsyncIterator[None]:
+    """Around a load of `index`, watch `charge_point_changes` first and replay the events
+    heard meanwhile afterwards, as the rows loaded may predate them.
+    """
+    global _watching
+    if not _watching:
+        _watching = True
+        try:
+            await charge_point_changes.watch(_on_change)
+        except BaseException:
+            _watching = False
+            raise
+    losses = _watch_losses
+    replay: List[Dict[str, Any]] = []
+    _replays.setdefault(index, []).append(replay)
+    try:
+        yield
+    finally:
+        _replays[index].remove(replay)
+    if _watch_losses != losses:
+        index.clear()
+        return
+    for event in replay:
+        _apply_change(index, event)
+
+
+find_nearest_candidates = registry.histogram(
+    "find_nearest_candidates",
+    "Charge points read from the database per nearest search.",
+    ("strategy",),
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+
+# Past this many `geo_cell` ranges a window is fetched as one span of rows instead.
+MAX_CELL_RANGES = 64
 
 
 class CRUDChargePoint(CRUDBase[ChargePointSchemaIn, ChargePointSchema, ChargePoint]):
+    _cache = charge_point_cache
+    _revisioned = True
+    _channel = CHARGE_POINT_CHANNEL
+    _tombstones = charge_point_tombstone_table
+
     @property
     def _in_schema(self) -> Type[ChargePointSchemaIn]:
         return ChargePointSchemaIn
@@ -22,21 +198,326 @@ class CRUDChargePoint(CRUDBase[ChargePointSchemaIn, ChargePointSchema, ChargePoi
     def _table(self) -> Type[ChargePoint]:
         return ChargePoint
 
-    def _distance(self, lat1, lng1, lat2, lng2):
-        """Use Haversine formula to calculate distance between two points.
-        https://en.wikipedia.org/wiki/Haversine_formula
+    async def load_index(self) -> None:
+        """(Re)build the spatial index from the coordinates of every charge point on the
+        primary. From then on it follows the writes of every process, see `_on_change`.
+        """
+        query = select(self._table.id, self._table.lat, self._table.lng)
+        async with _loading(charge_point_index), self._primary() as session:
+            results = await session.execute(query)
+            await spatial_executor.run_local(charge_point_index.load, results.all())
+
+    async def load_search_index(self) -> None:
+        """(Re)build the search index from the location of every charge point on the
+        primary, see `load_index`.
         """
-        p = 0.017453292519943295  # pi / 180 gives us factor to convert degrees to radians
-        hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
-            cos(lat1 * p) * cos(lat2 * p) * \
-            (1 - cos((lng2 - lng1) * p)) / 2
-        return 12742 * asin(sqrt(hav))  # R = 6371 km and 2 * R gives us diameter of globe
+        query = select(self._table.id, self._table.location)
+        async with _loading(charge_point_search_index), self._primary() as session:
+            results = await session.execute(query)
+            await spatial_executor.run_local(charge_point_search_index.load, results.all())
 
-    async def find_nearest(self, lat: float, lng: float) -> ChargePointSchema:
-        """Find nearest charge point to given lat/lng.
+    def _on_created(self, item: ChargePointSchema) -> None:
+        if charge_point_index.loaded:
+            charge_point_index.upsert(item.id, item.lat, item.lng)
+            _rebuild_when_due(charge_point_index)
+        if charge_point_search_index.loaded:
+            charge_point_search_index.upsert(item.id, item.location)
+            _rebuild_when_due(charge_point_search_index)
+
+    def _on_updated(self, item: ChargePointSchema) -> None:
+        if charge_point_index.loaded:
+            charge_point_index.upsert(item.id, item.lat, item.lng)
+            _rebuild_when_due(charge_point_index)
+        if charge_point_search_index.loaded:
+            charge_point_search_index.upsert(item.id, item.location)
+            _rebuild_when_due(charge_point_search_index)
+
+    def _on_deleted(self, item: ChargePointSchema) -> None:
+        charge_point_index.remove(item.id)
+        _rebuild_when_due(charge_point_index)
+        charge_point_search_index.remove(item.id)
+        _rebuild_when_due(charge_point_search_index)
+
+    @asynccontextmanager
+    async def _primary(self) -> AsyncIterator[AsyncSession]:
+        """The session, or one of the primary if the session reads a replica."""
+        if self._reads_replica():
+            async with async_session() as session:
+                yield session
+        else:
+            yield self._db_session
+
+    async def _read_back(self, ids: List[UUID], current: Callable[[ChargePoint], bool]) -> Dict[UUID, ChargePoint]:
+        """Items of `ids` to check in-memory index entries against, `current` telling
+        whether an item agrees with its entry. A replica can lag behind writes the index
+        already has, so if its items disagree they are read again from the primary, and
+        the indexes are only ever corrected from what the primary holds.
+        """
+        query = select(self._table).filter(self._table.id.in_(ids))
+        items = {i.id: i for i in (await self._db_session.execute(query)).scalars()}
+        if self._reads_replica() and not all(i in items and current(items[i]) for i in ids):
+            async with async_session() as session:
+                items = {i.id: i for i in (await session.execute(query)).scalars()}
+        return items
+
+    async def search(self, q: str, limit: int = 10) -> List[ChargePointSchema]:
+        """Up to `limit` charge points whose location, or words of it, start with `q`,
+        best match first, see `PrefixIndex`. Matches come from the in-memory index and
+        are then read back from the database, see `_read_back`, so points deleted or
+        renamed by another process are dropped from the index and the search is retried.
+        """
+        if not charge_point_search_index.loaded:
+            await self.load_search_index()
+        while True:
+            found = await spatial_executor.run_local(charge_point_search_index.search, q, limit)
+            if not found:
+                return []
+            items = await self._read_back(
+                found, lambda item: charge_point_search_index.matches(item.id, item.location),
+            )
+            stale = False
+            for item_id in found:
+                item = items.get(item_id)
+                if item is None:
+                    charge_point_search_index.remove(item_id)
+                    stale = True
+                elif not charge_point_search_index.matches(item.id, item.location):
+                    charge_point_search_index.upsert(item.id, item.location)
+                    stale = True
+            _rebuild_when_due(charge_point_search_index)
+            if not stale:
+                return [self._schema.from_orm(items[item_id]) for item_id in found]
+
+    async def find_in_bbox(self, bbox: BBox, limit: int) -> Tuple[list, bool]:
+        """Rows of up to `limit` charge points inside `bbox` and whether there were more.
+        Rows are ordered by lat and lng, the key of `ix_charge_point_lat_lng`, so that the
+        index scan stops once the limit is reached instead of reading and sorting every row
+        of a large box. A truncated result is therefore the southern end of the box.
+        """
+        table = self._table
+        if bbox.crosses_antimeridian:
+            lng_filter = or_(table.lng >= bbox.min_lng, table.lng <= bbox.max_lng)
+        else:
+            lng_filter = table.lng.between(bbox.min_lng, bbox.max_lng)
+        query = (
+            select(*self._columns())
+            .filter(table.lat.between(bbox.min_lat, bbox.max_lat), lng_filter)
+            .order_by(table.lat, table.lng)
+            .limit(limit + 1)
+        )
+        rows = (await self._db_session.execute(query)).all()
+        return rows[:limit], len(rows) > limit
+
+    async def find_clusters(self, bbox: BBox, zoom: int, limit: int) -> Tuple[list, bool]:
+        """Rows of up to `limit` clusters of the `zoom` grid overlapping `bbox`, with their
+        count and coordinate sums, and whether there were more. Clusters are read from the
+        precomputed `charge_point_cluster` table, a primary key range scan per x range.
+        Zoom levels it does not store are merged from the cells of the next stored level
+        that make up the cells in view, see `CLUSTER_ZOOM_STEP`.
+        """
+        table = charge_point_cluster_table
+        stored = cluster_stored_zoom(zoom)
+        shift = stored - zoom
+        (y_lo, y_hi), x_ranges = cluster_ranges(bbox, zoom)
+        y, x = table.c.y, table.c.x
+        columns = [table.c.count, table.c.lat_sum, table.c.lng_sum]
+        if shift:
+            # inlined, as bound parameters would make ORDER BY differ from GROUP BY
+            y, x = y.op(">>")(literal_column(str(shift))), x.op(">>")(literal_column(str(shift)))
+            columns = [
+                cast(func.sum(table.c.count), BigInteger).label("count"),
+                func.sum(table.c.lat_sum).label("lat_sum"),
+                func.sum(table.c.lng_sum).label("lng_sum"),
+            ]
+        query = (
+            select(*columns)
+            .filter(
+                table.c.zoom == stored,
+                table.c.y.between(y_lo << shift, ((y_hi + 1) << shift) - 1),
+                or_(*(table.c.x.between(x_lo << shift, ((x_hi + 1) << shift) - 1) for x_lo, x_hi in x_ranges)),
+            )
+            .order_by(y, x)
+            .limit(limit + 1)
+        )
+        if shift:
+            query = query.group_by(y, x)
+        rows = (await self._db_session.execute(query)).all()
+        return rows[:limit], len(rows) > limit
+
+    async def find_nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_km: Optional[float] = None,
+    ) -> List[Tuple[ChargePointSchema, float]]:
+        """Find the `k` nearest charge points to given lat/lng, closest first, paired with
+        their distance in km. Points further than `max_km` are never considered.
         XXX alternative approach would be implementing PostGIS nearest-neighbor search.
         """
-        query = select(self._table)  # XXX major performance boost if we can filter down options early here
-        results = (await self._db_session.execute(query)).scalars()
-        item = min(results, key=lambda i: self._distance(i.lat, i.lng, lat, lng))
-        return self._schema.from_orm(item)
+        if settings.SPATIAL_INDEX_ENABLED:
+            return await self._find_nearest_indexed(lat, lng, k, max_km)
+        return await self._find_nearest_by_cell(lat, lng, k, max_km)
+
+    async def find_nearest_batch(
+        self,
+        origins: List[Tuple[float, float]],
+    ) -> List[Optional[Tuple[ChargePointSchema, float]]]:
+        """Find the nearest charge point to each lat/lng origin, in order, paired with its
+        distance in km. Yields None per origin if there are no points.
+        """
+        if settings.SPATIAL_INDEX_ENABLED:
+            return await self._find_nearest_batch_indexed(origins)
+        return await self._find_nearest_batch_scan(origins)
+
+    async def _find_nearest_batch_indexed(
+        self,
+        origins: List[Tuple[float, float]],
+    ) -> List[Optional[Tuple[ChargePointSchema, float]]]:
+        """Every origin is looked up in the in-memory spatial index in one executor job,
+        and the points found are read back like `_find_nearest_indexed` does.
+        """
+        if not charge_point_index.loaded:
+            await self.load_index()
+        candidates = 0
+        while True:
+            found = await spatial_executor.run_local(charge_point_index.nearest_many, origins)
+            ids = list({f[0]: None for f in found if f is not None})
+            items = await self._read_back_indexed(ids) if ids else {}
+            candidates += len(ids)
+            if items is not None:
+                find_nearest_candidates.observe(("batch",), candidates)
+                schemas = {item_id: self._schema.from_orm(item) for item_id, item in items.items()}
+                return [None if f is None else (schemas[f[0]], f[1]) for f in found]
+
+    async def _find_nearest_batch_scan(
+        self,
+        origins: List[Tuple[float, float]],
+    ) -> List[Optional[Tuple[ChargePointSchema, float]]]:
+        """Without the spatial index the candidate set is loaded once and every origin is
+        answered in chunked vectorized passes over it.
+        """
+        table = self._table
+        query = select(table.id, table.lat, table.lng, table.location)
+        rows = (await self._db_session.execute(query)).all()
+        find_nearest_candidates.observe(("batch",), len(rows))
+        if not rows:
+            return [None] * len(origins)
+        engine = HaversineEngine([r.lat for r in rows], [r.lng for r in rows])
+        positions, distances = await spatial_executor.run(
+            engine.nearest_many, [o[0] for o in origins], [o[1] for o in origins],
+        )
+        schemas = {}
+        results = []
+        for position, distance in zip(positions.tolist(), distances.tolist()):
+            if position not in schemas:
+                schemas[position] = self._schema.from_orm(rows[position])
+            results.append((schemas[position], distance))
+        return results
+
+    async def _find_nearest_indexed(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        max_km: Optional[float],
+    ) -> List[Tuple[ChargePointSchema, float]]:
+        """Candidates come from the in-memory spatial index and are then read back from the
+        database, see `_read_back`, so points deleted or moved by another process are
+        dropped from the index and the search is retried.
+        """
+        if not charge_point_index.loaded:
+            await self.load_index()
+        candidates = 0
+        while True:
+            found = await spatial_executor.run_local(charge_point_index.nearest, lat, lng, k, max_km)
+            items = await self._read_back_indexed([i for i, _ in found]) if found else {}
+            candidates += len(found)
+            if items is not None:
+                find_nearest_candidates.observe(("index",), candidates)
+                return [
+                    (self._schema.from_orm(items[item_id]), distance)
+                    for item_id, distance in found
+                ]
+
+    async def _read_back_indexed(self, ids: List[UUID]) -> Optional[Dict[UUID, ChargePoint]]:
+        """Charge points of `ids` found in the spatial index, see `_read_back`. If any was
+        deleted or moved by another process its entry is corrected and None is returned,
+        for the search to be retried.
+        """
+        items = await self._read_back(ids, lambda item: charge_point_index.matches(item.id, item.lat, item.lng))
+        stale = False
+        for item_id in ids:
+            item = items.get(item_id)
+            if item is None:
+                charge_point_index.remove(item_id)
+                stale = True
+            elif not charge_point_index.matches(item.id, item.lat, item.lng):
+                charge_point_index.upsert(item.id, item.lat, item.lng)
+                stale = True
+        _rebuild_when_due(charge_point_index)
+        return None if stale else items
+
+    async def _find_nearest_by_cell(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        max_km: Optional[float],
+    ) -> List[Tuple[ChargePointSchema, float]]:
+        """Only rows in the window of `geo_cell`s around lat/lng are fetched. The window
+        doubles in size until the k-th best candidate is closer than anything outside
+        of it could be, or the window covers everything within `max_km`.
+        """
+        table = self._table
+        radius = 0
+        candidates = 0
+        while True:
+            window = CellWindow(lat, lng, radius)
+            query = select(table.id, table.lat, table.lng, table.location).filter(self._cell_filter(window))
+            rows = (await self._db_session.execute(query)).all()
+            candidates += len(rows)
+            engine = HaversineEngine([r.lat for r in rows], [r.lng for r in rows])
+            positions, distances = await spatial_executor.run(engine.nearest, lat, lng, k, max_km)
+            bound = window.min_outside_km()
+            if (
+                window.covers_globe
+                or (max_km is not None and bound >= max_km)
+                or (len(positions) == k and distances[-1] <= bound)
+            ):
+                find_nearest_candidates.observe(("cell",), candidates)
+                return [
+                    (self._schema.from_orm(rows[p]), float(d))
+                    for p, d in zip(positions, distances)
+                ]
+            radius = radius * 2 or 1
+
+    def _cell_filter(self, window: CellWindow):
+        cell = self._table.geo_cell
+        ranges = window.cell_ranges()
+        if len(ranges) <= MAX_CELL_RANGES:
+            return or_(*(cell.between(lo, hi) for lo, hi in ranges))
+        # Too many rows for one range each, scan the row span and filter columns
+        return and_(
+            cell.between(window.row_lo * N_COLS, window.row_hi * N_COLS + N_COLS - 1),
+            or_(*((cell % N_COLS).between(lo, hi) for lo, hi in window.col_ranges)),
+        )
+
+
+async def reload_indexes_periodically(interval: float) -> None:
+    """Reload the loaded in-memory indexes every `interval` seconds, to pick up the
+    writes never announced on `charge_point_changes`.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for index, load in [
+            (charge_point_index, CRUDChargePoint.load_index),
+            (charge_point_search_index, CRUDChargePoint.load_search_index),
+        ]:
+            if not index.loaded:
+                continue
+            try:
+                async with async_session() as session:
+                    await load(CRUDChargePoint(session))
+            except Exception:
+                logger.exception("Reloading %s failed", type(index).__name__)
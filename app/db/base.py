@@ -3,4 +3,7 @@
 
 from app.db.base_class import Base  # noqa
 from app.models.charge_point import ChargePoint  # noqa
+from app.models.charge_point_cluster import charge_point_cluster_table  # noqa
+from app.models.charge_point_tombstone import charge_point_tombstone_table  # noqa
+from app.models.revision import revision_table  # noqa
 from app.models.user import User  # noqa
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import asyncpg
+import orjson
+
+from app.core.logger import logger
+from app.core.metrics import registry
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more.
+MAX_PAYLOAD_BYTES = 7999
+
+change_feed_subscribers = registry.gauge(
+    "change_feed_subscribers", "Clients subscribed to a change feed.", ("channel",),
+)
+change_feed_dropped_total = registry.counter(
+    "change_feed_dropped_total", "Subscribers disconnected for falling behind.", ("channel",),
+)
+
+
+def change_event(op: str, revision: Optional[int], item: Dict[str, Any]) -> str:
+    """NOTIFY payload announcing that `item` was created, updated or deleted. Items too
+    large for a payload are announced by id only, to be fetched by the listener.
+    """
+    payload = orjson.dumps({"op": op, "revision": revision, "item": item})
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        payload = orjson.dumps({"op": op, "revision": revision, "item": {"id": item["id"]}})
+    return payload.decode()
+
+
+def sse_message(payload: str) -> bytes:
+    """Server-Sent Event of a `change_event`, with the op as event type and the
+    revision as id.
+    """
+    event = orjson.loads(payload)
+    lines = [f"event: {event['op']}"]
+    if event["revision"] is not None:
+        lines.append(f"id: {event['revision']}")
+    lines.append(f"data: {payload}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscription:
+    """Bounded buffer of Server-Sent Events for one client, `get` returns None once
+    the subscription has ended.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self._queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize)
+
+    async def get(self) -> Optional[bytes]:
+        return await self._queue.get()
+
+    def _put(self, message: bytes) -> bool:
+        """Buffer `message`, False if the buffer is full."""
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def _end(self) -> None:
+        """Throw away what is buffered so that `get` returns None next."""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+
+class ChangeFeed:
+    """Fans out the change events NOTIFYed on `channel` to any number of subscribers of
+    this process, over a single connection that LISTENs to it.
+
+    The connection is opened for the first subscriber. Every event is rendered as a
+    Server-Sent Event once and then buffered per subscriber, and a subscriber whose
+    buffer of `buffer_size` events is full is dropped rather than buffering without
+    bound, its client can reconnect. If the connection is lost every subscription
+    ends and the next subscriber opens a new one.
+
+    Watchers, see `watch`, are instead handed every event as it arrives.
+    """
+
+    def __init__(self, channel: str, dsn: str, buffer_size: int) -> None:
+        self.channel = channel
+        self.dsn = dsn
+        self.buffer_size = buffer_size
+        self._subscribers: Set[Subscription] = set()
+        self._watchers: List[Callable[[Optional[Dict[str, Any]]], None]] = []
+        self._connection: Optional[asyncpg.Connection] = None
+        # created on first use, so that it belongs to the running event loop
+        self._connecting: Optional[asyncio.Lock] = None
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    async def subscribe(self) -> Subscription:
+        await self._connect()
+        subscription = Subscription(self.buffer_size)
+        self._subscribers.add(subscription)
+        change_feed_subscribers.inc((self.channel,))
+        return subscription
+
+    async def watch(self, callback: Callable[[Optional[Dict[str, Any]]], None]) -> None:
+        """Call `callback` on the event loop with every change event from now on, as
+        `change_event` makes them. It must not block, and is never dropped for being slow.
+        Once the connection is lost, and events may have been missed, `callback` is called
+        with None and then no more.
+        """
+        await self._connect()
+        self._watchers.append(callback)
+
+    async def _connect(self) -> None:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._connection is None or self._connection.is_closed():
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(self.channel, self._on_notification)
+                connection.add_termination_listener(self._on_termination)
+                self._connection = connection
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+            change_feed_subscribers.dec((self.channel,))
+
+    async def close(self) -> None:
+        """End every subscription and watch and close the connection."""
+        self._end_all()
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            await connection.close()
+
+    def _on_notification(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        if self._watchers:
+            event = orjson.loads(payload)
+            for callback in list(self._watchers):
+                self._call(callback, event)
+        if not self._subscribers:
+            return
+        message = sse_message(payload)
+        for subscription in list(self._subscribers):
+            if not subscription._put(message):
+                logger.warning("Dropping a %s subscriber %d events behind", self.channel, self.buffer_size)
+                change_feed_dropped_total.inc((self.channel,))
+                self.unsubscribe(subscription)
+                subscription._end()
+
+    def _on_termination(self, connection: Any) -> None:
+        logger.warning("Lost the connection listening to %s", self.channel)
+        if connection is self._connection:
+            self._connection = None
+        self._end_all()
+
+    def _end_all(self) -> None:
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+            subscription._end()
+        watchers, self._watchers = self._watchers, []
+        for callback in watchers:
+            self._call(callback, None)
+
+    def _call(self, callback: Callable[[Optional[Dict[str, Any]]], None], event: Optional[Dict[str, Any]]) -> None:
+        try:
+            callback(event)
+        except Exception:
+            logger.exception("Watcher of %s failed", self.channel)
@@ -1,2 +1,10 @@
 class DoesNotExist(Exception):
-    """Raised when entity was not found in database."""
\ No newline at end of file
+    """Raised when entity was not found in database."""
+
+
+class InvalidCursor(Exception):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+class RevisionMismatch(Exception):
+    """Raised when an entity is not at the revision a write was conditioned on."""
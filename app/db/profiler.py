@@ -0,0 +1,111 @@
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.logger import logger
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\$\d+|\?)(?:\s*,\s*(?:\$\d+|\?))*\s*\)")
+
+
+class QueryStats:
+    __slots__ = ("count", "duration")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.3f};desc="{self.count} queries"'
+
+
+# Statistics of the request being served, set by `QueryProfilerMiddleware`.
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+
+
+def normalize_sql(statement: str) -> str:
+    """Collapse whitespace, literals and bind parameter lists so that the same query
+    always logs the same way whatever its arguments.
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PARAMETER_LIST.sub("(...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryProfiler:
+    """Times every statement sent through an engine using SQLAlchemy engine events.
+
+    Statements are counted towards the request being served, if any, and those
+    slower than `slow_threshold_ms` are logged with their normalized SQL.
+    """
+
+    def __init__(self, slow_threshold_ms: float) -> None:
+        self.slow_threshold_ms = slow_threshold_ms
+
+    def install(self, engine: AsyncEngine) -> None:
+        sync_engine = engine.sync_engine
+        if event.contains(sync_engine, "before_cursor_execute", self._before_cursor_execute):
+            return
+        event.listen(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def uninstall(self, engine: AsyncEngine) -> None:
+        sync_engine = engine.sync_engine
+        if not event.contains(sync_engine, "before_cursor_execute", self._before_cursor_execute):
+            return
+        event.remove(sync_engine, "before_cursor_execute", self._before_cursor_execute)
+        event.remove(sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.duration += elapsed
+        if elapsed * 1000 >= self.slow_threshold_ms:
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, normalize_sql(statement))
+
+
+class QueryProfilerMiddleware:
+    """Adds a `Server-Timing` header with the statement count and DB time of each request.
+
+    Only statements issued before the response starts are counted, so for
+    streamed responses the header covers the work up to the first chunk.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("server-timing", stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_stats.reset(token)
+
+
+query_profiler = QueryProfiler(settings.SLOW_QUERY_THRESHOLD_MS)
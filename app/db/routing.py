@@ -0,0 +1,55 @@
+import time
+from math import ceil
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+# Methods served by the read replica when one is configured.
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+# Set on successful writes, holds the unix time until which the client reads from the primary.
+PRIMARY_PIN_COOKIE = "db_primary_until"
+
+
+def use_read_replica(request: Request) -> bool:
+    """Whether the request can be served from the read replica.
+
+    Writes always go to the primary, and so do reads of a client that wrote
+    something less than READ_YOUR_WRITES_SECONDS ago, so it never reads data
+    older than its own changes because of replication lag.
+    """
+    if not settings.READ_REPLICA_DATABASE_URI or request.method not in READ_METHODS:
+        return False
+    try:
+        pinned_until = float(request.cookies.get(PRIMARY_PIN_COOKIE, 0))
+    except ValueError:
+        return True
+    return pinned_until <= time.time()
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client to the primary for a while after each successful write."""
+
+    def __init__(self, app: ASGIApp, seconds: float) -> None:
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in READ_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "set-cookie",
+                    f"{PRIMARY_PIN_COOKIE}={time.time() + self.seconds:.3f}; "
+                    f"Max-Age={ceil(self.seconds)}; Path=/; HttpOnly; SameSite=lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
@@ -1,10 +1,37 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
-async_engine = create_async_engine(
-    settings.ASYNC_SQLALCHEMY_DATABASE_URI,
-    echo=settings.SQLALCHEMY_DATABASE_ECHO,
-)
+
+def create_engine(url: str) -> AsyncEngine:
+    """Engine with the pool and asyncpg settings from `Config`."""
+    url = make_url(url).update_query_dict(
+        # SQLAlchemy keeps its own cache of prepared statements on top of asyncpg's
+        {"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)},
+    )
+    return create_async_engine(
+        url,
+        echo=settings.SQLALCHEMY_DATABASE_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        connect_args={
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "command_timeout": settings.DB_COMMAND_TIMEOUT_SECONDS,
+        },
+    )
+
+
+async_engine = create_engine(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
 async_session = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Falls back to the primary when no replica is configured.
+async_read_engine = (
+    create_engine(settings.ASYNC_READ_REPLICA_DATABASE_URI)
+    if settings.READ_REPLICA_DATABASE_URI
+    else async_engine
+)
+async_read_session = sessionmaker(async_read_engine, class_=AsyncSession, expire_on_commit=False)
@@ -0,0 +1,31 @@
+from typing import NamedTuple
+
+
+class BBox(NamedTuple):
+    """Lng/lat box in GeoJSON order. `min_lng` > `max_lng` means the box crosses the
+    antimeridian, e.g. 170,-20,-170,-10 spans the 20 degrees around lng 180.
+    """
+
+    min_lng: float
+    min_lat: float
+    max_lng: float
+    max_lat: float
+
+    @property
+    def crosses_antimeridian(self) -> bool:
+        return self.min_lng > self.max_lng
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse a `min_lng,min_lat,max_lng,max_lat` string, raising ValueError if invalid."""
+    parts = value.split(",")
+    if len(parts) != 4:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    bbox = BBox(*(float(part) for part in parts))
+    if not all(-180 <= lng <= 180 for lng in (bbox.min_lng, bbox.max_lng)):
+        raise ValueError("bbox longitudes must be within [-180, 180]")
+    if not all(-90 <= lat <= 90 for lat in (bbox.min_lat, bbox.max_lat)):
+        raise ValueError("bbox latitudes must be within [-90, 90]")
+    if bbox.min_lat > bbox.max_lat:
+        raise ValueError("bbox min_lat must not be above max_lat")
+    return bbox
@@ -0,0 +1,89 @@
+from math import asin, cos, floor, sin
+from typing import List, Optional, Tuple
+
+from app.geo.index import DEG_TO_RAD, EARTH_RADIUS_KM
+
+# Fixed lat/lng grid used for the `charge_point.geo_cell` column.
+# NOTE changing these requires a migration since the column is computed by the database.
+CELL_SIZE_DEG = 0.25
+N_ROWS = 720  # 180 / CELL_SIZE_DEG
+N_COLS = 1440  # 360 / CELL_SIZE_DEG
+
+
+def cell_row(lat: float) -> int:
+    return min(int(floor((lat + 90) / CELL_SIZE_DEG)), N_ROWS - 1)
+
+
+def cell_col(lng: float) -> int:
+    return min(int(floor((lng + 180) / CELL_SIZE_DEG)), N_COLS - 1)
+
+
+def geo_cell(lat: float, lng: float) -> int:
+    """Python twin of `geo_cell_sql`, row-major cell id of the given lat/lng."""
+    return cell_row(lat) * N_COLS + cell_col(lng)
+
+
+def geo_cell_sql(lat_column: str, lng_column: str) -> str:
+    """SQL expression computing `geo_cell` from the given column names."""
+    return (
+        f"(LEAST(FLOOR(({lat_column} + 90) / {CELL_SIZE_DEG}), {N_ROWS - 1}) * {N_COLS}"
+        f" + LEAST(FLOOR(({lng_column} + 180) / {CELL_SIZE_DEG}), {N_COLS - 1}))::integer"
+    )
+
+
+class CellWindow:
+    """Square of cells within `radius` rows and columns of the cell holding lat/lng.
+
+    `col_ranges` is None when the window wraps all the way around the globe,
+    otherwise it holds inclusive column intervals split at the antimeridian.
+    """
+
+    def __init__(self, lat: float, lng: float, radius: int) -> None:
+        self.lat = lat
+        self.lng = lng
+        self.radius = radius
+        row, col = cell_row(lat), cell_col(lng)
+        self.row_lo = max(0, row - radius)
+        self.row_hi = min(N_ROWS - 1, row + radius)
+        self.col_lo = col - radius
+        self.col_hi = col + radius
+        self.col_ranges: Optional[List[Tuple[int, int]]]
+        if 2 * radius + 1 >= N_COLS:
+            self.col_ranges = None
+        elif self.col_lo < 0:
+            self.col_ranges = [(0, self.col_hi), (self.col_lo + N_COLS, N_COLS - 1)]
+        elif self.col_hi >= N_COLS:
+            self.col_ranges = [(self.col_lo, N_COLS - 1), (0, self.col_hi - N_COLS)]
+        else:
+            self.col_ranges = [(self.col_lo, self.col_hi)]
+
+    @property
+    def covers_globe(self) -> bool:
+        return self.col_ranges is None and self.row_lo == 0 and self.row_hi == N_ROWS - 1
+
+    def cell_ranges(self) -> List[Tuple[int, int]]:
+        """Inclusive `geo_cell` intervals, one per row and column interval."""
+        if self.col_ranges is None:
+            return [(self.row_lo * N_COLS, self.row_hi * N_COLS + N_COLS - 1)]
+        return [
+            (row * N_COLS + lo, row * N_COLS + hi)
+            for row in range(self.row_lo, self.row_hi + 1)
+            for lo, hi in self.col_ranges
+        ]
+
+    def min_outside_km(self) -> float:
+        """Lower bound on the distance from lat/lng to any point outside the window."""
+        gaps = []
+        if self.row_lo > 0:
+            gaps.append((self.lat - (self.row_lo * CELL_SIZE_DEG - 90)) * DEG_TO_RAD)
+        if self.row_hi < N_ROWS - 1:
+            gaps.append((((self.row_hi + 1) * CELL_SIZE_DEG - 90) - self.lat) * DEG_TO_RAD)
+        if self.col_ranges is not None:
+            lng_lo = self.col_lo * CELL_SIZE_DEG - 180
+            lng_hi = (self.col_hi + 1) * CELL_SIZE_DEG - 180
+            gap = min(self.lng - lng_lo, lng_hi - self.lng, 90) * DEG_TO_RAD
+            # distance from a point to the meridian `gap` radians of longitude away
+            gaps.append(asin(min(1.0, cos(self.lat * DEG_TO_RAD) * sin(gap))))
+        if not gaps:
+            return float("inf")
+        return max(0.0, min(gaps)) * EARTH_RADIUS_KM
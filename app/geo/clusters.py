@@ -0,0 +1,134 @@
+from math import floor
+from typing import List, Tuple
+
+from app.geo.bbox import BBox
+
+# Zoom levels clusters are kept for. At zoom z the world is a grid of square cells
+# 360 / (CELLS_PER_TILE * 2^z) degrees wide, i.e. CELLS_PER_TILE cells across each
+# 256 pixel map tile, so about 64 pixels per cluster.
+# NOTE changing these requires a migration since the database maintains the clusters.
+CLUSTER_MAX_ZOOM = 14
+CELLS_PER_TILE = 4
+# Clusters are only stored every this many zoom levels, counting down from
+# CLUSTER_MAX_ZOOM. A cell of zoom z is exactly the 2x2 cells of zoom z + 1 below it, so
+# the levels in between are merged from the next stored level when read. Every stored
+# level costs every write an upsert per changed row, see `cluster_trigger_ddl`.
+CLUSTER_ZOOM_STEP = 2
+
+
+def cluster_cols(zoom: int) -> int:
+    return CELLS_PER_TILE << zoom
+
+
+def cluster_cell_size(zoom: int) -> float:
+    return 360.0 / cluster_cols(zoom)
+
+
+def cluster_x(lng: float, zoom: int) -> int:
+    return min(int(floor((lng + 180) / cluster_cell_size(zoom))), cluster_cols(zoom) - 1)
+
+
+def cluster_y(lat: float, zoom: int) -> int:
+    return min(int(floor((lat + 90) / cluster_cell_size(zoom))), cluster_cols(zoom) // 2 - 1)
+
+
+def cluster_stored_zoom(zoom: int) -> int:
+    """The zoom level the clusters of `zoom` are merged from, see `CLUSTER_ZOOM_STEP`."""
+    return zoom + (CLUSTER_MAX_ZOOM - zoom) % CLUSTER_ZOOM_STEP
+
+
+def cluster_ranges(bbox: BBox, zoom: int) -> Tuple[Tuple[int, int], List[Tuple[int, int]]]:
+    """Inclusive y range and x ranges of the cells overlapping `bbox`, the x range is
+    split in two when the box crosses the antimeridian.
+    """
+    y_range = (cluster_y(bbox.min_lat, zoom), cluster_y(bbox.max_lat, zoom))
+    x_lo, x_hi = cluster_x(bbox.min_lng, zoom), cluster_x(bbox.max_lng, zoom)
+    if bbox.crosses_antimeridian:
+        return y_range, [(x_lo, cluster_cols(zoom) - 1), (0, x_hi)]
+    return y_range, [(x_lo, x_hi)]
+
+
+def _cells_sql(rows: str, sign: str) -> str:
+    """Cells of every stored zoom level of the `rows` charge points, with `sign` as their count.
+    NOTE the `lat` attribute is stored in the "longitude" column and vice versa.
+    """
+    cols = f"({CELLS_PER_TILE} << z)"
+    zooms = f"{CLUSTER_MAX_ZOOM % CLUSTER_ZOOM_STEP}, {CLUSTER_MAX_ZOOM}, {CLUSTER_ZOOM_STEP}"
+    return (
+        f"SELECT z AS zoom,"
+        f" LEAST(FLOOR((r.longitude + 90) / (360.0 / {cols})), {cols} / 2 - 1)::integer AS y,"
+        f" LEAST(FLOOR((r.latitude + 180) / (360.0 / {cols})), {cols} - 1)::integer AS x,"
+        f" {sign} AS count, {sign} * r.longitude AS lat_sum, {sign} * r.latitude AS lng_sum"
+        f" FROM {rows} AS r CROSS JOIN generate_series({zooms}) AS z"
+    )
+
+
+def _apply_sql(cells: str) -> str:
+    # ordered so that concurrent writers lock cluster rows in the same order
+    return (
+        "INSERT INTO charge_point_cluster (zoom, y, x, count, lat_sum, lng_sum)"
+        " SELECT zoom, y, x, SUM(count), SUM(lat_sum), SUM(lng_sum)"
+        f" FROM ({cells}) AS cells GROUP BY zoom, y, x ORDER BY zoom, y, x"
+        " ON CONFLICT (zoom, y, x) DO UPDATE SET"
+        " count = charge_point_cluster.count + excluded.count,"
+        " lat_sum = charge_point_cluster.lat_sum + excluded.lat_sum,"
+        " lng_sum = charge_point_cluster.lng_sum + excluded.lng_sum"
+    )
+
+
+def cluster_trigger_ddl() -> List[str]:
+    """Function and statement level triggers keeping `charge_point_cluster` in step with
+    every write to `charge_point`, including COPY. The changed rows of each statement are
+    aggregated per cell and applied as one upsert, and cells left empty are dropped.
+    """
+    # rows whose coordinates an update left alone do not change any cluster
+    moved = (
+        "(SELECT {side}.* FROM new_rows AS n JOIN old_rows AS o ON o.id = n.id"
+        " WHERE (n.longitude, n.latitude) IS DISTINCT FROM (o.longitude, o.latitude))"
+    )
+    moved_new, moved_old = moved.format(side="n"), moved.format(side="o")
+
+    def prune(rows: str) -> str:
+        return (
+            "DELETE FROM charge_point_cluster AS c"
+            f" USING ({_cells_sql(rows, '1')}) AS r"
+            " WHERE c.zoom = r.zoom AND c.y = r.y AND c.x = r.x AND c.count = 0"
+        )
+
+    function = (
+        "CREATE OR REPLACE FUNCTION charge_point_cluster_apply() RETURNS trigger AS $$\n"
+        "BEGIN\n"
+        "    IF TG_OP = 'INSERT' THEN\n"
+        f"        {_apply_sql(_cells_sql('new_rows', '1'))};\n"
+        "    ELSIF TG_OP = 'UPDATE' THEN\n"
+        f"        {_apply_sql(_cells_sql(moved_new, '1') + ' UNION ALL ' + _cells_sql(moved_old, '-1'))};\n"
+        f"        {prune(moved_old)};\n"
+        "    ELSIF TG_OP = 'DELETE' THEN\n"
+        f"        {_apply_sql(_cells_sql('old_rows', '-1'))};\n"
+        f"        {prune('old_rows')};\n"
+        "    ELSE\n"
+        "        TRUNCATE charge_point_cluster;\n"
+        "    END IF;\n"
+        "    RETURN NULL;\n"
+        "END\n"
+        "$$ LANGUAGE plpgsql"
+    )
+    return [
+        function,
+        "CREATE TRIGGER charge_point_cluster_insert AFTER INSERT ON charge_point"
+        " REFERENCING NEW TABLE AS new_rows"
+        " FOR EACH STATEMENT EXECUTE FUNCTION charge_point_cluster_apply()",
+        "CREATE TRIGGER charge_point_cluster_update AFTER UPDATE ON charge_point"
+        " REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"
+        " FOR EACH STATEMENT EXECUTE FUNCTION charge_point_cluster_apply()",
+        "CREATE TRIGGER charge_point_cluster_delete AFTER DELETE ON charge_point"
+        " REFERENCING OLD TABLE AS old_rows"
+        " FOR EACH STATEMENT EXECUTE FUNCTION charge_point_cluster_apply()",
+        "CREATE TRIGGER charge_point_cluster_truncate AFTER TRUNCATE ON charge_point"
+        " FOR EACH STATEMENT EXECUTE FUNCTION charge_point_cluster_apply()",
+    ]
+
+
+def cluster_backfill_sql() -> str:
+    """Rebuild the clusters of every existing charge point."""
+    return _apply_sql(_cells_sql("charge_point", "1"))
@@ -0,0 +1,78 @@
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from app.geo.index import EARTH_RADIUS_KM
+
+
+# Upper bound on the number of origin x point distances held in memory at once.
+CHUNK_ELEMENTS = 1 << 20
+
+
+class HaversineEngine:
+    """Vectorized haversine over a fixed set of points.
+
+    Coordinates are converted to radians once and kept in contiguous float64
+    arrays together with the cosine of each latitude, so a query is a handful of
+    numpy passes over the whole candidate set.
+    """
+
+    def __init__(self, lats: Iterable[float], lngs: Iterable[float]) -> None:
+        self.lat = np.ascontiguousarray(np.radians(np.asarray(lats, dtype=np.float64)))
+        self.lng = np.ascontiguousarray(np.radians(np.asarray(lngs, dtype=np.float64)))
+        self.cos_lat = np.cos(self.lat)
+
+    def __len__(self) -> int:
+        return self.lat.shape[0]
+
+    def distances(self, lat: float, lng: float) -> np.ndarray:
+        """Great-circle distance in km from lat/lng to every point."""
+        phi = np.radians(lat)
+        lam = np.radians(lng)
+        hav = np.sin((self.lat - phi) * 0.5) ** 2
+        hav += np.cos(phi) * self.cos_lat * np.sin((self.lng - lam) * 0.5) ** 2
+        np.clip(hav, 0.0, 1.0, out=hav)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(hav, out=hav), out=hav)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_km: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions and distances of the `k` closest points, closest first."""
+        distances = self.distances(lat, lng)
+        positions = np.arange(len(self)) if max_km is None else np.flatnonzero(distances <= max_km)
+        if k < positions.shape[0]:
+            positions = positions[np.argpartition(distances[positions], k - 1)[:k]]
+        positions = positions[np.argsort(distances[positions], kind="stable")]
+        return positions, distances[positions]
+
+    def nearest_many(
+        self,
+        lats: Iterable[float],
+        lngs: Iterable[float],
+        chunk_elements: int = CHUNK_ELEMENTS,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Position and distance of the closest point to each origin.
+
+        Origins are processed in chunks so that at most `chunk_elements`
+        distances are materialized at a time, whatever the batch size.
+        """
+        phi = np.radians(np.asarray(lats, dtype=np.float64))
+        lam = np.radians(np.asarray(lngs, dtype=np.float64))
+        positions = np.empty(phi.shape[0], dtype=np.intp)
+        distances = np.empty(phi.shape[0], dtype=np.float64)
+        chunk = max(1, chunk_elements // max(1, len(self)))
+        for start in range(0, phi.shape[0], chunk):
+            stop = start + chunk
+            c_phi = phi[start:stop, None]
+            c_lam = lam[start:stop, None]
+            hav = np.sin((self.lat - c_phi) * 0.5) ** 2
+            hav += np.cos(c_phi) * self.cos_lat * np.sin((self.lng - c_lam) * 0.5) ** 2
+            best = np.argmin(hav, axis=1)
+            positions[start:stop] = best
+            distances[start:stop] = hav[np.arange(best.shape[0]), best]
+        np.clip(distances, 0.0, 1.0, out=distances)
+        return positions, 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(distances))
@@ -0,0 +1,236 @@
+import heapq
+import threading
+from math import asin, cos, sin, sqrt
+from operator import itemgetter
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+EARTH_RADIUS_KM = 6371
+DEG_TO_RAD = 0.017453292519943295  # pi / 180
+
+# Entries are (x, y, z, key) tuples where (x, y, z) is a point on the unit sphere.
+Entry = Tuple[float, float, float, Hashable]
+
+
+def to_unit_vector(lat: float, lng: float) -> Tuple[float, float, float]:
+    """Project lat/lng onto the unit sphere."""
+    phi = lat * DEG_TO_RAD
+    lam = lng * DEG_TO_RAD
+    return (cos(phi) * cos(lam), cos(phi) * sin(lam), sin(phi))
+
+
+def chord_to_km(chord: float) -> float:
+    """Convert a straight line distance on the unit sphere to a great-circle distance.
+    The chord is 2 * sin(theta / 2) which is the same quantity the haversine formula
+    works with, so ranking by chord gives the same order as ranking by haversine.
+    """
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km: float) -> float:
+    """Inverse of `chord_to_km`."""
+    return 2 * sin(min(km / (2 * EARTH_RADIUS_KM), 1.5707963267948966))
+
+
+class _Leaf:
+    __slots__ = ("entries",)
+
+    def __init__(self, entries: List[Entry]) -> None:
+        self.entries = entries
+
+
+class _Node:
+    __slots__ = ("axis", "split", "left", "right")
+
+    def __init__(self, axis: int, split: float, left, right) -> None:
+        self.axis = axis
+        self.split = split
+        self.left = left
+        self.right = right
+
+
+def _build(entries: List[Entry], leaf_size: int):
+    if len(entries) <= leaf_size:
+        return _Leaf(entries)
+    spreads = [
+        max(e[axis] for e in entries) - min(e[axis] for e in entries)
+        for axis in range(3)
+    ]
+    axis = spreads.index(max(spreads))
+    entries.sort(key=itemgetter(axis))
+    mid = len(entries) // 2
+    return _Node(
+        axis,
+        entries[mid][axis],
+        _build(entries[:mid], leaf_size),
+        _build(entries[mid:], leaf_size),
+    )
+
+
+class SpatialIndex:
+    """In-memory KD-tree of points on the unit sphere keyed by an arbitrary id.
+
+    The tree itself is immutable. Writes since the last build are kept in a small
+    pending buffer that is scanned linearly, and removed or moved keys are
+    tombstoned so the tree skips them. Once the buffer grows past `rebuild_ratio`
+    of the indexed points `needs_rebuild` is set, and the owner of the index should
+    call `rebuild` off the event loop. Writes never rebuild the tree themselves.
+
+    All methods are safe to call from several threads.
+    """
+
+    def __init__(self, leaf_size: int = 16, rebuild_ratio: float = 0.05, min_rebuild: int = 256) -> None:
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self._lock = threading.RLock()
+        # keys written while `rebuild` builds a tree without the lock, None otherwise
+        self._touched: Optional[Set[Hashable]] = None
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self.loaded = False
+        self._points: Dict[Hashable, Entry] = {}
+        self._tree = None
+        self._pending: Dict[Hashable, Entry] = {}
+        self._stale: Set[Hashable] = set()
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._points
+
+    def matches(self, key: Hashable, lat: float, lng: float) -> bool:
+        """Whether `key` is indexed at exactly the given lat/lng."""
+        with self._lock:
+            entry = self._points.get(key)
+        return entry is not None and entry[:3] == to_unit_vector(lat, lng)
+
+    def load(self, points: Iterable[Tuple[Hashable, float, float]]) -> None:
+        """Replace the contents of the index with `(key, lat, lng)` triples."""
+        entries = {key: (*to_unit_vector(lat, lng), key) for key, lat, lng in points}
+        tree = _build(list(entries.values()), self.leaf_size) if entries else None
+        with self._lock:
+            self._reset()
+            self._points = entries
+            self._tree = tree
+            self.loaded = True
+
+    def upsert(self, key: Hashable, lat: float, lng: float) -> None:
+        entry = (*to_unit_vector(lat, lng), key)
+        with self._lock:
+            if key in self._points:
+                self._stale.add(key)
+            self._points[key] = entry
+            self._pending[key] = entry
+            if self._touched is not None:
+                self._touched.add(key)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            if self._points.pop(key, None) is None:
+                return
+            self._pending.pop(key, None)
+            self._stale.add(key)
+            if self._touched is not None:
+                self._touched.add(key)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_km: Optional[float] = None,
+    ) -> List[Tuple[Hashable, float]]:
+        """Return up to `k` `(key, distance_km)` pairs ordered by distance.
+        Branches further away than `max_km` are never visited.
+        """
+        q = to_unit_vector(lat, lng)
+        bound = km_to_chord(max_km) if max_km is not None else 2.0
+        # max-heap of (-squared chord, key) holding the best k so far
+        heap: List[Tuple[float, Hashable]] = []
+        bound2 = bound * bound
+        with self._lock:
+            if self._tree is not None:
+                self._search(self._tree, q, k, bound2, heap)
+            for entry in self._pending.values():
+                self._consider(entry, q, k, bound2, heap)
+        return [
+            (key, chord_to_km(sqrt(-neg_d2)))
+            for neg_d2, key in sorted(heap, reverse=True)
+        ]
+
+    def nearest_many(self, origins: Iterable[Tuple[float, float]]) -> List[Optional[Tuple[Hashable, float]]]:
+        """The `(key, distance_km)` of the closest point to each lat/lng origin, in order,
+        None per origin if the index is empty.
+        """
+        results = []
+        for lat, lng in origins:
+            found = self.nearest(lat, lng)
+            results.append(found[0] if found else None)
+        return results
+
+    def _consider(self, entry: Entry, q, k: int, bound2: float, heap) -> None:
+        dx = entry[0] - q[0]
+        dy = entry[1] - q[1]
+        dz = entry[2] - q[2]
+        d2 = dx * dx + dy * dy + dz * dz
+        if d2 > bound2:
+            return
+        if len(heap) < k:
+            heapq.heappush(heap, (-d2, entry[3]))
+        elif d2 < -heap[0][0]:
+            heapq.heapreplace(heap, (-d2, entry[3]))
+
+    def _search(self, node, q, k: int, bound2: float, heap) -> None:
+        if isinstance(node, _Leaf):
+            stale = self._stale
+            for entry in node.entries:
+                if stale and entry[3] in stale:
+                    continue
+                self._consider(entry, q, k, bound2, heap)
+            return
+        diff = q[node.axis] - node.split
+        near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+        self._search(near, q, k, bound2, heap)
+        worst = -heap[0][0] if len(heap) == k else bound2
+        if diff * diff <= worst:
+            self._search(far, q, k, bound2, heap)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """Whether the pending buffer grew past `rebuild_ratio` and no rebuild is running."""
+        with self._lock:
+            dirty = len(self._pending) + len(self._stale)
+            return self._touched is None and dirty > max(self.min_rebuild, self.rebuild_ratio * len(self._points))
+
+    def rebuild(self) -> None:
+        """Rebuild the tree from every indexed point and empty the pending buffer.
+
+        The tree is built from a snapshot without holding the lock, so searches and
+        writes carry on meanwhile. Writes made during the build stay buffered once the
+        new tree is swapped in. A rebuild while another one runs does nothing, and one
+        overtaken by `load` or `clear` is thrown away.
+        """
+        with self._lock:
+            if self._touched is not None:
+                return
+            self._touched = set()
+            points = self._points
+            entries = list(points.values())
+        tree = None
+        built = False
+        try:
+            tree = _build(entries, self.leaf_size) if entries else None
+            built = True
+        finally:
+            with self._lock:
+                touched, self._touched = self._touched, None
+                if built and self._points is points:
+                    self._tree = tree
+                    self._pending = {key: points[key] for key in touched if key in points}
+                    self._stale = touched
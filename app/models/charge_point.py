@@ -1,11 +1,20 @@
-from sqlalchemy import Column, Float, String
+from sqlalchemy import BigInteger, Column, Computed, Float, Index, Integer, String
 
 from app.db.base_class import Base
+from app.geo.cells import geo_cell_sql
 
 
 class ChargePoint(Base):
     __tablename__ = "charge_point"
+    __table_args__ = (
+        # Bounding box queries, a range on lat then a filter on lng within the index
+        Index("ix_charge_point_lat_lng", "longitude", "latitude"),
+    )
 
     lat = Column("longitude", Float, nullable=False)
     lng = Column("latitude", Float, nullable=False)
     location = Column(String, nullable=False)
+    # NOTE the `lat` attribute is stored in the "longitude" column and vice versa
+    geo_cell = Column(Integer, Computed(geo_cell_sql("longitude", "latitude"), persisted=True), index=True)
+    # Value of the table's counter in `app.models.revision` when the row was last written
+    revision = Column(BigInteger, nullable=False, server_default="0", index=True)
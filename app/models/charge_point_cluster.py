@@ -0,0 +1,24 @@
+from sqlalchemy import DDL, BigInteger, Column, Float, Integer, SmallInteger, Table, event
+
+from app.db.base_class import Base
+from app.geo.clusters import cluster_trigger_ddl
+from app.models.charge_point import ChargePoint
+
+# Charge point count and coordinate sums per grid cell of every zoom level, see
+# `app.geo.clusters`. Kept up to date by triggers on `charge_point`, so every write,
+# whether made through `CRUDBase`, a bulk import or by hand, moves the clusters with it
+# in the same transaction.
+charge_point_cluster_table = Table(
+    "charge_point_cluster",
+    Base.metadata,
+    Column("zoom", SmallInteger, primary_key=True),
+    Column("y", Integer, primary_key=True),
+    Column("x", Integer, primary_key=True),
+    Column("count", BigInteger, nullable=False),
+    Column("lat_sum", Float, nullable=False),
+    Column("lng_sum", Float, nullable=False),
+)
+
+for statement in cluster_trigger_ddl():
+    event.listen(ChargePoint.__table__, "after_create", DDL(statement))
+event.listen(ChargePoint.__table__, "after_drop", DDL("DROP FUNCTION IF EXISTS charge_point_cluster_apply()"))
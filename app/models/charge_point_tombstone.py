@@ -0,0 +1,14 @@
+from fastapi_users_db_sqlalchemy import GUID
+from sqlalchemy import BigInteger, Column, Table
+
+from app.db.base_class import Base
+
+# Id of every charge point deleted through `CRUDBase`, with the revision of its deletion,
+# so that `CRUDBase.get_changes` can tell clients syncing from an earlier revision which
+# charge points to drop. Ids are never reused, a tombstone is never removed.
+charge_point_tombstone_table = Table(
+    "charge_point_tombstone",
+    Base.metadata,
+    Column("id", GUID, primary_key=True),
+    Column("revision", BigInteger, nullable=False, index=True),
+)
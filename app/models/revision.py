@@ -0,0 +1,13 @@
+from sqlalchemy import BigInteger, Column, String, Table
+
+from app.db.base_class import Base
+
+# One counter per revisioned table, bumped inside every write transaction. The row lock
+# taken by the bump makes revisions commit in order, so a reader that has seen revision
+# N has seen every write up to N.
+revision_table = Table(
+    "revision",
+    Base.metadata,
+    Column("name", String, primary_key=True),
+    Column("value", BigInteger, nullable=False),
+)
@@ -1,7 +1,7 @@
 import uuid
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import Field
+from pydantic import Field, conlist, validator
 
 from app.schemas.base import BaseSchema
 
@@ -24,7 +24,85 @@ class ChargePointSchemaIn(ChargePointSchemaBase):
 
 class ChargePointSchema(ChargePointSchemaBase):
     id: uuid.UUID
+    # Used for ETags, never serialized
+    revision: Optional[int] = Field(None, exclude=True)
 
 
 class ChargePointSchemaOut(ChargePointSchema):
-    pass
\ No newline at end of file
+    pass
+
+
+class ChargePointSchemaNearestOut(ChargePointSchemaOut):
+    distance: float
+
+
+class ChargePointClusterOut(BaseSchema):
+    # centroid of the charge points in the cluster
+    lat: float
+    lng: float
+    count: int
+
+
+class ChargePointChangesOut(BaseSchema):
+    # revision the changes bring the client up to, its `since` next time
+    revision: int
+    # whether there are changes after `revision`, to be fetched straight away
+    more: bool
+    changed: List[ChargePointSchemaOut]
+    deleted: List[uuid.UUID]
+
+
+class CoordinatesSchema(BaseSchema):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+
+
+class ChargePointSchemaNearestBatchIn(BaseSchema):
+    origins: conlist(CoordinatesSchema, min_items=1, max_items=10_000)
+
+
+# Upper bound on the number of charge points changed by one bulk request.
+BULK_MAX_ITEMS = 1000
+
+
+def _unique_ids(ids: List[uuid.UUID]) -> List[uuid.UUID]:
+    if len(set(ids)) != len(ids):
+        raise ValueError("ids must be unique")
+    return ids
+
+
+class ChargePointSchemaBulkUpdateItem(ChargePointSchemaUpdate):
+    id: uuid.UUID
+
+
+class ChargePointSchemaBulkUpdateIn(BaseSchema):
+    items: conlist(ChargePointSchemaBulkUpdateItem, min_items=1, max_items=BULK_MAX_ITEMS)
+
+    @validator("items")
+    def unique_items(cls, items: List[ChargePointSchemaBulkUpdateItem]) -> List[ChargePointSchemaBulkUpdateItem]:
+        _unique_ids([item.id for item in items])
+        return items
+
+
+class ChargePointSchemaBulkDeleteIn(BaseSchema):
+    ids: conlist(uuid.UUID, min_items=1, max_items=BULK_MAX_ITEMS)
+
+    _unique_ids = validator("ids", allow_reuse=True)(_unique_ids)
+
+
+class ChargePointBulkResult(BaseSchema):
+    id: uuid.UUID
+    # 200 if the charge point was changed, 404 if it does not exist
+    status: int
+    charge_point: Optional[ChargePointSchemaOut] = None
+
+
+class ChargePointImportError(BaseSchema):
+    line: int
+    error: str
+
+
+class ChargePointImportReport(BaseSchema):
+    created: int
+    failed: int
+    errors: List[ChargePointImportError]
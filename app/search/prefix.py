@@ -0,0 +1,236 @@
+import heapq
+import re
+import sys
+import threading
+import unicodedata
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+_WORD = re.compile(r"\w+")
+
+# Match classes, best first: the whole text starts with the query, or every query
+# word starts a word of the text.
+PREFIX = 0
+WORD_PREFIX = 1
+
+# Sorts after any character, so (prefix + _LAST,) is past every word with that prefix
+_LAST = "\U0010ffff"
+
+Rank = Tuple
+
+# Items sorted per call of `sorted` by `_sorted_in_chunks`
+SORT_CHUNK = 16384
+
+
+def normalize(text: str) -> str:
+    """Case and accent insensitive form of `text` that matching is done on."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join(_WORD.findall("".join(c for c in decomposed if not unicodedata.combining(c))))
+
+
+class PrefixIndex:
+    """In-memory index of short texts, such as charge point locations, keyed by an
+    arbitrary id, for autocomplete.
+
+    Texts are matched on a prefix of the whole text or on prefixes of their words, so
+    "vila" finds "Port Vila" but not "Villa". Results are ranked whole text matches
+    first, then by the word matching the most selective query word, closest
+    completions first, then by text.
+
+    Like `app.geo.index.SpatialIndex` the sorted lists are immutable, writes since the
+    last build are kept in a pending buffer scanned linearly and removed or changed
+    keys are tombstoned, until the buffer grows past `rebuild_ratio` of the index and
+    `needs_rebuild` is set. Its owner should then call `rebuild` off the event loop.
+
+    All methods are safe to call from several threads.
+    """
+
+    def __init__(self, rebuild_ratio: float = 0.05, min_rebuild: int = 256) -> None:
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self._lock = threading.RLock()
+        # keys written while `rebuild` sorts without the lock, None otherwise
+        self._touched: Optional[Set[Hashable]] = None
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self.loaded = False
+        self._texts: Dict[Hashable, str] = {}
+        # (normalized text, key) and (word, normalized text, key) sorted
+        self._names: List[Tuple[str, Hashable]] = []
+        self._words: List[Tuple[str, str, Hashable]] = []
+        self._pending: Dict[Hashable, str] = {}
+        self._stale: Set[Hashable] = set()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._texts
+
+    def matches(self, key: Hashable, text: str) -> bool:
+        """Whether `key` is indexed with exactly the given text, after normalizing."""
+        with self._lock:
+            indexed = self._texts.get(key)
+        return indexed is not None and indexed == normalize(text)
+
+    def load(self, texts: Iterable[Tuple[Hashable, str]]) -> None:
+        """Replace the contents of the index with `(key, text)` pairs."""
+        normalized = {key: normalize(text) for key, text in texts}
+        names, words = self._build(normalized)
+        with self._lock:
+            self._reset()
+            self._texts = normalized
+            self._names = names
+            self._words = words
+            self.loaded = True
+
+    def upsert(self, key: Hashable, text: str) -> None:
+        normalized = normalize(text)
+        with self._lock:
+            if key in self._texts:
+                self._stale.add(key)
+            self._texts[key] = normalized
+            self._pending[key] = normalized
+            if self._touched is not None:
+                self._touched.add(key)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            if self._texts.pop(key, None) is None:
+                return
+            self._pending.pop(key, None)
+            self._stale.add(key)
+            if self._touched is not None:
+                self._touched.add(key)
+
+    def search(self, query: str, limit: int = 10) -> List[Hashable]:
+        """Keys of up to `limit` texts matching `query`, best first."""
+        query = normalize(query)
+        if not query:
+            return []
+        ranked: Dict[Hashable, Rank] = {}
+        with self._lock:
+            terms = self._by_selectivity(query.split(" "))
+            stale = self._stale
+            for matches in (self._ranked_names(query), self._ranked_words(terms)):
+                candidates = 0
+                for rank, key in matches:
+                    if key in stale or key in ranked:
+                        continue
+                    ranked[key] = rank
+                    candidates += 1
+                    if candidates == limit:
+                        break
+            for key, text in self._pending.items():
+                rank = _rank(text, query, terms)
+                if rank is not None:
+                    ranked[key] = rank
+        return sorted(ranked, key=ranked.__getitem__)[:limit]
+
+    def _word_range(self, term: str) -> Tuple[int, int]:
+        return bisect_left(self._words, (term,)), bisect_left(self._words, (term + _LAST,))
+
+    def _by_selectivity(self, terms: List[str]) -> List[str]:
+        """`terms` with the one prefixing the fewest indexed words first."""
+        if len(terms) == 1:
+            return terms
+
+        def matching_words(term: str) -> int:
+            lo, hi = self._word_range(term)
+            return hi - lo
+
+        return sorted(terms, key=matching_words)
+
+    def _ranked_names(self, query: str) -> Iterator[Tuple[Rank, Hashable]]:
+        names = self._names
+        for i in range(bisect_left(names, (query,)), len(names)):
+            text, key = names[i]
+            if not text.startswith(query):
+                return
+            yield (PREFIX, text), key
+
+    def _ranked_words(self, terms: List[str]) -> Iterator[Tuple[Rank, Hashable]]:
+        first, rest = terms[0], terms[1:]
+        words = self._words
+        lo, hi = self._word_range(first)
+        for i in range(lo, hi):
+            word, text, key = words[i]
+            if rest and not _has_word_prefixes(text, rest):
+                continue
+            yield (WORD_PREFIX, word, text), key
+
+    def _build(self, texts: Dict[Hashable, str]) -> Tuple[list, list]:
+        # keys are left out of the sort, comparing them is slow for UUIDs
+        names = _sorted_in_chunks([(text, key) for key, text in texts.items()], itemgetter(0))
+        words = _sorted_in_chunks(
+            [
+                (sys.intern(word), text, key)
+                for key, text in texts.items()
+                for word in set(text.split(" "))
+                if word
+            ],
+            itemgetter(0, 1),
+        )
+        return names, words
+
+    @property
+    def needs_rebuild(self) -> bool:
+        """Whether the pending buffer grew past `rebuild_ratio` and no rebuild is running."""
+        with self._lock:
+            dirty = len(self._pending) + len(self._stale)
+            return self._touched is None and dirty > max(self.min_rebuild, self.rebuild_ratio * len(self._texts))
+
+    def rebuild(self) -> None:
+        """Re-sort every indexed text and empty the pending buffer, like
+        `SpatialIndex.rebuild` without holding the lock while sorting.
+        """
+        with self._lock:
+            if self._touched is not None:
+                return
+            self._touched = set()
+            texts = self._texts
+            snapshot = dict(texts)
+        built = None
+        try:
+            built = self._build(snapshot)
+        finally:
+            with self._lock:
+                touched, self._touched = self._touched, None
+                if built is not None and self._texts is texts:
+                    self._names, self._words = built
+                    self._pending = {key: texts[key] for key in touched if key in texts}
+                    self._stale = touched
+
+
+def _sorted_in_chunks(items: list, key: Callable) -> list:
+    """`sorted(items, key=key)`, but sorting `SORT_CHUNK` items at a time and merging
+    them. A single `sorted` call holds the GIL until it is done, which stalls the event
+    loop for as long even when rebuilding in another thread.
+    """
+    if len(items) <= SORT_CHUNK:
+        return sorted(items, key=key)
+    chunks = [sorted(items[i:i + SORT_CHUNK], key=key) for i in range(0, len(items), SORT_CHUNK)]
+    return list(heapq.merge(*chunks, key=key))
+
+
+def _has_word_prefixes(text: str, terms: List[str]) -> bool:
+    words = text.split(" ")
+    return all(any(word.startswith(term) for word in words) for term in terms)
+
+
+def _rank(text: str, query: str, terms: List[str]) -> Optional[Rank]:
+    """Rank of a match of `text` as `search` orders them, None if it does not match."""
+    if text.startswith(query):
+        return PREFIX, text
+    if not _has_word_prefixes(text, terms[1:]):
+        return None
+    matched = [word for word in text.split(" ") if word.startswith(terms[0])]
+    if not matched:
+        return None
+    return WORD_PREFIX, min(matched), text
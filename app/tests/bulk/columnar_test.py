@@ -0,0 +1,43 @@
+import json
+import uuid
+from collections import namedtuple
+
+import pytest
+
+from app.api.responses import accepts_msgpack, charge_point_out
+from app.bulk.columnar import decode_charge_points, encode_charge_points
+
+Row = namedtuple("Row", ["id", "lat", "lng", "location"])
+
+
+@pytest.mark.parametrize("size", [0, 1, 15, 16, 1000])
+def test_columnar_round_trip(size: int) -> None:
+    rows = [
+        Row(uuid.uuid4(), -17.7333 + i / 1000, 168.3273 - i / 1000, f"Charge Point {i % 20}" + "é" * (i % 300))
+        for i in range(size)
+    ]
+    data = encode_charge_points(rows)
+    assert list(decode_charge_points(data)) == [row._asdict() for row in rows]
+    # batches are concatenated when streamed
+    assert list(decode_charge_points(data + data)) == [row._asdict() for row in rows] * 2
+
+
+def test_columnar_size() -> None:
+    rows = [Row(uuid.uuid4(), 40.7453297, -73.9929523, "Ampcontrol Office") for _ in range(1000)]
+    as_json = json.dumps([charge_point_out(row) for row in rows], default=str)
+    # 16 bytes id, 2 * 8 bytes coordinates and a 4 bytes string table index per point
+    assert len(encode_charge_points(rows)) < 40 * len(rows) < len(as_json) / 2
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, False),
+    ("*/*", False),
+    ("application/json", False),
+    ("application/x-msgpack", True),
+    ("application/json, application/x-msgpack", True),
+    ("application/json, application/x-msgpack;q=0.5", False),
+    ("application/json;q=0.5, application/x-msgpack", True),
+    ("application/x-msgpack;q=0, */*", False),
+])
+def test_accepts_msgpack(accept, expected: bool) -> None:
+    assert accepts_msgpack(accept) is expected
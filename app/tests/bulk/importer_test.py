@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.bulk.importer import CSV, NDJSON, ChargePointImporter, iter_lines
+from app.crud.charge_point import CRUDChargePoint
+
+pytestmark = pytest.mark.asyncio
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_iter_lines() -> None:
+    lines = [line async for line in iter_lines(stream(b"a,b\nc", "é\n".encode()[:1], "é\n".encode()[1:], b"d"))]
+    assert lines == ["a,b", "cé", "d"]
+
+
+async def test_import_csv(db_session: AsyncSession) -> None:
+    body = (
+        b"lat,lng,location\r\n"
+        b"-17,168,\"Port Vila, Vanuatu\"\r\n"
+        b"north,-73.99,Ampcontrol Office\r\n"
+        b"\r\n"
+        b"40.7357,-74.1724\r\n"
+        b"40.7453297,-73.9929523,Ampcontrol Office\r\n"
+    )
+    importer = ChargePointImporter(db_session, CSV, chunk_size=2)
+    report = await importer.run(iter_lines(stream(body)))
+    assert report.created == 2
+    assert report.failed == 2
+    assert [e.line for e in report.errors] == [3, 5]
+    assert "lat" in report.errors[0].error
+    assert "location" in report.errors[1].error
+    charge_points = list(await CRUDChargePoint(db_session).get_multi())
+    assert sorted(cp.location for cp in charge_points) == ["Ampcontrol Office", "Port Vila, Vanuatu"]
+
+
+async def test_import_csv__multiline_field(db_session: AsyncSession) -> None:
+    body = (
+        b"lat,lng,location\r\n"
+        b"-17,168,\"Port Vila,\r\n"
+        b"\r\n"
+        b"Vanuatu\"\r\n"
+        b"north,-73.99,\"Ampcontrol\r\n"
+        b"Office\"\r\n"
+        b"40.7453297,-73.9929523,\"Ampcontrol \"\"HQ\"\"\"\r\n"
+    )
+    # a chunk never ends inside a quoted field
+    importer = ChargePointImporter(db_session, CSV, chunk_size=2)
+    report = await importer.run(iter_lines(stream(body)))
+    assert report.created == 2
+    assert [e.line for e in report.errors] == [5]
+    charge_points = list(await CRUDChargePoint(db_session).get_multi())
+    assert sorted(cp.location for cp in charge_points) == ['Ampcontrol "HQ"', "Port Vila,\n\nVanuatu"]
+
+
+async def test_import_ndjson(db_session: AsyncSession) -> None:
+    body = (
+        b'{"lat": -17, "lng": 168, "location": "Port Vila, Vanuatu"}\n'
+        b'{"lat": -17, "lng": 168\n'
+        b'[1, 2, 3]\n'
+        b'{"lat": 40.7453297, "lng": -73.9929523, "location": "Ampcontrol Office"}'
+    )
+    importer = ChargePointImporter(db_session, NDJSON)
+    report = await importer.run(iter_lines(stream(body)))
+    assert report.created == 2
+    assert report.failed == 2
+    assert [e.line for e in report.errors] == [2, 3]
+
+
+async def test_import_unknown_format(db_session: AsyncSession) -> None:
+    with pytest.raises(ValueError):
+        ChargePointImporter(db_session, "xml")
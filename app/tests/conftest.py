@@ -6,7 +6,13 @@ from fastapi import FastAPI
 
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.users import get_user_manager
+from app.core.users import get_user_manager, user_token_cache
+from app.crud.charge_point import (
+    charge_point_cache,
+    charge_point_changes,
+    charge_point_index,
+    charge_point_search_index,
+)
 from app.db.base import Base
 from app.db.session import async_session, async_engine
 from app.models.user import User
@@ -22,6 +28,12 @@ def event_loop(request) -> Generator:
 
 @pytest_asyncio.fixture()
 async def db_session() -> AsyncSession:
+    # drops what the indexes watch, see `app.crud.charge_point._on_change`
+    await charge_point_changes.close()
+    charge_point_index.clear()
+    charge_point_search_index.clear()
+    charge_point_cache.clear()
+    user_token_cache.clear()
     async with async_engine.begin() as connection:
         await connection.run_sync(Base.metadata.drop_all)
         await connection.run_sync(Base.metadata.create_all)
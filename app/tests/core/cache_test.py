@@ -0,0 +1,89 @@
+from app.core.cache import MISSING, TTLCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cache_ttl_and_negative_ttl() -> None:
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=10, negative_ttl=1, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", MISSING)
+    assert cache.get("a") == 1
+    assert cache.get("b") is MISSING
+    clock.now = 2
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 3, "misses": 2, "evictions": 0}
+
+
+def test_cache_lru_eviction_and_invalidate() -> None:
+    cache = TTLCache(maxsize=2, ttl=10, negative_ttl=1)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_cache_disabled() -> None:
+    cache = TTLCache(maxsize=0, ttl=10, negative_ttl=1)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cache_entry_ttl_and_invalidate_where() -> None:
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=10, negative_ttl=1, clock=clock)
+    cache.set("a", 1, ttl=2)
+    cache.set("b", 2, ttl=100)
+    cache.set("c", 3, ttl=0)
+    assert cache.get("c") is None
+    clock.now = 3
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    clock.now = 11
+    assert cache.get("b") is None
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.invalidate_where(lambda value: value % 2 == 1) == 2
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_cache_generation() -> None:
+    cache = TTLCache(maxsize=2, ttl=10, negative_ttl=1)
+    generation = cache.generation()
+    cache.invalidate("a")
+    # read before "a" was invalidated, so not cached, while other keys are
+    cache.set("a", 1, generation=generation)
+    cache.set("b", 2, generation=generation)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    generation = cache.generation()
+    cache.set("a", 1, generation=generation)
+    assert cache.get("a") == 1
+    # once "a" is no longer among the recent invalidations older generations are refused
+    generation = cache.generation()
+    cache.invalidate("a")
+    cache.invalidate("c")
+    cache.invalidate("d")
+    cache.set("e", 5, generation=generation)
+    assert cache.get("e") is None
+    generation = cache.generation()
+    cache.invalidate_where(lambda value: False)
+    cache.set("f", 6, generation=generation)
+    assert cache.get("f") is None
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.executor import CPUExecutor, ExecutorBusy
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_executor_runs_off_loop() -> None:
+    executor = CPUExecutor("thread", max_workers=2, max_queue=2)
+    try:
+        main_thread = threading.get_ident()
+        assert await executor.run(threading.get_ident) != main_thread
+        assert await executor.run_local(sum, [1, 2, 3]) == 6
+        assert executor.in_flight == 0
+    finally:
+        executor.shutdown()
+
+
+async def test_executor_rejects_when_queue_full() -> None:
+    executor = CPUExecutor("thread", max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+        assert executor.in_flight == 2
+        with pytest.raises(ExecutorBusy):
+            await executor.run(release.wait)
+        release.set()
+        assert await running and await queued
+        assert executor.in_flight == 0
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,64 @@
+import json
+import os
+
+from app.core.metrics import Registry
+
+
+def make_registry(directory=None):
+    registry = Registry(directory)
+    requests = registry.counter("requests_total", "Requests.", ("route",))
+    in_flight = registry.gauge("in_flight", "In flight.")
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1))
+    return registry, requests, in_flight, latency
+
+
+def test_registry_text_format() -> None:
+    registry, requests, in_flight, latency = make_registry()
+    requests.inc(("/a",))
+    requests.inc(("/a",), 2)
+    requests.inc(('/"b"',))
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(("/a",), 0.1)
+    latency.observe(("/a",), 0.5)
+    latency.observe(("/a",), 3)
+    assert registry.collect().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/\\"b\\""} 1',
+        'requests_total{route="/a"} 3',
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight 1",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 3.6',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_registry_merges_workers(tmp_path) -> None:
+    registry, requests, in_flight, latency = make_registry(str(tmp_path))
+    requests.inc(("/a",))
+    in_flight.inc()
+    latency.observe(("/a",), 0.5)
+    collected = []
+    registry.collector("test", lambda: collected.append(True))
+    registry.write()
+    assert collected == [True]
+    snapshot = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+
+    # a live worker counts fully, a dead one only for counters and histograms
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(snapshot))
+    (tmp_path / "999999999.json").write_text(json.dumps(snapshot))
+    (tmp_path / "broken.json.tmp").write_text("{")
+    lines = registry.collect().splitlines()
+    assert 'requests_total{route="/a"} 3' in lines
+    assert "in_flight 2" in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 0' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'latency_seconds_count{route="/a"} 3' in lines
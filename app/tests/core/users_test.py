@@ -0,0 +1,86 @@
+import uuid
+
+import pytest
+from fastapi_users.manager import UserNotExists
+
+from app.core.users import UserManager, get_jwt_strategy, user_token_cache
+from app.schemas.user import UserDB
+
+pytestmark = pytest.mark.asyncio
+
+
+class StubUserManager:
+    def __init__(self, *users: UserDB) -> None:
+        self.users = {user.id: user for user in users}
+        self.calls = 0
+
+    async def get(self, user_id):
+        self.calls += 1
+        if user_id not in self.users:
+            raise UserNotExists()
+        return self.users[user_id]
+
+
+def make_user(**kwargs) -> UserDB:
+    return UserDB(id=uuid.uuid4(), email="user@example.com", hashed_password="x", **kwargs)
+
+
+async def test_read_token_is_cached() -> None:
+    user_token_cache.clear()
+    user = make_user()
+    manager = StubUserManager(user)
+    strategy = get_jwt_strategy()
+    token = await strategy.write_token(user)
+    assert await strategy.read_token(token, manager) == user
+    assert await strategy.read_token(token, manager) == user
+    assert manager.calls == 1
+    assert await strategy.read_token("not-a-token", manager) is None
+    assert await strategy.read_token(None, manager) is None
+
+
+async def test_read_token_unknown_user_not_cached() -> None:
+    user_token_cache.clear()
+    manager = StubUserManager()
+    strategy = get_jwt_strategy()
+    token = await strategy.write_token(make_user())
+    assert await strategy.read_token(token, manager) is None
+    assert await strategy.read_token(token, manager) is None
+    assert manager.calls == 2
+
+
+async def test_user_update_invalidates_cached_tokens() -> None:
+    user_token_cache.clear()
+    user = make_user()
+    other = make_user()
+    manager = StubUserManager(user, other)
+    strategy = get_jwt_strategy()
+    token = await strategy.write_token(user)
+    other_token = await strategy.write_token(other)
+    await strategy.read_token(token, manager)
+    await strategy.read_token(other_token, manager)
+
+    deactivated = user.copy(update={"is_active": False})
+    manager.users[user.id] = deactivated
+    await UserManager(None).on_after_update(deactivated, {"is_active": False})
+    assert await strategy.read_token(token, manager) == deactivated
+    await strategy.read_token(other_token, manager)
+    assert manager.calls == 3
+
+
+async def test_user_update_while_reading_token() -> None:
+    user_token_cache.clear()
+    user = make_user()
+    deactivated = user.copy(update={"is_active": False})
+    strategy = get_jwt_strategy()
+    token = await strategy.write_token(user)
+
+    class UpdatedWhileReading(StubUserManager):
+        async def get(self, user_id):
+            found = await super().get(user_id)
+            self.users[user_id] = deactivated
+            await UserManager(None).on_after_update(deactivated, {"is_active": False})
+            return found
+
+    manager = UpdatedWhileReading(user)
+    assert await strategy.read_token(token, manager) == user
+    assert await strategy.read_token(token, manager) == deactivated
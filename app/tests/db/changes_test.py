@@ -0,0 +1,116 @@
+import asyncio
+
+import asyncpg
+import orjson
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.charge_point import CHARGE_POINT_CHANNEL, CRUDChargePoint
+from app.db.changes import CREATED, DELETED, MAX_PAYLOAD_BYTES, UPDATED, ChangeFeed, change_event, sse_message
+from app.db.session import async_engine
+from app.schemas.charge_point import ChargePointSchemaIn, ChargePointSchemaUpdate
+
+CHANNEL = "changes_test"
+
+
+def test_change_event() -> None:
+    payload = change_event(UPDATED, 7, {"id": "a", "location": "Port Vila"})
+    assert orjson.loads(payload) == {"op": UPDATED, "revision": 7, "item": {"id": "a", "location": "Port Vila"}}
+    assert sse_message(payload) == f"event: updated\nid: 7\ndata: {payload}\n\n".encode()
+    assert sse_message(change_event(CREATED, None, {"id": "a"})).startswith(b"event: created\ndata: ")
+    # too large for NOTIFY, only the id is sent
+    payload = change_event(CREATED, 8, {"id": "a", "location": "x" * MAX_PAYLOAD_BYTES})
+    assert orjson.loads(payload)["item"] == {"id": "a"}
+
+
+@pytest.mark.asyncio
+async def test_change_feed_listens() -> None:
+    feed = ChangeFeed(CHANNEL, settings.SQLALCHEMY_DATABASE_URI, buffer_size=10)
+    first, second = await feed.subscribe(), await feed.subscribe()
+    assert len(feed) == 2
+    connection = await asyncpg.connect(settings.SQLALCHEMY_DATABASE_URI)
+    try:
+        payload = change_event(DELETED, 3, {"id": "a"})
+        await connection.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+        assert await asyncio.wait_for(first.get(), 5) == sse_message(payload)
+        assert await asyncio.wait_for(second.get(), 5) == sse_message(payload)
+        # nothing is heard of rolled back writes
+        transaction = connection.transaction()
+        await transaction.start()
+        await connection.execute("SELECT pg_notify($1, $2)", CHANNEL, change_event(CREATED, 4, {"id": "b"}))
+        await transaction.rollback()
+    finally:
+        await connection.close()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(first.get(), 0.2)
+    feed.unsubscribe(second)
+    await feed.close()
+    assert len(feed) == 0
+    assert await first.get() is None
+
+
+@pytest.mark.asyncio
+async def test_change_feed_drops_slow_subscribers() -> None:
+    feed = ChangeFeed(CHANNEL, settings.SQLALCHEMY_DATABASE_URI, buffer_size=2)
+    slow, fast = await feed.subscribe(), await feed.subscribe()
+    payloads = [change_event(UPDATED, revision, {"id": "a"}) for revision in range(3)]
+    for payload in payloads:
+        feed._on_notification(None, 0, CHANNEL, payload)
+        assert await fast.get() == sse_message(payload)
+    # the slow subscriber is dropped once its buffer is full, what it missed is discarded
+    assert len(feed) == 1
+    assert await slow.get() is None
+    await feed.close()
+    assert await fast.get() is None
+
+
+@pytest.mark.asyncio
+async def test_change_feed_watch() -> None:
+    feed = ChangeFeed(CHANNEL, settings.SQLALCHEMY_DATABASE_URI, buffer_size=1)
+    heard = []
+
+    def failing(event):
+        raise ValueError(event)
+
+    await feed.watch(failing)
+    await feed.watch(heard.append)
+    payloads = [change_event(UPDATED, revision, {"id": "a"}) for revision in range(3)]
+    for payload in payloads:
+        feed._on_notification(None, 0, CHANNEL, payload)
+    # watchers are never dropped for being slow, nor for failing
+    assert heard == [orjson.loads(payload) for payload in payloads]
+    await feed.close()
+    assert heard[-1] is None
+
+
+@pytest.mark.asyncio
+async def test_crud_notifies_changes(db_session: AsyncSession) -> None:
+    notified = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "pg_notify" in statement:
+            channel, payloads = parameters
+            assert channel == CHARGE_POINT_CHANNEL
+            notified.extend(map(orjson.loads, payloads))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        crud_cp = CRUDChargePoint(db_session)
+        cp = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila"))
+        await crud_cp.update(cp.id, ChargePointSchemaUpdate(location="Mele"))
+        others = await crud_cp.bulk_create([
+            ChargePointSchemaIn(lat=1, lng=2, location="One"),
+            ChargePointSchemaIn(lat=3, lng=4, location="Two"),
+        ])
+        await crud_cp.delete(cp.id)
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", capture)
+    assert [(n["op"], n["item"]["location"]) for n in notified] == [
+        (CREATED, "Port Vila"), (UPDATED, "Mele"), (CREATED, "One"), (CREATED, "Two"), (DELETED, "Mele"),
+    ]
+    assert notified[0]["item"]["id"] == str(cp.id)
+    assert [n["item"]["id"] for n in notified[2:4]] == [str(o.id) for o in others]
+    # a bulk write is one revision, and a delete is stamped with its own
+    assert [n["revision"] for n in notified] == [1, 2, 3, 3, 4]
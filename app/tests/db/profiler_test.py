@@ -0,0 +1,46 @@
+import pytest
+from fastapi import Depends, FastAPI
+from httpx import AsyncClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.deps.db import get_db
+from app.db import profiler as profiler_module
+from app.db.profiler import QueryProfiler, QueryProfilerMiddleware, normalize_sql
+from app.db.session import async_engine
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_normalize_sql() -> None:
+    assert normalize_sql(
+        "SELECT *\n  FROM charge_point\n WHERE id IN ($1, $2, $3) AND location = 'it''s' LIMIT 10"
+    ) == "SELECT * FROM charge_point WHERE id IN (...) AND location = ? LIMIT ?"
+    assert normalize_sql("SELECT geo_cell_2 FROM t WHERE x = $1") == "SELECT geo_cell_2 FROM t WHERE x = $1"
+
+
+async def test_query_profiler(monkeypatch, app: FastAPI, db_session: AsyncSession) -> None:
+    logged = []
+    monkeypatch.setattr(profiler_module.logger, "warning", lambda *args: logged.append(args))
+    profiler = QueryProfiler(slow_threshold_ms=0)
+    profiler.install(async_engine)
+    profiler.install(async_engine)
+
+    @app.get("/two-queries")
+    async def two_queries(db: AsyncSession = Depends(get_db)):
+        await db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT  'a'  ,\n 2"))
+        return {}
+
+    app.add_middleware(QueryProfilerMiddleware)
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            resp = await client.get("/two-queries")
+    finally:
+        profiler.uninstall(async_engine)
+        profiler.uninstall(async_engine)
+
+    timing = resp.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    assert timing.endswith('desc="2 queries"')
+    assert [args[2] for args in logged] == ["SELECT ?", "SELECT ? , ?"]
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from httpx import AsyncClient
+
+from app.core.config import settings
+from app.db.routing import PRIMARY_PIN_COOKIE, ReadYourWritesMiddleware, use_read_replica
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+def replica(monkeypatch) -> None:
+    monkeypatch.setattr(settings, "READ_REPLICA_DATABASE_URI", "postgresql://replica/app")
+
+
+@pytest.fixture()
+def routing_app(replica) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware, seconds=5)
+
+    @app.get("/read")
+    async def read(request: Request):
+        return {"replica": use_read_replica(request)}
+
+    @app.post("/write")
+    async def write():
+        return {}
+
+    @app.post("/fail", status_code=400)
+    async def fail():
+        return {}
+
+    return app
+
+
+def make_request(method: str, cookie: str = None) -> Request:
+    headers = [] if cookie is None else [(b"cookie", f"{PRIMARY_PIN_COOKIE}={cookie}".encode())]
+    return Request({"type": "http", "method": method, "headers": headers})
+
+
+async def test_use_read_replica(replica) -> None:
+    assert use_read_replica(make_request("GET"))
+    assert use_read_replica(make_request("HEAD"))
+    assert not use_read_replica(make_request("POST"))
+    assert not use_read_replica(make_request("GET", str(time.time() + 60)))
+    assert use_read_replica(make_request("GET", str(time.time() - 1)))
+    assert use_read_replica(make_request("GET", "garbage"))
+
+
+async def test_use_read_replica_without_replica() -> None:
+    assert settings.READ_REPLICA_DATABASE_URI is None
+    assert not use_read_replica(make_request("GET"))
+
+
+async def test_reads_pinned_to_primary_after_write(routing_app: FastAPI) -> None:
+    async with AsyncClient(app=routing_app, base_url="http://test") as client:
+        assert (await client.get("/read")).json() == {"replica": True}
+        await client.post("/fail")
+        assert (await client.get("/read")).json() == {"replica": True}
+        resp = await client.post("/write")
+        assert PRIMARY_PIN_COOKIE in resp.cookies
+        assert (await client.get("/read")).json() == {"replica": False}
@@ -1,18 +1,47 @@
+from collections import Counter
+from contextlib import asynccontextmanager
 from unittest import mock
+import csv
+import io
+import json
+import random
 import uuid
+from math import asin, cos, sqrt
 import pytest
 from httpx import AsyncClient
-from fastapi import status
+from fastapi import FastAPI, status
+from sqlalchemy import false, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.api.deps.user import current_active_user
+from app.bulk.columnar import decode_charge_points
 from app.core.config import settings
-from app.crud.charge_point import CRUDChargePoint
-from app.schemas.charge_point import ChargePointSchemaIn
+from app.crud import charge_point as crud_charge_point
+from app.crud.charge_point import (
+    CHARGE_POINT_CHANNEL,
+    CRUDChargePoint,
+    charge_point_cache,
+    charge_point_changes,
+    charge_point_index,
+)
+from app.db.changes import CREATED, DELETED, UPDATED, change_event
+from app.geo.clusters import CLUSTER_MAX_ZOOM, cluster_x, cluster_y
+from app.db.exceptions import DoesNotExist, RevisionMismatch
+from app.models.charge_point import ChargePoint
+from app.schemas.charge_point import ChargePointSchema, ChargePointSchemaIn, ChargePointSchemaUpdate
 from app.tests.utils.user import user_authentication_headers
 
 pytestmark = pytest.mark.asyncio
 
 
+def haversine(lat1, lng1, lat2, lng2):
+    p = 0.017453292519943295
+    hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
+        cos(lat1 * p) * cos(lat2 * p) * \
+        (1 - cos((lng2 - lng1) * p)) / 2
+    return 12742 * asin(sqrt(hav))
+
+
 # TODO fix creating user for testing
 # async def test_charge_point_create(
 #     async_client: AsyncClient,
@@ -78,6 +107,76 @@ async def test_charge_point_get_by_id__fails_id(
     assert resp.status_code == status.HTTP_404_NOT_FOUND
 
 
+async def test_charge_point_get_by_id__cached(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    charge_point = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    for _ in range(3):
+        resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/{charge_point.id}")
+        assert resp.status_code == status.HTTP_200_OK
+    assert charge_point_cache.stats()["hits"] == 2
+    assert charge_point_cache.stats()["misses"] == 1
+    # updates are visible straight away
+    await crud_cp.update(charge_point.id, ChargePointSchemaUpdate(location="Luganville, Vanuatu"))
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/{charge_point.id}")
+    assert resp.json()["location"] == "Luganville, Vanuatu"
+    # and so are deletes
+    await crud_cp.delete(charge_point.id)
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/{charge_point.id}")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    # negative lookups are cached too
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/{charge_point.id}")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    assert charge_point_cache.stats()["hits"] == 3
+
+
+async def test_charge_point_get_by_id__lagging_replica(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    charge_point = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+
+    async def not_replicated_yet(self, item_id):
+        return None
+
+    monkeypatch.setattr(CRUDChargePoint, "_reads_replica", lambda self: True)
+    monkeypatch.setattr(CRUDChargePoint, "_get_one", not_replicated_yet)
+    with pytest.raises(DoesNotExist):
+        await crud_cp.get_by_id(charge_point.id)
+    monkeypatch.undo()
+    # what the replica read is not cached for reads of the primary
+    assert await crud_cp.get_by_id(charge_point.id) == charge_point
+    assert charge_point_cache.stats()["hits"] == 0
+    # nor is a row another process has since written, once changes are watched
+    await crud_cp.load_index()
+    payload = change_event(UPDATED, charge_point.revision + 1, charge_point.dict())
+    charge_point_changes._on_notification(None, 0, CHARGE_POINT_CHANNEL, payload)
+    assert charge_point_cache.get(charge_point.id) is None
+
+
+async def test_charge_point_get_by_id__cached_write_race(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    charge_point = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    get_one = CRUDChargePoint._get_one
+
+    async def get_one_then_update(self, item_id):
+        # the row is read, then a concurrent request updates it before it is cached
+        item = self._schema.from_orm(await get_one(self, item_id))
+        monkeypatch.setattr(CRUDChargePoint, "_get_one", get_one)
+        await crud_cp.update(item_id, ChargePointSchemaUpdate(location="Luganville, Vanuatu"))
+        return item
+
+    monkeypatch.setattr(CRUDChargePoint, "_get_one", get_one_then_update)
+    assert (await crud_cp.get_by_id(charge_point.id)).location == "Port Vila, Vanuatu"
+    assert (await crud_cp.get_by_id(charge_point.id)).location == "Luganville, Vanuatu"
+
+
 async def test_charge_point_nearest(
     async_client: AsyncClient,
     db_session: AsyncSession,
@@ -160,6 +259,224 @@ async def test_charge_point_nearest(
     }
 
 
+async def test_charge_point_nearest__k_and_max_km(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    cp_vu = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    cp_ny = await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    cp_nj = await crud_cp.create(ChargePointSchemaIn(lat=40.7357, lng=-74.1724, location="Newark, New Jersey"))
+    # k nearest, sorted by distance
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 40.75,
+            "lng": -74,
+            "k": 10,
+        },
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert [cp["id"] for cp in resp.json()] == [str(cp_ny.id), str(cp_nj.id), str(cp_vu.id)]
+    distances = [cp["distance"] for cp in resp.json()]
+    assert distances == sorted(distances)
+    assert distances[0] == pytest.approx(haversine(40.75, -74, cp_ny.lat, cp_ny.lng))
+    # bounded by radius
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 40.75,
+            "lng": -74,
+            "k": 10,
+            "max_km": 25,
+        },
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert [cp["id"] for cp in resp.json()] == [str(cp_ny.id), str(cp_nj.id)]
+    # nothing within radius
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 0,
+            "lng": 0,
+            "k": 1,
+            "max_km": 25,
+        },
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == []
+    # and without k, where the nearest is returned on its own
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 0,
+            "lng": 0,
+            "max_km": 25,
+        },
+    )
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_charge_point_nearest__by_cell(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "SPATIAL_INDEX_ENABLED", False)
+    crud_cp = CRUDChargePoint(db_session)
+    cp_vu = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    cp_ny = await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    cp_nj = await crud_cp.create(ChargePointSchemaIn(lat=40.7357, lng=-74.1724, location="Newark, New Jersey"))
+    for params, expected in [
+        ({"lat": 40.75, "lng": -74, "k": 1}, [cp_ny]),
+        ({"lat": 40.75, "lng": -74, "k": 10}, [cp_ny, cp_nj, cp_vu]),
+        ({"lat": 40.75, "lng": -74, "k": 10, "max_km": 25}, [cp_ny, cp_nj]),
+        ({"lat": -90, "lng": 180, "k": 1}, [cp_vu]),
+        ({"lat": -17, "lng": -179.9, "k": 1}, [cp_vu]),
+        ({"lat": 0, "lng": 0, "k": 1, "max_km": 25}, []),
+    ]:
+        resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/nearest", params=params)
+        assert resp.status_code == status.HTTP_200_OK
+        assert [cp["id"] for cp in resp.json()] == [str(cp.id) for cp in expected]
+
+
+async def test_charge_point_nearest__lagging_replica(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila, Vanuatu"))
+    await crud_cp.load_index()
+    await crud_cp.load_search_index()
+
+    class LaggingReplica:
+        """Read session of a replica that has not caught up with any of the writes."""
+
+        async def execute(self, query):
+            return await db_session.execute(query.filter(false()))
+
+    @asynccontextmanager
+    async def primary():
+        yield db_session
+
+    monkeypatch.setattr(crud_charge_point, "async_session", primary)
+    monkeypatch.setattr(CRUDChargePoint, "_reads_replica", lambda self: True)
+    replica_cp = CRUDChargePoint(LaggingReplica())
+    # what the replica is missing is read from the primary rather than dropped from the indexes
+    assert [(cp.id, distance) for cp, distance in await replica_cp.find_nearest(-17.7333, 168.3273)] == [(vila.id, 0)]
+    assert [cp.id for cp in await replica_cp.search("vila")] == [vila.id]
+    assert charge_point_index.matches(vila.id, vila.lat, vila.lng)
+
+
+async def test_charge_point_nearest__other_processes(
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    far = await crud_cp.create(ChargePointSchemaIn(lat=10, lng=10, location="Far"))
+    gone = await crud_cp.create(ChargePointSchemaIn(lat=0.01, lng=0.01, location="Gone"))
+
+    def written_elsewhere(op: str, cp: ChargePointSchema) -> None:
+        """Hear of a write as if another process made it, see `_on_change`."""
+        payload = change_event(op, cp.revision, cp.dict())
+        charge_point_changes._on_notification(None, 0, CHARGE_POINT_CHANNEL, payload)
+
+    # a write committed after the rows were read is replayed over them
+    execute = db_session.execute
+
+    async def read_then_delete(query):
+        rows = await execute(query)
+        written_elsewhere(DELETED, gone)
+        return rows
+
+    monkeypatch.setattr(db_session, "execute", read_then_delete)
+    await crud_cp.load_index()
+    monkeypatch.undo()
+    assert gone.id not in charge_point_index and far.id in charge_point_index
+
+    row = ChargePoint(id=uuid.uuid4(), lat=0, lng=0.0135, location="Near")
+    db_session.add(row)
+    await db_session.flush()
+    await db_session.refresh(row)
+    near = ChargePointSchema.from_orm(row)
+    written_elsewhere(CREATED, near)
+    assert [cp.id for cp, _ in await crud_cp.find_nearest(0, 0)] == [near.id]
+    row.lng = 20
+    await db_session.flush()
+    await db_session.refresh(row)
+    written_elsewhere(UPDATED, ChargePointSchema.from_orm(row))
+    assert [cp.id for cp, _ in await crud_cp.find_nearest(0, 0)] == [far.id]
+
+    # announced by id only, the item is read back from the primary
+    @asynccontextmanager
+    async def primary():
+        yield db_session
+
+    monkeypatch.setattr(crud_charge_point, "async_session", primary)
+    charge_point_index.upsert(far.id, 0, 0)
+    await crud_charge_point._refresh(far.id)
+    assert charge_point_index.matches(far.id, far.lat, far.lng)
+    await db_session.delete(row)
+    await db_session.flush()
+    await crud_charge_point._refresh(near.id)
+    assert near.id not in charge_point_index
+    # events may have been missed once the feed is closed, the index is reloaded on next use
+    await charge_point_changes.close()
+    assert not charge_point_index.loaded
+
+
+@pytest.mark.parametrize("spatial_index", [True, False])
+async def test_charge_point_nearest_batch(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+    monkeypatch: pytest.MonkeyPatch,
+    spatial_index: bool,
+) -> None:
+    monkeypatch.setattr(settings, "SPATIAL_INDEX_ENABLED", spatial_index)
+    # no charge points yet
+    resp = await async_client.post(
+        f"{settings.API_V1_STR}/charge_points/nearest/batch",
+        json={"origins": [{"lat": 0, "lng": 0}]},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == [None]
+
+    crud_cp = CRUDChargePoint(db_session)
+    cp_vu = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    cp_ny = await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    origins = [
+        {"lat": 40, "lng": -70},
+        {"lat": -10, "lng": 150},
+        {"lat": 90, "lng": -180},
+        {"lat": -90, "lng": 180},
+    ]
+    resp = await async_client.post(
+        f"{settings.API_V1_STR}/charge_points/nearest/batch",
+        json={"origins": origins},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert [cp["id"] for cp in resp.json()] == [str(cp_ny.id), str(cp_vu.id), str(cp_ny.id), str(cp_vu.id)]
+    assert resp.json()[0]["distance"] == pytest.approx(haversine(40, -70, cp_ny.lat, cp_ny.lng))
+
+    if spatial_index:
+        # a point deleted by another process is dropped from the index
+        charge_point_index.upsert(uuid.uuid4(), 40, -70)
+        resp = await async_client.post(
+            f"{settings.API_V1_STR}/charge_points/nearest/batch",
+            json={"origins": origins[:2]},
+        )
+        assert [cp["id"] for cp in resp.json()] == [str(cp_ny.id), str(cp_vu.id)]
+        assert len(charge_point_index) == 2
+
+    # invalid origins
+    for origins in [[], [{"lat": 91, "lng": 0}], [{"lat": 0}]]:
+        resp = await async_client.post(
+            f"{settings.API_V1_STR}/charge_points/nearest/batch",
+            json={"origins": origins},
+        )
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 async def test_charge_point_nearest__fails_params(
     async_client: AsyncClient,
     db_session: AsyncSession,
@@ -203,4 +520,443 @@ async def test_charge_point_nearest__fails_params(
             "lng": 1_000_000,
         }
     )
-    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
\ No newline at end of file
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    # invalid k value
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 40,
+            "lng": -70,
+            "k": 0,
+        }
+    )
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    # invalid max_km value
+    resp = await async_client.get(
+        f"{settings.API_V1_STR}/charge_points/nearest",
+        params={
+            "lat": 40,
+            "lng": -70,
+            "max_km": -1,
+        }
+    )
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_charge_point_export(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    cp_vu = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    cp_ny = await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    # NDJSON
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/export")
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(rows, key=lambda r: r["location"]) == [
+        {"id": str(cp_ny.id), "lat": cp_ny.lat, "lng": cp_ny.lng, "location": cp_ny.location},
+        {"id": str(cp_vu.id), "lat": cp_vu.lat, "lng": cp_vu.lng, "location": cp_vu.location},
+    ]
+    # CSV
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/export", params={"format": "csv"})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert sorted(r["id"] for r in rows) == sorted([str(cp_vu.id), str(cp_ny.id)])
+    assert {r["location"] for r in rows} == {"Port Vila, Vanuatu", "Ampcontrol Office"}
+    # MessagePack, by format or Accept header
+    for params, headers in (({"format": "msgpack"}, {}), ({}, {"Accept": "application/x-msgpack"})):
+        resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/export", params=params, headers=headers)
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"] == "application/x-msgpack"
+        rows = list(decode_charge_points(resp.content))
+        assert sorted(rows, key=lambda r: r["location"]) == [
+            {"id": cp_ny.id, "lat": cp_ny.lat, "lng": cp_ny.lng, "location": cp_ny.location},
+            {"id": cp_vu.id, "lat": cp_vu.lat, "lng": cp_vu.lng, "location": cp_vu.location},
+        ]
+    # invalid format
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/export", params={"format": "xml"})
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_charge_point_list__cursor(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    created = [
+        await crud_cp.create(ChargePointSchemaIn(lat=i, lng=i, location=f"Charge Point {i}"))
+        for i in range(5)
+    ]
+    ids, cursor = [], None
+    for _ in range(3):
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/", params=params)
+        assert resp.status_code == status.HTTP_200_OK
+        ids.extend(cp["id"] for cp in resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+    assert cursor is None
+    assert ids == sorted(str(cp.id) for cp in created)
+    # legacy offset pagination follows the same order
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/", params={"skip": 2, "limit": 2})
+    assert [cp["id"] for cp in resp.json()] == ids[2:4]
+    # invalid cursor
+    resp = await async_client.get(f"{settings.API_V1_STR}/charge_points/", params={"cursor": "not-a-cursor"})
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_charge_point_etag(
+    app: FastAPI,
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    app.dependency_overrides[current_active_user] = lambda: None
+    crud_cp = CRUDChargePoint(db_session)
+    charge_point = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    url = f"{settings.API_V1_STR}/charge_points/{charge_point.id}"
+    # conditional GET of an item
+    resp = await async_client.get(url)
+    etag = resp.headers["ETag"]
+    resp = await async_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+    assert resp.content == b""
+    # conditional GET of the list
+    list_url = f"{settings.API_V1_STR}/charge_points/"
+    resp = await async_client.get(list_url)
+    list_etag = resp.headers["ETag"]
+    resp = await async_client.get(list_url, headers={"If-None-Match": list_etag})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+    resp = await async_client.get(list_url, params={"limit": 1}, headers={"If-None-Match": list_etag})
+    assert resp.status_code == status.HTTP_200_OK
+    # writes with a stale ETag are refused
+    payload = {"location": "Luganville, Vanuatu"}
+    resp = await async_client.put(url, json=payload, headers={"If-Match": '"0"'})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+    resp = await async_client.put(url, json=payload, headers={"If-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["ETag"] != etag
+    resp = await async_client.delete(url, headers={"If-Match": etag})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+    # and every cached representation is now stale
+    resp = await async_client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["location"] == "Luganville, Vanuatu"
+    resp = await async_client.get(list_url, headers={"If-None-Match": list_etag})
+    assert resp.status_code == status.HTTP_200_OK
+    resp = await async_client.delete(url, headers={"If-Match": resp.headers["ETag"]})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+    resp = await async_client.delete(url, headers={"If-Match": "*"})
+    assert resp.status_code == status.HTTP_200_OK
+
+
+async def test_charge_point_update_delete__not_matched(
+    app: FastAPI,
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    app.dependency_overrides[current_active_user] = lambda: None
+    crud_cp = CRUDChargePoint(db_session)
+    charge_point = await crud_cp.create(ChargePointSchemaIn(lat=-17, lng=168, location="Port Vila, Vanuatu"))
+    revision = await crud_cp.get_revision()
+    missing = uuid.uuid4()
+    payload = ChargePointSchemaUpdate(location="Luganville, Vanuatu")
+    with pytest.raises(DoesNotExist):
+        await crud_cp.update(missing, payload)
+    with pytest.raises(DoesNotExist):
+        await crud_cp.delete(missing, if_revision=charge_point.revision)
+    with pytest.raises(RevisionMismatch):
+        await crud_cp.update(charge_point.id, payload, if_revision=charge_point.revision - 1)
+    with pytest.raises(RevisionMismatch):
+        await crud_cp.delete(charge_point.id, if_revision=charge_point.revision - 1)
+    # writes that matched nothing leave the revision counter alone
+    assert await crud_cp.get_revision() == revision
+
+    resp = await async_client.put(f"{settings.API_V1_STR}/charge_points/{missing}", json={"location": "x"})
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+    resp = await async_client.delete(f"{settings.API_V1_STR}/charge_points/{missing}")
+    assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+    updated = await crud_cp.update(charge_point.id, ChargePointSchemaUpdate(), if_revision=charge_point.revision)
+    assert updated.location == charge_point.location
+    assert updated.revision == revision + 1
+    deleted = await crud_cp.delete(charge_point.id, if_revision=updated.revision)
+    assert deleted.id == charge_point.id
+    assert await crud_cp.get_revision() == revision + 2
+
+
+async def test_charge_point_bulk_update_delete(
+    app: FastAPI,
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    app.dependency_overrides[current_active_user] = lambda: None
+    crud_cp = CRUDChargePoint(db_session)
+    await crud_cp.load_index()
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila, Vanuatu"))
+    luganville = await crud_cp.create(ChargePointSchemaIn(lat=-15.5333, lng=167.1667, location="Luganville"))
+    missing = uuid.uuid4()
+    url = f"{settings.API_V1_STR}/charge_points/"
+
+    payload = {
+        "items": [
+            {"id": str(missing), "location": "Nowhere"},
+            {"id": str(vila.id), "lat": -17.74, "lng": 168.31},
+            {"id": str(luganville.id), "location": "Luganville, Vanuatu"},
+        ],
+    }
+    resp = await async_client.patch(url, json=payload)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == [
+        {"id": str(missing), "status": 404, "charge_point": None},
+        {
+            "id": str(vila.id),
+            "status": 200,
+            "charge_point": {"id": str(vila.id), "lat": -17.74, "lng": 168.31, "location": "Port Vila, Vanuatu"},
+        },
+        {
+            "id": str(luganville.id),
+            "status": 200,
+            "charge_point": {
+                "id": str(luganville.id), "lat": -15.5333, "lng": 167.1667, "location": "Luganville, Vanuatu",
+            },
+        },
+    ]
+    # one revision for the whole batch, and the index follows
+    revision = await crud_cp.get_revision()
+    assert (await crud_cp.get_by_id(vila.id)).revision == revision
+    assert (await crud_cp.get_by_id(luganville.id)).revision == revision
+    nearest = await crud_cp.find_nearest(-17.74, 168.31)
+    assert nearest[0][0].id == vila.id
+    assert nearest[0][1] == pytest.approx(0)
+
+    resp = await async_client.patch(url, json={"items": [{"id": str(vila.id)}, {"id": str(vila.id)}]})
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    resp = await async_client.request("DELETE", url, json={"ids": [str(vila.id), str(missing)]})
+    assert resp.status_code == status.HTTP_200_OK
+    assert [(r["id"], r["status"]) for r in resp.json()] == [(str(vila.id), 200), (str(missing), 404)]
+    assert await crud_cp.get_revision() == revision + 1
+    with pytest.raises(DoesNotExist):
+        await crud_cp.get_by_id(vila.id)
+    assert (await crud_cp.find_nearest(-17.74, 168.31))[0][0].id == luganville.id
+
+    resp = await async_client.request("DELETE", url, json={"ids": [str(missing)]})
+    assert resp.json() == [{"id": str(missing), "status": 404, "charge_point": None}]
+    assert await crud_cp.get_revision() == revision + 1
+
+
+async def test_charge_point_list__bbox(
+    monkeypatch,
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila, Vanuatu"))
+    suva = await crud_cp.create(ChargePointSchemaIn(lat=-18.1416, lng=178.4419, location="Suva, Fiji"))
+    apia = await crud_cp.create(ChargePointSchemaIn(lat=-13.8333, lng=-171.7667, location="Apia, Samoa"))
+    await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    url = f"{settings.API_V1_STR}/charge_points/"
+
+    async def ids_in(bbox: str):
+        resp = await async_client.get(url, params={"bbox": bbox})
+        assert resp.status_code == status.HTTP_200_OK
+        return {cp["id"] for cp in resp.json()}, resp.headers["X-Truncated"]
+
+    assert await ids_in("166.5,-20.5,170.5,-13") == ({str(vila.id)}, "false")
+    # crossing the antimeridian
+    assert await ids_in("175,-20,-170,-10") == ({str(suva.id), str(apia.id)}, "false")
+    assert await ids_in("160,-20,-170,-10") == ({str(vila.id), str(suva.id), str(apia.id)}, "false")
+    assert await ids_in("0,0,1,1") == (set(), "false")
+
+    monkeypatch.setattr(settings, "BBOX_MAX_RESULTS", 2)
+    # the southernmost ones
+    assert await ids_in("-180,-90,180,90") == ({str(vila.id), str(suva.id)}, "true")
+
+    resp = await async_client.get(url, params={"bbox": "0,10,10"})
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+async def test_charge_point_clusters(
+    monkeypatch,
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7, lng=168.3, location="Port Vila, Vanuatu"))
+    await crud_cp.bulk_create([
+        ChargePointSchemaIn(lat=-17.8, lng=168.4, location="Port Vila, Vanuatu"),
+        ChargePointSchemaIn(lat=-18.1, lng=178.4, location="Suva, Fiji"),
+        ChargePointSchemaIn(lat=40.7, lng=-74.0, location="Ampcontrol Office"),
+    ])
+    url = f"{settings.API_V1_STR}/charge_points/clusters"
+
+    async def clusters(bbox: str, zoom: int):
+        resp = await async_client.get(url, params={"bbox": bbox, "zoom": zoom})
+        assert resp.status_code == status.HTTP_200_OK
+        return sorted((c["count"], round(c["lat"], 2), round(c["lng"], 2)) for c in resp.json())
+
+    assert await clusters("-180,-90,180,90", 0) == [(1, 40.7, -74.0), (3, -17.87, 171.7)]
+    assert await clusters("160,-20,-170,-10", 5) == [(1, -18.1, 178.4), (2, -17.75, 168.35)]
+    assert await clusters("0,0,1,1", 5) == []
+
+    # clusters follow every write
+    await crud_cp.update(vila.id, ChargePointSchemaUpdate(lat=-13.8, lng=-171.8))
+    assert await clusters("160,-20,-170,-10", 5) == [(1, -18.1, 178.4), (1, -17.8, 168.4), (1, -13.8, -171.8)]
+    await crud_cp.update(vila.id, ChargePointSchemaUpdate(location="Apia, Samoa"))
+    assert await clusters("160,-20,-170,-10", 5) == [(1, -18.1, 178.4), (1, -17.8, 168.4), (1, -13.8, -171.8)]
+    await crud_cp.delete(vila.id)
+    assert await clusters("-180,-90,180,90", 0) == [(1, 40.7, -74.0), (2, -17.95, 173.4)]
+
+    monkeypatch.setattr(settings, "BBOX_MAX_RESULTS", 1)
+    resp = await async_client.get(url, params={"bbox": "-180,-90,180,90", "zoom": 0})
+    assert len(resp.json()) == 1
+    assert resp.headers["X-Truncated"] == "true"
+    resp = await async_client.get(
+        url, params={"bbox": "-180,-90,180,90", "zoom": 0}, headers={"If-None-Match": resp.headers["ETag"]},
+    )
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+
+    resp = await async_client.get(url, params={"bbox": "0,10,10", "zoom": 0})
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    resp = await async_client.get(url, params={"bbox": "0,0,10,10", "zoom": 99})
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_charge_point_clusters__every_zoom(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    rng = random.Random(0)
+    points = [(rng.uniform(-18, -17), rng.uniform(168, 169)) for _ in range(200)]
+    # on cell edges, and the last cells
+    points += [(-17.5, 168.5), (-17.75, 168.25), (90, 180), (-90, -180)]
+    await CRUDChargePoint(db_session).bulk_create([
+        ChargePointSchemaIn(lat=lat, lng=lng, location=f"Station {i}") for i, (lat, lng) in enumerate(points)
+    ])
+    url = f"{settings.API_V1_STR}/charge_points/clusters"
+    for zoom in range(CLUSTER_MAX_ZOOM + 1):
+        expected = Counter((cluster_y(lat, zoom), cluster_x(lng, zoom)) for lat, lng in points)
+        resp = await async_client.get(url, params={"bbox": "-180,-90,180,90", "zoom": zoom})
+        assert resp.headers["X-Truncated"] == "false"
+        assert sorted(c["count"] for c in resp.json()) == sorted(expected.values()), zoom
+        # only the cells in view, whole
+        resp = await async_client.get(url, params={"bbox": "168.5,-17.5,168.5,-17.5", "zoom": zoom})
+        cell = (cluster_y(-17.5, zoom), cluster_x(168.5, zoom))
+        assert [c["count"] for c in resp.json()] == [expected[cell]], zoom
+
+
+async def test_charge_point_list__msgpack(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila, Vanuatu"))
+    await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    url = f"{settings.API_V1_STR}/charge_points/"
+
+    for params in ({}, {"bbox": "-180,-90,180,90"}, {"skip": 1}):
+        resp_json = await async_client.get(url, params=params)
+        resp = await async_client.get(url, params=params, headers={"Accept": "application/x-msgpack"})
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"] == "application/x-msgpack"
+        assert resp.headers["vary"] == "Accept"
+        assert [{**cp, "id": str(cp["id"])} for cp in decode_charge_points(resp.content)] == resp_json.json()
+        # representations are cached separately
+        assert resp.headers["etag"] != resp_json.headers["etag"]
+        resp = await async_client.get(
+            url, params=params, headers={"Accept": "application/x-msgpack", "If-None-Match": resp.headers["etag"]},
+        )
+        assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+async def test_charge_point_search(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila, Vanuatu"))
+    nova = await crud_cp.create(ChargePointSchemaIn(lat=-17.74, lng=168.31, location="Vila Nova"))
+    await crud_cp.create(ChargePointSchemaIn(lat=40.7453297, lng=-73.9929523, location="Ampcontrol Office"))
+    url = f"{settings.API_V1_STR}/charge_points/search"
+
+    async def search(q: str, **params):
+        resp = await async_client.get(url, params={"q": q, **params})
+        assert resp.status_code == status.HTTP_200_OK
+        return [cp["location"] for cp in resp.json()]
+
+    assert await search("vila") == ["Vila Nova", "Port Vila, Vanuatu"]
+    assert await search("VILA", limit=1) == ["Vila Nova"]
+    assert await search("port v") == ["Port Vila, Vanuatu"]
+    assert await search("nowhere") == []
+
+    # writes through the CRUD are indexed straight away
+    await crud_cp.update(vila.id, ChargePointSchemaUpdate(location="Mele, Vanuatu"))
+    assert await search("vila") == ["Vila Nova"]
+    assert await search("vanuatu") == ["Mele, Vanuatu"]
+    # as if written by another process, stale matches are dropped and searched again
+    await db_session.execute(text("UPDATE charge_point SET location = 'Apia' WHERE id = :id"), {"id": nova.id})
+    db_session.expire_all()
+    assert await search("vila") == []
+    # and the index corrected
+    assert await search("apia") == ["Apia"]
+    # and what another process creates is indexed once it is heard of
+    row = ChargePoint(id=uuid.uuid4(), lat=-13.83, lng=-171.76, location="Apia Harbour")
+    db_session.add(row)
+    await db_session.flush()
+    await db_session.refresh(row)
+    payload = change_event(CREATED, row.revision, ChargePointSchema.from_orm(row).dict())
+    charge_point_changes._on_notification(None, 0, CHARGE_POINT_CHANNEL, payload)
+    assert await search("apia") == ["Apia", "Apia Harbour"]
+
+    resp = await async_client.get(url, params={"q": ""})
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def test_charge_point_changes(
+    async_client: AsyncClient,
+    db_session: AsyncSession,
+) -> None:
+    crud_cp = CRUDChargePoint(db_session)
+    url = f"{settings.API_V1_STR}/charge_points/changes"
+
+    async def changes(since: int, **params):
+        resp = await async_client.get(url, params={"since": since, **params})
+        assert resp.status_code == status.HTTP_200_OK
+        body = resp.json()
+        # ordered by revision, then by random id
+        return sorted(cp["location"] for cp in body["changed"]), body["deleted"], body["revision"], body["more"]
+
+    assert await changes(0) == ([], [], 0, False)
+    # a row from before revisions were stamped is only sent on a first sync
+    legacy = uuid.uuid4()
+    await db_session.execute(
+        text("INSERT INTO charge_point (id, longitude, latitude, location) VALUES (:id, 0, 0, 'Legacy')"),
+        {"id": legacy},
+    )
+    vila = await crud_cp.create(ChargePointSchemaIn(lat=-17.7333, lng=168.3273, location="Port Vila"))
+    await crud_cp.bulk_create([
+        ChargePointSchemaIn(lat=-15.5333, lng=167.1667, location="Luganville"),
+        ChargePointSchemaIn(lat=-13.8, lng=-171.7, location="Apia"),
+    ])
+    assert await changes(0) == (["Apia", "Legacy", "Luganville", "Port Vila"], [], 2, False)
+    assert await changes(1) == (["Apia", "Luganville"], [], 2, False)
+    assert await changes(2) == ([], [], 2, False)
+
+    await crud_cp.update(vila.id, ChargePointSchemaUpdate(location="Mele"))
+    await crud_cp.delete(legacy)
+    assert await changes(2) == (["Mele"], [str(legacy)], 4, False)
+    assert await changes(3) == ([], [str(legacy)], 4, False)
+
+    # pages stop short of the revision of the first change left out
+    assert await changes(0, limit=2) == (["Apia", "Luganville"], [], 2, True)
+    assert await changes(1, limit=3) == (["Apia", "Luganville", "Mele"], [], 3, True)
+    # unless that revision is the first, then it is returned whole
+    assert await changes(1, limit=1) == (["Apia", "Luganville"], [], 2, True)
+
+    resp = await async_client.get(url, params={"since": 4})
+    resp = await async_client.get(url, params={"since": 4}, headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
@@ -2,6 +2,8 @@ import pytest
 from httpx import AsyncClient
 from fastapi import status
 
+from app.core.config import settings
+
 pytestmark = pytest.mark.asyncio
 
 
@@ -10,3 +12,24 @@ async def test_main(async_client: AsyncClient) -> None:
 
     assert resp.status_code == status.HTTP_200_OK
     assert resp.json()["status"] == "ok"
+
+
+async def test_metrics(async_client: AsyncClient) -> None:
+    await async_client.get("/")
+    await async_client.get(f"{settings.API_V1_STR}/charge_points/nearest", params={"lat": 1, "lng": 2})
+    await async_client.get("/does-not-exist")
+    resp = await async_client.get("/metrics")
+
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = resp.text.splitlines()
+    assert any(line.startswith('http_responses_total{method="GET",route="/",status="200"} ') for line in lines)
+    assert any(line.startswith('http_responses_total{method="GET",route="<unmatched>",status="404"} ') for line in lines)
+    assert any(
+        line.startswith('http_request_duration_seconds_count{method="GET",route="/api/v1/charge_points/nearest"} ')
+        for line in lines
+    )
+    assert any(line.startswith('find_nearest_candidates_count{strategy="index"} ') for line in lines)
+    assert 'db_pool_size{engine="primary"} 5' in lines
+    assert any(line.startswith('cache_hits_total{cache="charge_point"} ') for line in lines)
+    assert "http_requests_in_flight 1" in lines
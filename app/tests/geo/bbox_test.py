@@ -0,0 +1,24 @@
+import pytest
+
+from app.geo.bbox import BBox, parse_bbox
+
+
+def test_parse_bbox() -> None:
+    assert parse_bbox("166.5,-20.5,170.5,-13") == BBox(166.5, -20.5, 170.5, -13)
+    assert not parse_bbox("166.5,-20.5,170.5,-13").crosses_antimeridian
+    assert parse_bbox("170,-20,-170,-10").crosses_antimeridian
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "1,2,3",
+    "1,2,3,4,5",
+    "a,2,3,4",
+    "-181,0,10,10",
+    "0,-91,10,10",
+    "0,10,10,0",
+    "nan,0,10,10",
+])
+def test_parse_bbox__invalid(value: str) -> None:
+    with pytest.raises(ValueError):
+        parse_bbox(value)
@@ -0,0 +1,49 @@
+import random
+from math import asin, cos, sqrt
+
+import pytest
+
+from app.geo.cells import N_COLS, N_ROWS, CellWindow, cell_col, cell_row, geo_cell
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    p = 0.017453292519943295
+    hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
+        cos(lat1 * p) * cos(lat2 * p) * \
+        (1 - cos((lng2 - lng1) * p)) / 2
+    return 12742 * asin(sqrt(hav))
+
+
+def in_window(window, lat, lng):
+    row, col = cell_row(lat), cell_col(lng)
+    if not window.row_lo <= row <= window.row_hi:
+        return False
+    if window.col_ranges is None:
+        return True
+    return any(lo <= col <= hi for lo, hi in window.col_ranges)
+
+
+def test_geo_cell_bounds() -> None:
+    assert geo_cell(-90, -180) == 0
+    assert geo_cell(90, 180) == N_ROWS * N_COLS - 1
+    assert geo_cell(0, 0) == (N_ROWS // 2) * N_COLS + N_COLS // 2
+
+
+def test_cell_ranges_match_window() -> None:
+    window = CellWindow(10, 179.9, 2)
+    cells = {c for lo, hi in window.cell_ranges() for c in range(lo, hi + 1)}
+    assert len(cells) == 25
+    assert geo_cell(10, -179.9) in cells
+    assert geo_cell(10, 179.9) in cells
+
+
+@pytest.mark.parametrize("lat,lng", [(0, 0), (89.9, 10), (-89.9, -170), (60, 179.99), (-45, -180)])
+@pytest.mark.parametrize("radius", [0, 1, 3, 50, 400])
+def test_min_outside_km_is_lower_bound(lat, lng, radius) -> None:
+    window = CellWindow(lat, lng, radius)
+    bound = window.min_outside_km()
+    for _ in range(2000):
+        other = (random.uniform(-90, 90), random.uniform(-180, 180))
+        if not in_window(window, *other):
+            assert haversine(lat, lng, *other) >= bound - 1e-6
+    assert CellWindow(lat, lng, N_COLS).covers_globe
@@ -0,0 +1,18 @@
+from app.geo.bbox import BBox
+from app.geo.clusters import CLUSTER_MAX_ZOOM, cluster_cols, cluster_ranges, cluster_x, cluster_y
+
+
+def test_cluster_cells() -> None:
+    assert (cluster_cols(0), cluster_cols(CLUSTER_MAX_ZOOM)) == (4, 4 << CLUSTER_MAX_ZOOM)
+    assert (cluster_y(-90, 0), cluster_x(-180, 0)) == (0, 0)
+    assert (cluster_y(-0.1, 0), cluster_x(-0.1, 0)) == (0, 1)
+    # the north pole and antimeridian are in the last cells
+    assert (cluster_y(90, 0), cluster_x(180, 0)) == (1, 3)
+    assert (cluster_y(90, 3), cluster_x(180, 3)) == (15, 31)
+
+
+def test_cluster_ranges() -> None:
+    assert cluster_ranges(BBox(-180, -90, 180, 90), 0) == ((0, 1), [(0, 3)])
+    assert cluster_ranges(BBox(166.5, -20.5, 170.5, -13), 2) == ((3, 3), [(15, 15)])
+    # crossing the antimeridian
+    assert cluster_ranges(BBox(170, -20, -170, -10), 2) == ((3, 3), [(15, 15), (0, 0)])
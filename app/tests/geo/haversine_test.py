@@ -0,0 +1,53 @@
+import random
+from math import asin, cos, sqrt
+
+import pytest
+
+from app.geo.haversine import HaversineEngine
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    p = 0.017453292519943295
+    hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
+        cos(lat1 * p) * cos(lat2 * p) * \
+        (1 - cos((lng2 - lng1) * p)) / 2
+    return 12742 * asin(sqrt(hav))
+
+
+def test_distances_match_scalar() -> None:
+    points = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(1000)]
+    engine = HaversineEngine([p[0] for p in points], [p[1] for p in points])
+    for lat, lng in [(90, -180), (-90, 180), (0, 0), (40, -70)]:
+        expected = [haversine(p[0], p[1], lat, lng) for p in points]
+        assert list(engine.distances(lat, lng)) == pytest.approx(expected)
+
+
+def test_nearest_k_and_max_km() -> None:
+    points = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(1000)]
+    engine = HaversineEngine([p[0] for p in points], [p[1] for p in points])
+    ranked = sorted(range(len(points)), key=lambda i: haversine(*points[i], 10, 20))
+    positions, distances = engine.nearest(10, 20, k=25)
+    assert list(positions) == ranked[:25]
+    positions, distances = engine.nearest(10, 20, k=25, max_km=2000)
+    assert list(positions) == [i for i in ranked[:25] if haversine(*points[i], 10, 20) <= 2000]
+    assert all(d <= 2000 for d in distances)
+
+
+def test_nearest_empty() -> None:
+    positions, distances = HaversineEngine([], []).nearest(0, 0, k=3)
+    assert len(positions) == 0
+    assert len(distances) == 0
+
+
+@pytest.mark.parametrize("chunk_elements", [1, 1000, 1 << 20])
+def test_nearest_many(chunk_elements) -> None:
+    points = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(500)]
+    origins = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(50)]
+    engine = HaversineEngine([p[0] for p in points], [p[1] for p in points])
+    positions, distances = engine.nearest_many(
+        [o[0] for o in origins], [o[1] for o in origins], chunk_elements=chunk_elements,
+    )
+    for origin, position, distance in zip(origins, positions, distances):
+        expected = min(range(len(points)), key=lambda i: haversine(*points[i], *origin))
+        assert position == expected
+        assert distance == pytest.approx(haversine(*points[expected], *origin))
@@ -0,0 +1,148 @@
+import random
+import uuid
+from math import asin, cos, sqrt
+
+import pytest
+
+from app.geo import index as geo_index
+from app.geo.index import SpatialIndex
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    p = 0.017453292519943295
+    hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
+        cos(lat1 * p) * cos(lat2 * p) * \
+        (1 - cos((lng2 - lng1) * p)) / 2
+    return 12742 * asin(sqrt(hav))
+
+
+def random_points(n):
+    return [
+        (uuid.uuid4(), random.uniform(-90, 90), random.uniform(-180, 180))
+        for _ in range(n)
+    ]
+
+
+def brute_force(points, lat, lng, k):
+    ranked = sorted(points, key=lambda p: haversine(p[1], p[2], lat, lng))
+    return [p[0] for p in ranked[:k]]
+
+
+def dict_coords(points):
+    return {key: (lat, lng) for key, lat, lng in points}
+
+
+@pytest.mark.parametrize("n", [1, 10, 1000])
+def test_nearest_matches_haversine(n) -> None:
+    points = random_points(n)
+    index = SpatialIndex()
+    index.load(points)
+    for lat, lng in [(90, -180), (-90, 180), (0, 0), (40, -70), (-17, 168)]:
+        key, distance = index.nearest(lat, lng)[0]
+        assert key == brute_force(points, lat, lng, 1)[0]
+        assert distance == pytest.approx(haversine(*dict_coords(points)[key], lat, lng))
+
+
+def test_nearest_after_writes() -> None:
+    points = random_points(500)
+    index = SpatialIndex(min_rebuild=16)
+    index.load(points)
+    live = {key: (lat, lng) for key, lat, lng in points}
+    rebuilds = 0
+
+    def rebuild_when_due():
+        nonlocal rebuilds
+        if index.needs_rebuild:
+            index.rebuild()
+            rebuilds += 1
+
+    for key, lat, lng in random_points(100):
+        index.upsert(key, lat, lng)
+        live[key] = (lat, lng)
+        rebuild_when_due()
+    for key in random.sample(list(live), 200):
+        index.remove(key)
+        del live[key]
+        rebuild_when_due()
+    for key in random.sample(list(live), 50):
+        live[key] = (random.uniform(-90, 90), random.uniform(-180, 180))
+        index.upsert(key, *live[key])
+    assert rebuilds > 0
+    assert len(index) == len(live)
+    expected = [(key, lat, lng) for key, (lat, lng) in live.items()]
+    for lat, lng in [(0, 0), (45, 45), (-60, -120)]:
+        assert index.nearest(lat, lng)[0][0] == brute_force(expected, lat, lng, 1)[0]
+
+
+def test_nearest_empty() -> None:
+    index = SpatialIndex()
+    index.load([])
+    assert index.nearest(0, 0) == []
+    assert index.nearest_many([(0, 0), (10, 10)]) == [None, None]
+
+
+def test_nearest_many() -> None:
+    points = random_points(1000)
+    index = SpatialIndex()
+    index.load(points)
+    origins = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(50)]
+    assert index.nearest_many(origins) == [index.nearest(lat, lng)[0] for lat, lng in origins]
+    assert [key for key, _ in index.nearest_many(origins)] == [
+        brute_force(points, lat, lng, 1)[0] for lat, lng in origins
+    ]
+
+
+def test_nearest_k_and_max_km() -> None:
+    points = random_points(1000)
+    index = SpatialIndex()
+    index.load(points)
+    found = index.nearest(10, 20, k=25, max_km=3000)
+    expected = [
+        key for key in brute_force(points, 10, 20, 25)
+        if haversine(*dict_coords(points)[key], 10, 20) <= 3000
+    ]
+    assert [key for key, _ in found] == expected
+    assert all(distance <= 3000 for _, distance in found)
+
+
+def test_writes_during_rebuild(monkeypatch) -> None:
+    points = random_points(500)
+    index = SpatialIndex(min_rebuild=16)
+    index.load(points)
+    live = {key: (lat, lng) for key, lat, lng in points}
+    for key in random.sample(list(live), 40):
+        index.remove(key)
+        del live[key]
+    assert index.needs_rebuild
+    build = geo_index._build
+
+    def build_while_writing(entries, leaf_size):
+        # writes and searches go on while the tree is built
+        monkeypatch.setattr(geo_index, "_build", build)
+        assert not index.needs_rebuild
+        for key, lat, lng in random_points(10):
+            index.upsert(key, lat, lng)
+            live[key] = (lat, lng)
+        for key in random.sample(list(live), 10):
+            index.remove(key)
+            del live[key]
+        for key in random.sample(list(live), 10):
+            live[key] = (random.uniform(-90, 90), random.uniform(-180, 180))
+            index.upsert(key, *live[key])
+        index.rebuild()  # a second rebuild meanwhile does nothing
+        index.nearest(0, 0)
+        return build(entries, leaf_size)
+
+    monkeypatch.setattr(geo_index, "_build", build_while_writing)
+    index.rebuild()
+    # only what was written during the build is left in the buffer
+    assert len(index._pending) <= 20
+    assert len(index) == len(live)
+    expected = [(key, lat, lng) for key, (lat, lng) in live.items()]
+    for lat, lng in [(0, 0), (45, 45), (-60, -120)]:
+        assert [key for key, _ in index.nearest(lat, lng, k=5)] == brute_force(expected, lat, lng, 5)
+    # a rebuild overtaken by a reload is thrown away
+    index.upsert(uuid.uuid4(), 0, 0)
+    monkeypatch.setattr(geo_index, "_build", lambda entries, leaf_size: index.load([]) or build(entries, leaf_size))
+    index.rebuild()
+    assert len(index) == 0 and index.nearest(0, 0) == []
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from app.search.prefix import PrefixIndex, normalize
+
+LOCATIONS = {
+    1: "Port Vila, Vanuatu",
+    2: "Villa Rosa",
+    3: "Vila Nova",
+    4: "Ampcontrol Office",
+    5: "Port Villa",
+    6: "École de Vila",
+}
+
+
+def test_normalize() -> None:
+    assert normalize("  Port-Vila,  VANUATU ") == "port vila vanuatu"
+    assert normalize("École Saint-Étienne") == "ecole saint etienne"
+    assert normalize("!!") == ""
+
+
+def test_search() -> None:
+    index = PrefixIndex()
+    index.load(LOCATIONS.items())
+    # whole location prefixes first, then the closest word completions
+    assert index.search("vila") == [3, 6, 1]
+    assert index.search("VIL") == [3, 2, 6, 1, 5]
+    assert index.search("port vil") == [1, 5]
+    assert index.search("office amp") == [4]
+    assert index.search("ecole") == [6]
+    assert index.search("vil", limit=2) == [3, 2]
+    assert index.search("ila") == []
+    assert index.search(" ") == []
+
+
+def test_search_pending_writes() -> None:
+    index = PrefixIndex(min_rebuild=256)
+    index.load(LOCATIONS.items())
+    index.upsert(7, "Vila Beach")
+    index.upsert(3, "Apia, Samoa")
+    index.remove(6)
+    assert index.search("vila") == [7, 1]
+    assert index.search("apia") == [3]
+    assert index.matches(3, "apia samoa")
+    assert not index.matches(3, "Vila Nova")
+    assert 6 not in index
+
+
+@pytest.mark.parametrize("min_rebuild", [0, 1000])
+def test_search_matches_brute_force(min_rebuild: int) -> None:
+    rng = random.Random(0)
+    words = ["port", "vila", "villa", "vanuatu", "apia", "suva", "office", "station", "st"]
+    index = PrefixIndex(min_rebuild=min_rebuild)
+    index.load((i, " ".join(rng.sample(words, 2))) for i in range(200))
+    texts = {i: index._texts[i] for i in range(200)}
+    for i in range(200, 300):
+        texts[i] = " ".join(rng.sample(words, 3))
+        index.upsert(i, texts[i])
+        if index.needs_rebuild:
+            index.rebuild()
+    for i in range(0, 300, 7):
+        index.remove(i)
+        del texts[i]
+        if index.needs_rebuild:
+            index.rebuild()
+    for query in ["v", "vil", "port v", "st", "suva port", "x"]:
+        terms = query.split(" ")
+        expected = {
+            key for key, text in texts.items()
+            if all(any(word.startswith(term) for word in text.split(" ")) for term in terms)
+            or text.startswith(query)
+        }
+        assert set(index.search(query, limit=1000)) == expected
+
+
+def test_writes_during_rebuild() -> None:
+    index = PrefixIndex(min_rebuild=2)
+    index.load(LOCATIONS.items())
+    index.upsert(7, "Vila Beach")
+    index.remove(2)
+    index.upsert(4, "Suva Office")
+    assert index.needs_rebuild
+    build = index._build
+
+    def build_while_writing(texts):
+        # writes and searches go on while the lists are sorted
+        assert not index.needs_rebuild
+        index.upsert(8, "Vila Market")
+        index.upsert(3, "Apia, Samoa")
+        index.remove(7)
+        index.rebuild()  # a second rebuild meanwhile does nothing
+        assert index.search("vila") == [8, 6, 1]
+        return build(texts)
+
+    index._build = build_while_writing
+    index.rebuild()
+    # only what was written during the sort is left in the buffer
+    assert set(index._pending) == {8, 3}
+    assert index.search("vila") == [8, 6, 1]
+    assert index.search("apia") == [3]
+    assert index.search("suva") == [4]
+    # a rebuild overtaken by a reload is thrown away
+    def build_while_reloading(texts):
+        index._build = build
+        index.load([])
+        return build(texts)
+
+    index._build = build_while_reloading
+    index.rebuild()
+    assert len(index) == 0 and index.search("vila") == []
@@ -0,0 +1,59 @@
+"""Benchmark the scalar haversine loop against `HaversineEngine`.
+
+Usage: python -m scripts.bench_haversine [--sizes 10000 100000 1000000] [--queries 20]
+"""
+import argparse
+import random
+import time
+from math import asin, cos, sqrt
+
+from app.geo.haversine import HaversineEngine
+
+
+def scalar_distance(lat1, lng1, lat2, lng2):
+    """The haversine formula `find_nearest` used to run once per row."""
+    p = 0.017453292519943295
+    hav = 0.5 - cos((lat2 - lat1) * p) / 2 + \
+        cos(lat1 * p) * cos(lat2 * p) * \
+        (1 - cos((lng2 - lng1) * p)) / 2
+    return 12742 * asin(sqrt(hav))
+
+
+def bench(size: int, queries: int) -> None:
+    points = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(size)]
+    origins = [(random.uniform(-90, 90), random.uniform(-180, 180)) for _ in range(queries)]
+
+    start = time.perf_counter()
+    scalar = [
+        min(range(size), key=lambda i: scalar_distance(points[i][0], points[i][1], lat, lng))
+        for lat, lng in origins
+    ]
+    scalar_s = (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    engine = HaversineEngine([p[0] for p in points], [p[1] for p in points])
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorized = [int(engine.nearest(lat, lng)[0][0]) for lat, lng in origins]
+    vectorized_s = (time.perf_counter() - start) / queries
+
+    assert scalar == vectorized
+    print(
+        f"{size:>9} points  scalar {scalar_s * 1000:9.2f} ms/query"
+        f"  numpy {vectorized_s * 1000:8.2f} ms/query (build {build_s * 1000:.1f} ms)"
+        f"  speedup x{scalar_s / vectorized_s:.1f}",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+    for size in args.sizes:
+        bench(size, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Load benchmark of the charge point endpoints over synthetic clustered datasets.
+
+For each dataset size the `charge_point` table is truncated and seeded with points
+clustered around random "cities", then every scenario is driven through the ASGI app
+in process by `--concurrency` concurrent clients. Latency percentiles and throughput
+are written to a JSON file, tagged with the current commit, to compare runs.
+
+WARNING this truncates `charge_point` in the configured database, point POSTGRES_DB
+at a scratch database and pass --yes.
+
+Usage: python -m scripts.bench_load --yes [--sizes 10000,100000,1000000] [--concurrency 16]
+    [--requests 2000] [--scenarios nearest,list,item,search,create,update] [--output bench_load.json]
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import numpy as np
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from app.api.deps.user import current_active_user
+from app.core.application import create_api
+from app.core.config import settings
+from app.crud.base import encode_cursor
+from app.crud.charge_point import (
+    CRUDChargePoint,
+    charge_point_cache,
+    charge_point_index,
+    charge_point_search_index,
+)
+from app.db.session import async_session
+from app.schemas.charge_point import ChargePointSchemaIn
+
+SIZES = (10_000, 100_000, 1_000_000)
+SCENARIOS = ("nearest", "list", "item", "search", "create", "update")
+SEED_CHUNK_SIZE = 50_000
+N_CITIES = 300
+# Share of points scattered uniformly instead of around a city.
+BACKGROUND_RATIO = 0.05
+# Ids sampled after seeding for the item, list and update scenarios.
+ID_SAMPLE_SIZE = 10_000
+
+BASE = f"{settings.API_V1_STR}/charge_points"
+
+Request = Callable[[AsyncClient, random.Random], Awaitable[int]]
+
+
+class Dataset:
+    """Random cities, each with a size and spread, that points and queries cluster around."""
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+        # populated latitudes, city sizes follow a heavy tailed distribution
+        self.cities = [
+            (rng.uniform(-45, 65), rng.uniform(-180, 180), rng.uniform(0.02, 0.5))
+            for _ in range(N_CITIES)
+        ]
+        self.weights = [rng.paretovariate(1.2) for _ in range(N_CITIES)]
+
+    def point(self, rng: random.Random) -> Tuple[float, float]:
+        if rng.random() < BACKGROUND_RATIO:
+            return rng.uniform(-90, 90), rng.uniform(-180, 180)
+        lat, lng, spread = rng.choices(self.cities, self.weights)[0]
+        lat = min(90.0, max(-90.0, rng.gauss(lat, spread)))
+        lng = (rng.gauss(lng, spread) + 180) % 360 - 180
+        return lat, lng
+
+
+async def seed(dataset: Dataset, size: int) -> List:
+    charge_point_index.clear()
+    charge_point_search_index.clear()
+    charge_point_cache.clear()
+    async with async_session() as session:
+        await session.execute(text("TRUNCATE charge_point"))
+        await session.commit()
+        crud_cp = CRUDChargePoint(session)
+        for start in range(0, size, SEED_CHUNK_SIZE):
+            in_schemas = []
+            for i in range(start, min(size, start + SEED_CHUNK_SIZE)):
+                lat, lng = dataset.point(dataset.rng)
+                in_schemas.append(ChargePointSchemaIn(lat=lat, lng=lng, location=f"Charge Point {i}"))
+            await crud_cp.bulk_create(in_schemas)
+        await session.execute(text("ANALYZE charge_point"))
+        await session.commit()
+        sample = await session.execute(
+            text("SELECT id FROM charge_point ORDER BY random() LIMIT :n"), {"n": ID_SAMPLE_SIZE},
+        )
+        return sample.scalars().all()
+
+
+def scenarios(dataset: Dataset, ids: List) -> Dict[str, Request]:
+    async def nearest(client: AsyncClient, rng: random.Random) -> int:
+        lat, lng = dataset.point(rng)
+        resp = await client.get(f"{BASE}/nearest", params={"lat": lat, "lng": lng, "k": 5})
+        return resp.status_code
+
+    async def list_page(client: AsyncClient, rng: random.Random) -> int:
+        resp = await client.get(f"{BASE}/", params={"cursor": encode_cursor(rng.choice(ids)), "limit": 100})
+        return resp.status_code
+
+    async def item(client: AsyncClient, rng: random.Random) -> int:
+        resp = await client.get(f"{BASE}/{rng.choice(ids)}")
+        return resp.status_code
+
+    async def search(client: AsyncClient, rng: random.Random) -> int:
+        # seeded locations are "Charge Point <n>"
+        resp = await client.get(f"{BASE}/search", params={"q": f"point {rng.randrange(len(ids))}"})
+        return resp.status_code
+
+    async def create(client: AsyncClient, rng: random.Random) -> int:
+        lat, lng = dataset.point(rng)
+        resp = await client.post(f"{BASE}/", json={"lat": lat, "lng": lng, "location": "Benchmark"})
+        return resp.status_code
+
+    async def update(client: AsyncClient, rng: random.Random) -> int:
+        lat, lng = dataset.point(rng)
+        resp = await client.put(
+            f"{BASE}/{rng.choice(ids)}", json={"lat": lat, "lng": lng, "location": "Benchmark"},
+        )
+        return resp.status_code
+
+    return {
+        "nearest": nearest,
+        "list": list_page,
+        "item": item,
+        "search": search,
+        "create": create,
+        "update": update,
+    }
+
+
+async def drive(client: AsyncClient, request: Request, requests: int, concurrency: int, seed: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker(rng: random.Random) -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await request(client, rng)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(random.Random(seed + i)) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def bench(args: argparse.Namespace) -> Dict:
+    dataset = Dataset(random.Random(args.seed))
+    results = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        ids = await seed(dataset, size)
+        print(f"seeded {size} charge points in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        app = create_api()
+        app.dependency_overrides[current_active_user] = lambda: None
+        await app.router.startup()
+        try:
+            requests = scenarios(dataset, ids)
+            async with AsyncClient(app=app, base_url="http://bench") as client:
+                for name in args.scenarios:
+                    await drive(client, requests[name], args.warmup, args.concurrency, args.seed)
+                    result = await drive(client, requests[name], args.requests, args.concurrency, args.seed)
+                    result = {"size": size, "scenario": name, "concurrency": args.concurrency, **result}
+                    print(json.dumps(result), file=sys.stderr)
+                    results.append(result)
+        finally:
+            await app.router.shutdown()
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": {
+            "SPATIAL_INDEX_ENABLED": settings.SPATIAL_INDEX_ENABLED,
+            "SPATIAL_EXECUTOR": settings.SPATIAL_EXECUTOR,
+            "DB_POOL_SIZE": settings.DB_POOL_SIZE,
+            "CHARGE_POINT_CACHE_SIZE": settings.CHARGE_POINT_CACHE_SIZE,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--yes", action="store_true", help="confirm charge_point may be truncated")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="per scenario and size")
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_load.json")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error(f"this truncates charge_point in database {settings.POSTGRES_DB!r}, pass --yes")
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.scenarios = args.scenarios.split(",")
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(bench(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
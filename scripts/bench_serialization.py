@@ -0,0 +1,75 @@
+"""Benchmark per-request CPU of serializing a page of charge points.
+
+Compares the previous path (`from_orm`, `ChargePointSchemaOut(**cp.dict())`, FastAPI's
+`response_model` validation, `jsonable_encoder` and `json.dumps`) with rendering rows
+straight to JSON bytes through `charge_point_out` and `ORJSONResponse`, and with the
+columnar MessagePack encoding sent for `Accept: application/x-msgpack`.
+
+Usage: python -m scripts.bench_serialization [--items 100] [--requests 2000]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import namedtuple
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.api.responses import charge_point_out
+from app.bulk.columnar import decode_charge_points, encode_charge_points
+from app.schemas.charge_point import ChargePointSchema, ChargePointSchemaOut
+
+Row = namedtuple("Row", ["id", "lat", "lng", "location", "revision"])
+
+
+async def previous(rows, field) -> bytes:
+    charge_points = [ChargePointSchema.from_orm(row) for row in rows]
+    content = [ChargePointSchemaOut(**cp.dict()) for cp in charge_points]
+    content = await serialize_response(field=field, response_content=content)
+    return json.dumps(jsonable_encoder(content)).encode()
+
+
+async def current(rows, field) -> bytes:
+    return ORJSONResponse([charge_point_out(row) for row in rows]).body
+
+
+async def columnar(rows, field) -> bytes:
+    return encode_charge_points(rows)
+
+
+async def bench(items: int, requests: int) -> None:
+    rows = [
+        Row(uuid.uuid4(), random.uniform(-90, 90), random.uniform(-180, 180), f"Charge Point {i}", i)
+        for i in range(items)
+    ]
+    field = create_response_field(name="response", type_=List[ChargePointSchemaOut])
+    assert json.loads(await previous(rows, field)) == json.loads(await current(rows, field))
+    assert list(decode_charge_points(await columnar(rows, field))) == [
+        {"id": r.id, "lat": r.lat, "lng": r.lng, "location": r.location} for r in rows
+    ]
+    for name, fn in (("previous", previous), ("orjson", current), ("columnar", columnar)):
+        size = len(await fn(rows, field))
+        start = time.process_time()
+        for _ in range(requests):
+            await fn(rows, field)
+        per_request = (time.process_time() - start) / requests
+        print(f"{name:>9}: {per_request * 1e6:9.1f} us CPU per request of {items} items, {size} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    random.seed(0)
+    asyncio.run(bench(args.items, args.requests))
+
+
+if __name__ == "__main__":
+    main()
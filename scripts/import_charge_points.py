@@ -0,0 +1,39 @@
+"""Bulk import charge points from a CSV or NDJSON file.
+
+Usage: python -m scripts.import_charge_points points.csv [--format csv|ndjson] [--chunk-size 5000]
+"""
+import argparse
+import asyncio
+import time
+
+from app.bulk.importer import CHUNK_SIZE, CSV, FORMATS, NDJSON, ChargePointImporter, iter_lines
+from app.db.session import async_session
+
+
+async def read_file(path: str, block_size: int = 1 << 20):
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+async def main(path: str, fmt: str, chunk_size: int) -> None:
+    start = time.perf_counter()
+    async with async_session() as session:
+        importer = ChargePointImporter(session, fmt, chunk_size=chunk_size)
+        report = await importer.run(iter_lines(read_file(path)))
+    elapsed = time.perf_counter() - start
+    print(report.json(indent=2))
+    print(f"{report.created} created, {report.failed} failed in {elapsed:.2f}s ({report.created / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    fmt = args.format or (NDJSON if args.path.endswith((".ndjson", ".jsonl")) else CSV)
+    asyncio.run(main(args.path, fmt, args.chunk_size))